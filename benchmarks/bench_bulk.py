@@ -0,0 +1,172 @@
+"""Выгрузка, загрузка и резервная копия на большой базе.
+
+Выгрузка и загрузка идут потоком: пиковая память (tracemalloc) не должна
+расти с размером таблицы. Загрузку прерывают посередине и запускают
+снова — она продолжается с места обрыва; повторы из файла пропускаются.
+Копия снимается, пока писатель непрерывно вставляет строки, и
+сравнивается задержка записи до и во время копирования.
+
+Запуск: python benchmarks/bench_bulk.py [--ads 100000] [--reposts 1000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup  # noqa: E402
+import bulk  # noqa: E402
+import search  # noqa: E402
+from bench_dedup import generate, repost  # noqa: E402
+from database import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+
+class Interrupted(Exception):
+    pass
+
+
+def open_db(path):
+    db = Database(path, functions=search.SQL_FUNCTIONS)
+    migrate(db)
+    return db
+
+
+def write_source(path, rnd, count, reposts):
+    """Файл объявлений из другого канала: count новых и reposts повторов из них же"""
+    ads = []
+    with open(path, 'w', encoding='utf-8') as out:
+        for number in range(count + reposts):
+            if number >= count:
+                title, description = repost(rnd, *rnd.choice(ads))
+            else:
+                title, description = generate(rnd)
+                ads.append((title, description))
+            record = {'user_id': rnd.randint(1, 5000), 'title': title, 'description': description,
+                      'price': rnd.randint(100, 50000), 'category': '⚽ Другое', 'status': 'approved'}
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def write_users(path, count):
+    with open(path, 'w', encoding='utf-8') as out:
+        for user_id in range(1, count + 1):
+            out.write(json.dumps({'user_id': user_id, 'username': f'user{user_id}', 'first_name': 'Имя'}) + '\n')
+
+
+def measured(fn):
+    """(результат, секунд, пик памяти МБ); время — отдельным прогоном без tracemalloc"""
+    started = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, peak / 2**20
+
+
+async def import_with_break(db, path, break_after):
+    """Загрузка, прерванная после break_after пачек, и её продолжение"""
+    chunks = 0
+
+    def on_chunk(ads):
+        nonlocal chunks
+        chunks += 1
+        if chunks == break_after:
+            raise Interrupted
+
+    try:
+        await bulk.import_file(db, 'ads', path, on_chunk=on_chunk, pause=0)
+    except Interrupted:
+        pass
+    return await bulk.import_file(db, 'ads', path, pause=0)
+
+
+_user_ids = iter(range(10_000_000, 20_000_000))
+
+
+async def write_latencies(db, seconds):
+    """Задержки записей, как у register_user, в течение seconds"""
+    latencies = []
+    stop = time.perf_counter() + seconds
+    while time.perf_counter() < stop:
+        started = time.perf_counter()
+        await db.execute("INSERT INTO users (user_id, first_name) VALUES (?, 'Имя')", (next(_user_ids),))
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.002)
+    return latencies
+
+
+async def backup_under_load(db, path, target_dir):
+    baseline = await write_latencies(db, 1.0)
+    copier = backup.OnlineBackup(path, target_dir)
+    started = time.perf_counter()
+    task = asyncio.create_task(copier.run())
+    during = []
+    while not task.done():
+        during += await write_latencies(db, 0.2)
+    copy_path = await task
+    return time.perf_counter() - started, copy_path, baseline, during
+
+
+def p99(values):
+    values = sorted(values)
+    return values[int(len(values) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ads', type=int, default=100000)
+    parser.add_argument('--reposts', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'channel.jsonl')
+        write_source(source, random.Random(0), args.ads, args.reposts)
+        users = os.path.join(tmp, 'users.jsonl')
+        write_users(users, 5000)
+
+        path = os.path.join(tmp, 'bulk.db')
+        db = open_db(path)
+        result = asyncio.run(bulk.import_file(db, 'users', users, pause=0))
+        print(f'загрузка пользователей: добавлено {result["imported"]}')
+        # Загрузка с обрывом на середине
+        started = time.perf_counter()
+        result = asyncio.run(import_with_break(db, source, args.ads // bulk.IMPORT_CHUNK // 2))
+        seconds = time.perf_counter() - started
+        total = args.ads + args.reposts
+        print(f'загрузка: {total} записей за {seconds:.1f} с ({total / seconds:.0f}/с), '
+              f'продолжена с записи {result["resumed_from"]}, добавлено {result["imported"]}, '
+              f'пропущено {result["skipped"]} (повторов в файле {args.reposts})')
+
+        for table, fmt in (('ads', 'jsonl'), ('ads', 'csv'), ('users', 'csv')):
+            target = os.path.join(tmp, f'{table}.{fmt}.gz')
+            count, seconds, peak = measured(lambda: asyncio.run(bulk.export_file(db, table, target, fmt)))
+            print(f'выгрузка {table}.{fmt}.gz: {count} строк за {seconds:.2f} с, '
+                  f'{os.path.getsize(target) / 2**20:.1f} МБ, пик памяти {peak:.2f} МБ')
+
+        export = os.path.join(tmp, 'ads.jsonl.gz')
+        restored = open_db(os.path.join(tmp, 'restored.db'))
+        started = time.perf_counter()
+        result = asyncio.run(bulk.import_file(restored, 'ads', export, pause=0))
+        seconds = time.perf_counter() - started
+        print(f'восстановление из выгрузки: добавлено {result["imported"]} за {seconds:.1f} с '
+              f'({result["imported"] / seconds:.0f}/с)')
+        restored.close()
+
+        seconds, copy_path, baseline, during = asyncio.run(backup_under_load(db, path, os.path.join(tmp, 'backups')))
+        print(f'копия {os.path.getsize(copy_path) / 2**20:.1f} МБ за {seconds:.2f} с под записью; '
+              f'задержка записи до: сред {statistics.mean(baseline):.2f} мс, p99 {p99(baseline):.2f} мс; '
+              f'во время: сред {statistics.mean(during):.2f} мс, p99 {p99(during):.2f} мс, записей {len(during)}')
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Пропускная способность обработчиков: sqlite3.connect в event loop против Database.
+
+Запуск: python benchmarks/bench_db.py [--users 500] [--latency 0.02]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from main import FleaMarketBot  # noqa: E402
+from outbound import OutboundQueue  # noqa: E402
+
+WORDS = ['велосипед', 'коляска', 'куртка', 'телефон', 'диван', 'книга', 'ботинки', 'стол']
+
+
+class BlockingDatabase:
+    """Прежнее поведение: новое соединение и блокирующий запрос на каждый вызов."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def _call(self, fn):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        for name, function in search.SQL_FUNCTIONS.items():
+            conn.create_function(name, 1, function, deterministic=True)
+        try:
+            result = fn(conn)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
+
+    def run_read(self, fn, *args):
+        return self._call(lambda conn: fn(conn, *args))
+
+    def run_write(self, fn, *args):
+        return self._call(lambda conn: fn(conn, *args))
+
+    def run_autocommit(self, fn, *args):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            return fn(conn, *args)
+        finally:
+            conn.close()
+
+    async def read(self, fn, *args):
+        return self._call(lambda conn: fn(conn, *args))
+
+    async def write(self, fn, *args):
+        return self._call(lambda conn: fn(conn, *args))
+
+    async def fetchone(self, sql, params=()):
+        return self._call(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return self._call(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        return self._call(lambda conn: conn.execute(sql, params).lastrowid)
+
+
+class LegacyBot(FleaMarketBot):
+    """Бот с прежним доступом к базе: все компоненты строит FleaMarketBot, база — BlockingDatabase"""
+
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        # Прежняя регистрация пишет в базу сразу, без кеша пользователей
+        self.users = None
+
+    def open_database(self, db_path):
+        return BlockingDatabase(db_path)
+
+    async def register_user(self, user_id, username, first_name, last_name):
+        await self.db.execute('''
+            INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, username, first_name, last_name))
+
+
+def make_update(user_id, text, latency):
+    async def network(*args, **kwargs):
+        await asyncio.sleep(latency)
+
+    user = SimpleNamespace(id=user_id, username=f'user{user_id}', first_name='Имя', last_name=None)
+    message = SimpleNamespace(text=text, reply_text=network, photo=None)
+    update = SimpleNamespace(effective_user=user, effective_chat=SimpleNamespace(id=user_id), message=message)
+    return update, network
+
+
+async def simulate_user(bot, user_id, latency, user_data, counter):
+    rnd = random.Random(user_id)
+    update, network = make_update(user_id, '/start', latency)
+    context = SimpleNamespace(user_data=user_data, bot=SimpleNamespace(send_message=network, send_photo=network))
+
+    await bot.start(update, context)
+    counter[0] += 1
+
+    user_data['creating_ad'] = True
+    user_data['ad_data'] = {
+        'title': f'{rnd.choice(WORDS)} {user_id}',
+        'description': ' '.join(rnd.choice(WORDS) for _ in range(8)),
+        'price': rnd.randint(100, 10000),
+        'category': '⚽ Другое',
+        'photo': None,
+    }
+    await bot.save_ad(update, context)
+    counter[0] += 1
+
+    await bot.my_ads(update, context)
+    counter[0] += 1
+
+    update.message.text = rnd.choice(WORDS)
+    await bot.search_ads(update, context)
+    counter[0] += 1
+
+
+async def watch_loop_lag(lags, interval=0.005):
+    """Насколько event loop опаздывает разбудить соседний чат."""
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def run(bot, users, latency):
+    async def network(*args, **kwargs):
+        await asyncio.sleep(latency)
+
+    # Лимиты Telegram здесь не измеряются: очередь отправляет без ограничений
+    bot.outbox = OutboundQueue(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    bot.outbox.start(SimpleNamespace(send_message=network, send_photo=network, send_media_group=network))
+    if bot.users is not None:
+        bot.users.start()
+    counter = [0]
+    lags = []
+    watcher = asyncio.create_task(watch_loop_lag(lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(simulate_user(bot, uid, latency, {}, counter) for uid in range(1, users + 1)))
+    elapsed = time.perf_counter() - started
+    watcher.cancel()
+    await bot.outbox.stop()
+    if bot.users is not None:
+        await bot.users.stop()
+    return counter[0], elapsed, max(lags, default=0.0)
+
+
+def seed(path, ads):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT,
+            last_name TEXT, registered_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+        CREATE TABLE IF NOT EXISTS ads (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER,
+            title TEXT NOT NULL, description TEXT, price REAL, category TEXT, photo_id TEXT,
+            status TEXT DEFAULT 'pending', created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+    ''')
+    rnd = random.Random(0)
+    conn.executemany(
+        "INSERT INTO ads (user_id, title, description, price, category, status) VALUES (?, ?, ?, ?, ?, 'approved')",
+        ((rnd.randint(1, 1000), rnd.choice(WORDS), ' '.join(rnd.choice(WORDS) for _ in range(8)),
+          rnd.randint(100, 10000), '⚽ Другое') for _ in range(ads)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--ads', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.02, help='имитация сетевой задержки Bot API, с')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for name, factory in (('legacy', LegacyBot), ('database', FleaMarketBot)):
+            path = os.path.join(tmp, f'{name}.db')
+            seed(path, args.ads)
+            bot = factory(path)
+            calls, elapsed, max_lag = asyncio.run(run(bot, args.users, args.latency))
+            if hasattr(bot.db, 'close'):
+                bot.db.close()
+            results[name] = calls / elapsed
+            print(f'{name:>9}: {calls} вызовов за {elapsed:.2f} с — {calls / elapsed:.0f} вызовов/с, '
+                  f'макс. задержка event loop {max_lag * 1000:.0f} мс')
+        print(f'ускорение: x{results["database"] / results["legacy"]:.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Поиск повторов объявлений: LSH по MinHash (в памяти и в SQLite) против перебора сигнатур.
+
+Запросы — слегка изменённые копии объявлений корпуса (переставлены знаки,
+регистр, добавлено или убрано слово) и новые объявления.
+
+Запуск: python benchmarks/bench_dedup.py [--sizes 10000,50000,100000] [--queries 200]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dedup  # noqa: E402
+from bench_search import ADJECTIVES, FILLER, NOUNS  # noqa: E402
+
+BRANDS = [f'brand{i}' for i in range(2000)]
+EXTRA = ['срочно', 'торг', 'недорого', 'самовывоз', 'доставка', 'обмен']
+
+signatures = {}  # ad_id -> сигнатура корпуса
+
+
+def generate(rnd):
+    title = f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)} {rnd.choice(BRANDS)}'
+    description = ' '.join(rnd.choice(FILLER + NOUNS + BRANDS[:200]) for _ in range(rnd.randint(8, 20)))
+    return title, description
+
+
+def repost(rnd, title, description):
+    """Повтор, как его подаёт продавец: другой регистр, знаки, одно слово"""
+    words = description.split()
+    if rnd.random() < 0.5 and len(words) > 8:
+        words.pop(rnd.randrange(len(words)))
+    else:
+        words.append(rnd.choice(EXTRA))
+    return title.upper() + '!', ', '.join(words)
+
+
+def lsh_lookup(conn, sig):
+    keys = dedup.band_keys(sig)
+    placeholders = ','.join('?' * len(keys))
+    candidates = [row[0] for row in conn.execute(
+        f'SELECT DISTINCT ad_id FROM ad_lsh_bands WHERE band_key IN ({placeholders})', keys
+    )]
+    matches = []
+    for ad_id in candidates:
+        other = signatures[ad_id]
+        if dedup.similarity(sig, other) >= dedup.SIMILARITY_THRESHOLD:
+            matches.append(ad_id)
+    return matches
+
+
+def scan(sig):
+    return [ad_id for ad_id, other in signatures.items()
+            if dedup.similarity(sig, other) >= dedup.SIMILARITY_THRESHOLD]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,50000,100000')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--scan-queries', type=int, default=10, help='запросов для перебора (он медленный)')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    rnd = random.Random(0)
+    index = dedup.DuplicateIndex()
+    corpus = []
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'dedup.db'), isolation_level=None)
+        for statement in dedup.DEDUP_SCHEMA[:3]:
+            conn.execute(statement)
+
+        print(f'{"объявлений":>10} | {"сигнатура, мс":>13} | {"LSH память, мс":>14} | {"LSH SQLite, мс":>14} | '
+              f'{"перебор, мс":>11} | {"найдено повторов":>16} | {"ложных":>6}')
+        for size in sizes:
+            conn.execute('BEGIN')
+            while len(corpus) < size:
+                ad_id = len(corpus) + 1
+                title, description = generate(rnd)
+                sig = dedup.signature(title, description)
+                corpus.append((title, description))
+                signatures[ad_id] = sig
+                index.add(ad_id, 1, sig)
+                dedup.store(conn, ad_id, 1, sig)
+            conn.execute('COMMIT')
+
+            # Половина запросов — повторы, половина — новые объявления
+            texts = []
+            for i in range(args.queries):
+                if i % 2 == 0:
+                    source = rnd.randrange(len(corpus))
+                    texts.append((source + 1, repost(rnd, *corpus[source])))
+                else:
+                    texts.append((None, generate(rnd)))
+            started = time.perf_counter()
+            queries = [(source, dedup.signature(*text)) for source, text in texts]
+            sig_ms = (time.perf_counter() - started) / len(queries) * 1000
+
+            started = time.perf_counter()
+            found = false_hits = 0
+            for source, sig in queries:
+                matches = [ad_id for ad_id, _, _ in index.similar(sig)]
+                found += source is not None and source in matches
+                false_hits += source is None and bool(matches)
+            memory_ms = (time.perf_counter() - started) / len(queries) * 1000
+
+            started = time.perf_counter()
+            for _, sig in queries:
+                lsh_lookup(conn, sig)
+            sqlite_ms = (time.perf_counter() - started) / len(queries) * 1000
+
+            started = time.perf_counter()
+            for _, sig in queries[:args.scan_queries]:
+                scan(sig)
+            scan_ms = (time.perf_counter() - started) / args.scan_queries * 1000
+
+            print(f'{size:>10} | {sig_ms:>13.3f} | {memory_ms:>14.3f} | {sqlite_ms:>14.3f} | {scan_ms:>11.1f} | '
+                  f'{found:>7} из {args.queries // 2:<6} | {false_hits:>6}')
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Флуд-контроль: сколько апдейтов флудеров доходит до базы, как долго ждут
+остальные и сколько стоит отброшенный апдейт.
+
+Обычные пользователи присылают по несколько сообщений, флудеры — сотни
+/start и сообщений подряд; всё приходит разом, как после простоя.
+Апдейты идут через PerUserUpdateProcessor, как в Application, обработчик
+пишет в SQLite, как register_user и шаги мастера. Флуд-контроль сравнивается в двух местах:
+в обработчике (прежний TypeHandler в группе -1, уже со слотом) и в
+обработчике апдейтов до очереди пользователя и слота.
+
+Запуск: python benchmarks/bench_floodcontrol.py [--users 1000] [--flooders 20] [--flood 300] [--slots 64]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot, Update  # noqa: E402
+
+from database import Database  # noqa: E402
+from floodcontrol import FloodControl  # noqa: E402
+from migrations import migrate  # noqa: E402
+from updates import PerUserUpdateProcessor  # noqa: E402
+import search  # noqa: E402
+
+
+def make_update(bot, update_id, user_id, text):
+    user = {'id': user_id, 'is_bot': False, 'first_name': 'Имя'}
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text, 'from': user,
+            'chat': {'id': user_id, 'type': 'private'},
+        },
+    }, bot)
+
+
+def traffic(rnd, bot, users, flooders, flood):
+    """Перемешанные апдейты: у обычных пользователей 2–8 сообщений, у флудеров flood команд и сообщений"""
+    updates = []
+    for user_id in range(1, users + 1):
+        updates += [(user_id, rnd.choice(['/start', 'велосипед', 'Детская коляска'])) for _ in range(rnd.randint(2, 8))]
+    for user_id in range(users + 1, users + flooders + 1):
+        updates += [(user_id, rnd.choice(['/start', 'велосипед'])) for _ in range(flood)]
+    rnd.shuffle(updates)
+    return [make_update(bot, number, user_id, text) for number, (user_id, text) in enumerate(updates, 1)]
+
+
+async def run(db, updates, slots, users, flood=None, in_handler=False):
+    """Все апдейты разом через обработчик апдейтов; (секунд, записей в БД, задержки обычных пользователей, с)"""
+    writes = 0
+    latencies = []
+
+    async def handle(update, submitted):
+        nonlocal writes
+        if in_handler:
+            # Как TypeHandler в группе -1: решение и ожидание уже внутри слота
+            delay = flood.admit(update)
+            if delay is None:
+                return
+            await asyncio.sleep(delay)
+        user = update.effective_user
+        await db.execute(
+            'INSERT OR REPLACE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            (user.id, None, user.first_name)
+        )
+        writes += 1
+        if user.id <= users:
+            latencies.append(time.perf_counter() - submitted)
+
+    admission = flood.admit if flood is not None and not in_handler else None
+    processor = PerUserUpdateProcessor(slots, admission=admission)
+    started = time.perf_counter()
+    await asyncio.gather(*(processor.process_update(update, handle(update, started)) for update in updates))
+    return time.perf_counter() - started, writes, latencies
+
+
+async def rejected_cost(count):
+    """Время одного отброшенного апдейта в обработчике апдейтов"""
+    flood = FloodControl()
+    processor = PerUserUpdateProcessor(admission=flood.admit)
+    bot = Bot('123:bench')
+    update = make_update(bot, 1, 1, '/start')
+    while flood.admit(update) is not None:
+        pass
+
+    async def handle():
+        pass
+
+    started = time.perf_counter()
+    for _ in range(count):
+        await processor.process_update(update, handle())
+    assert flood.dropped > count
+    return (time.perf_counter() - started) / count
+
+
+def p99(values):
+    values = sorted(values)
+    return values[int(len(values) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--flooders', type=int, default=20)
+    parser.add_argument('--flood', type=int, default=300, help='апдейтов от каждого флудера')
+    parser.add_argument('--slots', type=int, default=64, help='апдейтов одновременно')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = Database(os.path.join(tmp, 'flood.db'), functions=search.SQL_FUNCTIONS)
+        migrate(db)
+        bot = Bot('123:bench')
+        updates = traffic(random.Random(0), bot, args.users, args.flooders, args.flood)
+        flood_total = args.flooders * args.flood
+        print(f'{len(updates)} апдейтов, из них {flood_total} от {args.flooders} флудеров, слотов {args.slots}')
+        print(f'{"":>22} | {"время, с":>8} | {"записей в БД":>12} | {"ожидание обычных: сред, с":>25} | {"p99, с":>6}')
+        for name, flood, in_handler in (('без контроля', None, False),
+                                        ('в обработчике', FloodControl(), True),
+                                        ('до очереди и слота', FloodControl(), False)):
+            seconds, writes, latencies = asyncio.run(run(db, updates, args.slots, args.users, flood, in_handler))
+            print(f'{name:>22} | {seconds:>8.2f} | {writes:>12} | {statistics.mean(latencies):>25.3f} | '
+                  f'{p99(latencies):>6.3f}')
+            if flood is not None:
+                print(f'{"":>22}   {flood.stats()}')
+        db.close()
+    print(f'отброшенный апдейт: {asyncio.run(rejected_cost(100000)) * 1e6:.2f} мкс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Стоимость сброса состояния диалогов и время восстановления после перезапуска.
+
+Запуск: python benchmarks/bench_persistence.py [--conversations 5000] [--rounds 5]
+"""
+import argparse
+import asyncio
+import copy
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database  # noqa: E402
+from migrations import migrate  # noqa: E402
+from persistence import SQLitePersistence  # noqa: E402
+import search  # noqa: E402
+
+
+def wizard_state(rnd):
+    """user_data пользователя посреди создания объявления"""
+    ad_data = {'title': 'Детский велосипед', 'description': 'Почти новый, катались одно лето. ' * rnd.randint(1, 4)}
+    if rnd.random() < 0.5:
+        ad_data['price'] = float(rnd.randint(100, 20000))
+        ad_data['category'] = '🎮 Хобби'
+    return {'creating_ad': True, 'ad_data': ad_data, 'search': {'query': '"велосипед"', 'now': 2460000.5}}
+
+
+async def watch_loop_lag(lags, interval=0.001):
+    while True:
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - expected)
+
+
+async def flush_rounds(persistence, conversations, rounds):
+    rnd = random.Random(0)
+    states = {user_id: wizard_state(rnd) for user_id in range(1, conversations + 1)}
+    lags = []
+    watcher = asyncio.create_task(watch_loop_lag(lags))
+    enqueue = flush = 0.0
+    for _ in range(rounds):
+        # Как Application.update_persistence: копии данных, затем пачка update_*
+        batch = copy.deepcopy(states)
+        started = time.perf_counter()
+        await asyncio.gather(*(persistence.update_user_data(user_id, data) for user_id, data in batch.items()))
+        enqueue += time.perf_counter() - started
+        started = time.perf_counter()
+        await persistence.flush()
+        flush += time.perf_counter() - started
+    watcher.cancel()
+    return enqueue / rounds, flush / rounds, max(lags, default=0.0)
+
+
+async def recover(path):
+    db = Database(path, functions=search.SQL_FUNCTIONS)
+    started = time.perf_counter()
+    user_data = await SQLitePersistence(db).get_user_data()
+    elapsed = time.perf_counter() - started
+    db.close()
+    return len(user_data), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'persistence.db')
+        db = Database(path, functions=search.SQL_FUNCTIONS)
+        migrate(db)
+        enqueue, flush, max_lag = asyncio.run(flush_rounds(SQLitePersistence(db), args.conversations, args.rounds))
+        db.close()
+        restored, recovery = asyncio.run(recover(path))
+
+        print(f'диалогов: {args.conversations}')
+        print(f'update_* на пачку: {enqueue * 1000:.1f} мс ({enqueue / args.conversations * 1e6:.1f} мкс на диалог)')
+        print(f'сброс пачки в SQLite: {flush * 1000:.1f} мс, макс. задержка event loop {max_lag * 1000:.1f} мс')
+        print(f'восстановление: {restored} диалогов за {recovery * 1000:.1f} мс')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Проверка нового объявления по сохранённым поискам: перколятор против полного перебора.
+
+Запуск: python benchmarks/bench_savedsearch.py [--subscriptions 100000] [--ads 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from savedsearch import SavedSearchIndex  # noqa: E402
+
+NOUNS = ['велосипед', 'коляска', 'куртка', 'телефон', 'диван', 'книга', 'ботинки', 'стол', 'шкаф', 'самокат',
+         'ноутбук', 'пальто', 'кроссовки', 'санки', 'лыжи', 'кресло', 'холодильник', 'чайник', 'гитара', 'планшет']
+ADJECTIVES = ['детский', 'новый', 'старый', 'зимний', 'кожаный', 'синий', 'большой', 'удобный', 'складной']
+FILLER = ['продаю', 'состояние', 'отличное', 'торг', 'самовывоз', 'срочно', 'недорого', 'почти', 'без', 'дефектов']
+# Марки/модели дают реалистичный длинный хвост словаря подписок
+BRANDS = [f'brand{i}' for i in range(2000)]
+CATEGORIES = ['👕 Одежда', '👟 Обувь', '📱 Электроника', '🏠 Для дома', '🎮 Хобби', '📚 Книги', '🚗 Авто', '⚽ Другое']
+
+
+def subscriptions(rnd, count):
+    for sub_id in range(1, count + 1):
+        words = [rnd.choice(NOUNS), rnd.choice(BRANDS)] if rnd.random() < 0.9 else []
+        if words and rnd.random() < 0.3:
+            words.insert(0, rnd.choice(ADJECTIVES))
+        query = ' '.join(words)
+        category = rnd.choice(CATEGORIES) if not words or rnd.random() < 0.2 else None
+        max_price = rnd.choice([None, 1000, 5000, 20000])
+        yield sub_id, rnd.randint(1, count // 5), query, search.terms(query), category, None, max_price
+
+
+def ads(rnd, count):
+    for _ in range(count):
+        title = f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)} {rnd.choice(BRANDS)}'
+        description = ' '.join(rnd.choice(FILLER + NOUNS) for _ in range(12))
+        yield title, description, rnd.choice(CATEGORIES), rnd.randint(100, 50000)
+
+
+def scan(subs, title, description, category, price):
+    """Наивная проверка: каждое объявление против каждой подписки"""
+    ad_terms = set(search.terms(f'{title} {description} {category}'))
+    return [sub_id for sub_id, _, _, terms, sub_category, _, max_price in subs
+            if set(terms) <= ad_terms
+            and (sub_category is None or sub_category == category)
+            and (max_price is None or price <= max_price)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--subscriptions', type=int, default=100000)
+    parser.add_argument('--ads', type=int, default=2000)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    subs = list(subscriptions(rnd, args.subscriptions))
+    index = SavedSearchIndex()
+    for sub in subs:
+        index.add(*sub)
+    sample = list(ads(rnd, args.ads))
+
+    started = time.perf_counter()
+    matched = sum(len(index.match(*ad)) for ad in sample)
+    index_ms = (time.perf_counter() - started) / len(sample) * 1000
+
+    scanned = sample[:max(1, len(sample) // 100)]
+    started = time.perf_counter()
+    for ad in scanned:
+        assert sorted(scan(subs, *ad)) == sorted(sub_id for sub_id, _, _ in index.match(*ad))
+    scan_ms = (time.perf_counter() - started) / len(scanned) * 1000
+
+    print(f'подписок: {args.subscriptions}, объявлений: {len(sample)}, совпадений в среднем: {matched / len(sample):.1f}')
+    print(f'перколятор: {index_ms:.3f} мс на объявление')
+    print(f'перебор:    {scan_ms:.3f} мс на объявление')
+
+
+if __name__ == '__main__':
+    main()
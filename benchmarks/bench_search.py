@@ -0,0 +1,88 @@
+"""Задержка поиска: LIKE с ведущим % против FTS5 по мере роста таблицы ads.
+
+Запуск: python benchmarks/bench_search.py [--sizes 10000,100000,300000]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from main import FleaMarketBot  # noqa: E402
+
+NOUNS = ['велосипед', 'коляска', 'куртка', 'телефон', 'диван', 'книга', 'ботинки', 'стол', 'шкаф', 'самокат',
+         'ноутбук', 'пальто', 'кроссовки', 'санки', 'лыжи', 'кресло', 'холодильник', 'чайник', 'гитара', 'планшет']
+ADJECTIVES = ['детский', 'новый', 'старый', 'зимний', 'кожаный', 'синий', 'большой', 'удобный', 'складной']
+FILLER = ['продаю', 'состояние', 'отличное', 'торг', 'самовывоз', 'срочно', 'недорого', 'почти', 'без', 'дефектов']
+CATEGORIES = ['👕 Одежда', '👟 Обувь', '📱 Электроника', '🏠 Для дома', '🎮 Хобби', '📚 Книги', '🚗 Авто', '⚽ Другое']
+QUERIES = ['велосипед', 'куртку', 'детская коляска', 'зимние ботинки', 'гитару', 'электроника', 'кожаное кресло']
+
+LIKE_SQL = '''
+    SELECT a.id, a.title, a.description, a.price, a.category, a.photo_id,
+           u.username, u.first_name, a.created_at
+    FROM ads a
+    JOIN users u ON a.user_id = u.user_id
+    WHERE a.status = 'approved'
+    AND (a.title LIKE ? OR a.description LIKE ? OR a.category LIKE ?)
+    ORDER BY a.created_at DESC
+    LIMIT 20
+'''
+
+
+def generate(rnd, count, start_id):
+    for ad_id in range(start_id, start_id + count):
+        title = f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}'
+        description = ' '.join(rnd.choice(FILLER + NOUNS) for _ in range(12))
+        yield (rnd.randint(1, 5000), title, description, rnd.randint(100, 50000), rnd.choice(CATEGORIES),
+               f'2025-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d} 12:00:00')
+
+
+def fill(conn, rows):
+    conn.executemany('''
+        INSERT INTO ads (user_id, title, description, price, category, status, created_at)
+        VALUES (?, ?, ?, ?, ?, 'approved', ?)
+    ''', rows)
+
+
+def measure(conn, sql, params, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,300000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    rnd = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = FleaMarketBot(os.path.join(tmp, 'search.db'))
+        bot.db.run_write(lambda conn: conn.executemany(
+            'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            ((uid, f'user{uid}', 'Имя') for uid in range(1, 5001)),
+        ))
+
+        total = 0
+        print(f'{"объявлений":>10} | {"LIKE, мс":>9} | {"FTS5, мс":>9}')
+        for size in sizes:
+            bot.db.run_write(fill, generate(rnd, size - total, total + 1))
+            total = size
+            like_ms = fts_ms = 0.0
+            for text in QUERIES:
+                like_ms += bot.db._read(measure, LIKE_SQL, (f'%{text}%',) * 3, args.repeat)
+                params = (search.build_match_query(text), search.julian_now(), *search.SEARCH_FIRST_ANCHOR, 20)
+                fts_ms += bot.db._read(measure, search.SEARCH_NEXT_SQL, params, args.repeat)
+            print(f'{size:>10} | {like_ms / len(QUERIES):>9.2f} | {fts_ms / len(QUERIES):>9.2f}')
+        bot.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Кеш поисковой выдачи: задержка и доля попаданий на запросах с распределением Ципфа.
+
+Популярность запросов на барахолке сильно перекошена: несколько запросов
+(«велосипед», «коляска») составляют большую часть поиска. Пока идёт
+поиск, модератор публикует и отклоняет объявления, и каждое событие
+сбрасывает затронутые страницы кеша.
+
+Запуск: python benchmarks/bench_searchcache.py [--ads 100000] [--searches 5000] [--zipf 1.1]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search  # noqa: E402
+from bench_search import ADJECTIVES, CATEGORIES, NOUNS, fill, generate  # noqa: E402
+from main import FleaMarketBot  # noqa: E402
+from searchcache import SearchCache  # noqa: E402
+
+
+def vocabulary():
+    """Около 200 разных запросов: существительные, пары «прилагательное + существительное», категории"""
+    queries = list(NOUNS)
+    queries += [f'{adjective} {noun}' for adjective in ADJECTIVES for noun in NOUNS]
+    queries += [category.split(' ', 1)[1] for category in CATEGORIES]
+    return queries[:200]
+
+
+def zipf_weights(count, s):
+    return [1 / (rank ** s) for rank in range(1, count + 1)]
+
+
+async def run(bot, rnd, queries, weights, args):
+    """Поиски с листанием; каждые moderate_every поисков — событие модерации"""
+    latencies = []
+
+    async def moderate():
+        # Новое объявление публикуется, одно из опубликованных отклоняется
+        title = f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}'
+        ad_id = await bot.db.execute('''
+            INSERT INTO ads (user_id, title, description, price, category, status)
+            VALUES (?, ?, ?, ?, ?, 'approved')
+        ''', (rnd.randint(1, 5000), title, 'продаю срочно', rnd.randint(100, 50000), rnd.choice(CATEGORIES)))
+        bot.search_cache.invalidate_ad(ad_id, search.index_tokens(f'{title} продаю срочно'))
+        rejected = rnd.randint(1, args.ads)
+        await bot.db.execute("UPDATE ads SET status = 'rejected' WHERE id = ?", (rejected,))
+        bot.search_cache.invalidate_ad(rejected)
+
+    for number in range(args.searches):
+        if args.moderate_every and number and number % args.moderate_every == 0:
+            await moderate()
+
+        query = search.build_match_query(rnd.choices(queries, weights)[0])
+        state = {'query': query, 'now': bot.search_cache.reference_time(query, search.julian_now())}
+        direction = anchor = None
+        # Большинство смотрит первую страницу, часть листает дальше
+        for _ in range(1 + (rnd.random() < 0.3) + (rnd.random() < 0.1)):
+            started = time.perf_counter()
+            _, keys, _, _, has_next = await bot.search_page(state, direction, anchor)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if not has_next:
+                break
+            direction, anchor = 'next', keys[-1]
+    return latencies
+
+
+def report(name, latencies, seconds, cache):
+    stats = cache.stats()
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    print(f'{name:>10} | {statistics.mean(latencies):>8.3f} | {p95:>8.3f} | {len(latencies) / seconds:>9.0f} | '
+          f'{stats["hit_rate"]:>7.1%} | {stats["invalidations"]:>7}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ads', type=int, default=100000)
+    parser.add_argument('--searches', type=int, default=5000)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--moderate-every', type=int, default=50)
+    args = parser.parse_args()
+
+    queries = vocabulary()
+    weights = zipf_weights(len(queries), args.zipf)
+    with tempfile.TemporaryDirectory() as tmp:
+        bot = FleaMarketBot(os.path.join(tmp, 'searchcache.db'))
+        bot.db.run_write(lambda conn: conn.executemany(
+            'INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+            ((uid, f'user{uid}', 'Имя') for uid in range(1, 5001)),
+        ))
+        bot.db.run_write(fill, generate(random.Random(0), args.ads, 1))
+
+        print(f'{len(queries)} запросов, Ципф s={args.zipf}, модерация каждые {args.moderate_every} поисков')
+        print(f'{"":>10} | {"сред, мс":>8} | {"p95, мс":>8} | {"страниц/с":>9} | {"попад.":>7} | {"сбросов":>7}')
+        # Без кеша: ёмкость 0, каждая страница читается из базы
+        for name, cache in (('без кеша', SearchCache(capacity=0)), ('с кешем', SearchCache())):
+            bot.search_cache = cache
+            started = time.perf_counter()
+            latencies = asyncio.run(run(bot, random.Random(1), queries, weights, args))
+            report(name, latencies, time.perf_counter() - started, cache)
+        bot.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""Локальная замена Bot API для нагрузочных тестов: отвечает как Telegram и записывает каждый вызов.
+
+Бот подключается через ApplicationBuilder().base_url('http://127.0.0.1:8081/bot').
+Отдельный запуск: python benchmarks/fake_bot_api.py [--port 8081]
+  POST /_updates — поставить апдейт (JSON) в очередь getUpdates
+  GET  /_calls   — записанные вызовы
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FleaMarket', 'username': 'fleamarket_loadtest_bot'}
+
+
+def _decode(value):
+    # PTB передаёт сложные параметры (reply_markup, media) строками JSON
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return value
+
+
+class FakeBotAPI:
+    """Имитация методов Bot API, которые использует бот.
+
+    getUpdates отдаёт апдейты, поставленные через push_update, с long
+    polling; отправленные и отредактированные сообщения хранятся, чтобы
+    генератор нагрузки мог нажимать кнопки в ответах бота.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = []         # (время, метод, параметры)
+        self.messages = {}      # (chat_id, message_id) -> сообщение
+        self.history = {}       # chat_id -> [message_id] в порядке отправки
+        self._waiters = {}      # chat_id -> [(число сообщений, future)]
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._runner = None
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.dispatch)
+        self.app.router.add_post('/_updates', self.http_push_update)
+        self.app.router.add_get('/_calls', self.http_calls)
+
+    # --- Управление из теста ---
+
+    def push_update(self, update):
+        """Ставит апдейт в очередь getUpdates; возвращает update_id"""
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._new_updates.set()
+        return update['update_id']
+
+    def method_counts(self):
+        return dict(Counter(method for _, method, _ in self.calls))
+
+    async def wait_messages(self, chat_id, count):
+        """Ждёт, пока в чат уйдёт count сообщений; возвращает время последнего"""
+        if len(self.history.get(chat_id, ())) >= count:
+            return time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append((count, future))
+        return await future
+
+    def find_button(self, chat_id, prefix):
+        """Последнее сообщение чата с inline-кнопкой, чей callback_data начинается с prefix"""
+        for message_id in reversed(self.history.get(chat_id, ())):
+            message = self.messages[(chat_id, message_id)]
+            for row in message.get('reply_markup', {}).get('inline_keyboard', ()):
+                for button in row:
+                    if button.get('callback_data', '').startswith(prefix):
+                        return message, button['callback_data']
+        return None, None
+
+    async def start(self, host='127.0.0.1', port=8081):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # --- HTTP ---
+
+    async def http_push_update(self, request):
+        return web.json_response({'update_id': self.push_update(await request.json())})
+
+    async def http_calls(self, request):
+        return web.json_response([
+            {'at': at, 'method': method, 'params': params} for at, method, params in self.calls
+        ])
+
+    async def dispatch(self, request):
+        method = request.match_info['method']
+        params = {key: _decode(value) for key, value in (await request.post()).items()
+                  if isinstance(value, str)}
+        self.calls.append((time.perf_counter(), method, params))
+        if self.latency and method != 'getUpdates':
+            await asyncio.sleep(self.latency)
+        handler = getattr(self, f'api_{method}', None)
+        result = await handler(params) if handler is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    # --- Методы Bot API ---
+
+    def _message(self, chat_id, **fields):
+        message_id = next(self._message_ids)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **fields,
+        }
+        self.messages[(chat_id, message_id)] = message
+        history = self.history.setdefault(chat_id, [])
+        history.append(message_id)
+        waiters = self._waiters.get(chat_id)
+        if waiters:
+            now = time.perf_counter()
+            for count, future in [waiter for waiter in waiters if waiter[0] <= len(history)]:
+                waiters.remove((count, future))
+                if not future.done():
+                    future.set_result(now)
+            if not waiters:
+                del self._waiters[chat_id]
+        return message
+
+    @staticmethod
+    def _markup(params):
+        # В ответе Telegram сообщение содержит только inline-клавиатуру
+        markup = params.get('reply_markup')
+        return {'reply_markup': markup} if isinstance(markup, dict) and 'inline_keyboard' in markup else {}
+
+    async def api_getMe(self, params):
+        return BOT_USER
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit') or 100)]
+
+    async def api_sendMessage(self, params):
+        return self._message(int(params['chat_id']), text=params['text'], **self._markup(params))
+
+    async def api_sendPhoto(self, params):
+        photo = [{'file_id': str(params['photo']), 'file_unique_id': str(params['photo']), 'width': 800, 'height': 600}]
+        return self._message(int(params['chat_id']), photo=photo, caption=params.get('caption'), **self._markup(params))
+
+    async def api_sendMediaGroup(self, params):
+        chat_id = int(params['chat_id'])
+        return [
+            self._message(chat_id, photo=[{'file_id': item['media'], 'file_unique_id': item['media'],
+                                           'width': 800, 'height': 600}], caption=item.get('caption'))
+            for item in params['media']
+        ]
+
+    async def api_editMessageText(self, params):
+        message = self.messages.get((int(params['chat_id']), int(params['message_id'])))
+        if message is None:
+            return True
+        message['text'] = params['text']
+        message.pop('reply_markup', None)
+        message.update(self._markup(params))
+        return message
+
+    async def api_editMessageReplyMarkup(self, params):
+        message = self.messages.get((int(params['chat_id']), int(params['message_id'])))
+        if message is None:
+            return True
+        message.pop('reply_markup', None)
+        message.update(self._markup(params))
+        return message
+
+    async def api_answerCallbackQuery(self, params):
+        return True
+
+
+async def serve(port):
+    api = FakeBotAPI()
+    await api.start(port=port)
+    print(f'Fake Bot API: http://127.0.0.1:{port}/bot')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(json.dumps(api.method_counts(), ensure_ascii=False))
+        await api.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8081)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+"""Нагрузочный тест: тысячи пользователей проходят полные сценарии через локальную замену Bot API.
+
+Каждый пользователь: /start, мастер объявления (с фото или без), поиск с
+листанием и альбомом, «Мои объявления». Администратор параллельно
+разбирает очередь /moderate массовыми одобрениями и отклонениями.
+Бот работает как в проде: long polling, параллельные апдейты, хранилище.
+
+Запуск: python benchmarks/loadtest.py [--users 2000] [--concurrency 500] [--output loadtest.json]
+Результаты (p50/p95/p99 задержки апдейта, апдейтов/с, время в БД) пишутся в JSON,
+чтобы сравнивать прогоны на разных коммитах.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as bot_main  # noqa: E402
+import metrics  # noqa: E402
+from fake_bot_api import FakeBotAPI  # noqa: E402
+from outbound import OutboundQueue  # noqa: E402
+from updates import PerUserUpdateProcessor  # noqa: E402
+
+NOUNS = ['велосипед', 'коляска', 'куртка', 'телефон', 'диван', 'книга', 'ботинки', 'стол', 'шкаф', 'самокат',
+         'ноутбук', 'пальто', 'кроссовки', 'санки', 'лыжи', 'кресло', 'холодильник', 'чайник', 'гитара', 'планшет']
+ADJECTIVES = ['детский', 'новый', 'старый', 'зимний', 'кожаный', 'синий', 'большой', 'удобный', 'складной']
+FILLER = ['продаю', 'состояние', 'отличное', 'торг', 'самовывоз', 'срочно', 'недорого', 'почти', 'без', 'дефектов']
+FIRST_USER_ID = 10_000_000
+# Сколько ждать ответа, который бот отправляет через очередь исходящих, с
+REPLY_TIMEOUT = 30.0
+
+
+class TimedUpdateProcessor(PerUserUpdateProcessor):
+    """Сообщает генератору нагрузки, когда обработка апдейта закончилась или он выброшен"""
+
+    def __init__(self, max_concurrent_updates, profiler=None):
+        super().__init__(max_concurrent_updates, profiler)
+        self.done = {}  # update_id -> future
+
+    async def do_process_update(self, update, coroutine):
+        try:
+            await super().do_process_update(update, coroutine)
+        finally:
+            future = self.done.pop(getattr(update, 'update_id', None), None)
+            if future is not None and not future.done():
+                future.set_result(time.perf_counter())
+
+
+def time_database(db):
+    """Оборачивает выполнение запросов в потоках БД; возвращает {'read': [с], 'write': [с]}"""
+    timings = {'read': [], 'write': []}
+
+    def timed(kind, fn):
+        def wrapper(*args):
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                timings[kind].append(time.perf_counter() - started)
+        return wrapper
+
+    db._read = timed('read', db._read)
+    db._write = timed('write', db._write)
+    return timings
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def pick(q):
+        return round(values[min(len(values) - 1, int(q * len(values)))] * 1000, 2)
+
+    return {
+        'count': len(values), 'p50_ms': pick(0.50), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99),
+        'max_ms': round(values[-1] * 1000, 2), 'mean_ms': round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+class LoadGenerator:
+    def __init__(self, api, processor, think):
+        self.api = api
+        self.processor = processor
+        self.think = think
+        self.latencies = defaultdict(list)  # вид апдейта -> [с]
+        self.timeouts = 0
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': 'Тест', 'username': f'user{user_id}'}
+
+    async def _send(self, kind, chat_id, update, reply):
+        """Отправляет апдейт и ждёт конца обработки, а с reply — и ответа из очереди исходящих"""
+        expected = len(self.api.history.get(chat_id, ())) + 1
+        started = time.perf_counter()
+        update_id = self.api.push_update(update)
+        future = self.processor.done[update_id] = asyncio.get_running_loop().create_future()
+        finished = await future
+        if reply:
+            try:
+                finished = max(finished, await asyncio.wait_for(self.api.wait_messages(chat_id, expected), REPLY_TIMEOUT))
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return
+        self.latencies[kind].append(finished - started)
+
+    async def message(self, kind, user_id, text=None, photo=None, reply=False):
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+        }
+        if photo is not None:
+            message['photo'] = [{'file_id': photo, 'file_unique_id': photo, 'width': 800, 'height': 600}]
+        else:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        await self._send(kind, user_id, {'message': message}, reply)
+
+    async def press(self, kind, user_id, prefix, reply=False):
+        """Нажимает кнопку из последнего подходящего сообщения бота; False, если кнопки нет"""
+        message, data = self.api.find_button(user_id, prefix)
+        if message is None:
+            return False
+        await self._send(kind, user_id, {'callback_query': {
+            'id': str(next(self._callback_ids)),
+            'from': self.user(user_id),
+            'chat_instance': str(user_id),
+            'message': message,
+            'data': data,
+        }}, reply)
+        return True
+
+    async def pause(self, rnd):
+        if self.think:
+            await asyncio.sleep(rnd.uniform(0, self.think))
+
+    async def user_flow(self, user_id):
+        rnd = random.Random(user_id)
+        await self.message('start', user_id, '/start')
+        await self.pause(rnd)
+
+        await self.message('wizard', user_id, '📦 Добавить объявление')
+        noun = rnd.choice(NOUNS)
+        for text in (f'{rnd.choice(ADJECTIVES)} {noun}',
+                     ' '.join(rnd.choice(FILLER + NOUNS) for _ in range(12)),
+                     str(rnd.randint(100, 50000)),
+                     rnd.choice(bot_main.CATEGORIES)):
+            await self.pause(rnd)
+            await self.message('wizard', user_id, text)
+        await self.pause(rnd)
+        if rnd.random() < 0.3:
+            await self.message('wizard', user_id, photo=f'photo-{user_id}')
+        else:
+            await self.message('wizard', user_id, 'пропустить')
+        await self.pause(rnd)
+
+        await self.message('search', user_id, '🔍 Поиск объявлений')
+        await self.pause(rnd)
+        await self.message('search', user_id, rnd.choice([noun, rnd.choice(NOUNS), f'{rnd.choice(ADJECTIVES)} {noun}']),
+                           reply=True)
+        await self.pause(rnd)
+        if await self.press('page', user_id, 'page|sr|n|'):
+            await self.pause(rnd)
+        if rnd.random() < 0.2:
+            await self.press('photos', user_id, 'photos|', reply=True)
+            await self.pause(rnd)
+
+        await self.message('my_ads', user_id, '📋 Мои объявления', reply=True)
+        await self.pause(rnd)
+
+        await self.message('browse', user_id, '🗂 Каталог', reply=True)
+        if await self.press('browse', user_id, 'br|c|') and await self.press('browse', user_id, 'br|b|'):
+            await self.press('page', user_id, 'page|br|n|')
+
+    async def admin_flow(self, users_done, reject_share=0.2):
+        rnd = random.Random(0)
+        admin_id = bot_main.ADMIN_ID
+        while True:
+            finished = users_done.is_set()
+            await self.message('moderate', admin_id, '/moderate')
+            moderated = False
+            while True:
+                status = 'rejected' if rnd.random() < reject_share else 'approved'
+                if not await self.press('moderate_bulk', admin_id, f'mod|{status}|page'):
+                    break
+                moderated = True
+            if finished and not moderated:
+                return
+            if not moderated:
+                try:
+                    await asyncio.wait_for(users_done.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+
+
+def seed(db, count):
+    rnd = random.Random(0)
+    db.run_write(lambda conn: conn.executemany(
+        'INSERT OR IGNORE INTO users (user_id, username, first_name) VALUES (?, ?, ?)',
+        ((uid, f'seller{uid}', 'Продавец') for uid in range(1, 1001)),
+    ))
+    db.run_write(lambda conn: conn.executemany('''
+        INSERT INTO ads (user_id, title, description, price, category, status)
+        VALUES (?, ?, ?, ?, ?, 'approved')
+    ''', ((rnd.randint(1, 1000), f'{rnd.choice(ADJECTIVES)} {rnd.choice(NOUNS)}',
+           ' '.join(rnd.choice(FILLER + NOUNS) for _ in range(12)), rnd.randint(100, 50000),
+           rnd.choice(bot_main.CATEGORIES)) for _ in range(count))))
+
+
+def top_series(histogram, limit=10):
+    """Самые затратные серии гистограммы метрик по суммарному времени"""
+    series = sorted(histogram.snapshot().items(), key=lambda item: item[1][1], reverse=True)[:limit]
+    return [{'labels': list(labels), 'count': count, 'total_ms': round(total * 1000, 1),
+             'mean_ms': round(total / count * 1000, 3)} for labels, (count, total) in series]
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args, path):
+    api = FakeBotAPI(latency=args.api_latency)
+    await api.start(port=args.port)
+
+    bot = bot_main.FleaMarketBot(path)
+    seed(bot.db, args.seed_ads)
+    db_timings = time_database(bot.db)
+    if not args.telegram_limits:
+        # Лимиты Telegram здесь не измеряются: очередь отправляет без ограничений
+        bot.outbox = OutboundQueue(global_rate=1e9, chat_rate=1e9, chat_burst=1e9)
+    processor = TimedUpdateProcessor(args.concurrent_updates, metrics.profiler_from_env())
+    application = bot_main.build_application(
+        bot, token='1:LOADTEST', base_url=f'http://127.0.0.1:{args.port}/bot', update_processor=processor
+    )
+    generator = LoadGenerator(api, processor, args.think)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.updater.start_polling(poll_interval=0.0, timeout=5)
+    await application.start()
+
+    users_done = asyncio.Event()
+    admin = asyncio.create_task(generator.admin_flow(users_done))
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def limited(user_id):
+        async with slots:
+            await generator.user_flow(user_id)
+
+    db_before = {kind: len(values) for kind, values in db_timings.items()}
+    started = time.perf_counter()
+    await asyncio.gather(*(limited(FIRST_USER_ID + i) for i in range(args.users)))
+    users_elapsed = time.perf_counter() - started
+    users_done.set()
+    await admin
+    elapsed = time.perf_counter() - started
+
+    await application.updater.stop()
+    await application.stop()
+    await application.post_stop(application)
+    await application.shutdown()
+    await application.post_shutdown(application)
+    await api.stop()
+
+    all_latencies = [value for values in generator.latencies.values() for value in values]
+    db_stats = {}
+    for kind, values in db_timings.items():
+        values = values[db_before[kind]:]
+        db_stats[kind] = {'calls': len(values), 'total_ms': round(sum(values) * 1000, 1), **percentiles(values)}
+    db_total = db_stats['read']['total_ms'] + db_stats['write']['total_ms']
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': vars(args),
+        'updates': len(all_latencies),
+        'reply_timeouts': generator.timeouts,
+        'elapsed_s': round(elapsed, 3),
+        'users_elapsed_s': round(users_elapsed, 3),
+        'updates_per_s': round(len(all_latencies) / elapsed, 1),
+        'latency': {'all': percentiles(all_latencies),
+                    **{kind: percentiles(values) for kind, values in sorted(generator.latencies.items())}},
+        'db': {**db_stats, 'total_ms': round(db_total, 1),
+               'share_of_wall': round(db_total / 1000 / elapsed, 3)},
+        'api_calls': api.method_counts(),
+        'handlers': top_series(metrics.HANDLER_SECONDS, limit=None),
+        'sql_top': top_series(metrics.SQL_SECONDS),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=500, help='пользователей одновременно в сценарии')
+    parser.add_argument('--concurrent-updates', type=int, default=bot_main.CONCURRENT_UPDATES)
+    parser.add_argument('--seed-ads', type=int, default=20000, help='опубликованных объявлений до старта')
+    parser.add_argument('--think', type=float, default=0.0, help='пауза пользователя между шагами до N с')
+    parser.add_argument('--api-latency', type=float, default=0.0, help='задержка ответа Bot API, с')
+    parser.add_argument('--telegram-limits', action='store_true', help='оставить лимиты частоты отправки')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--output', default='loadtest.json')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmp:
+        result = asyncio.run(run(args, os.path.join(tmp, 'loadtest.db')))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    latency = result['latency']['all']
+    print(f"апдейтов: {result['updates']} за {result['elapsed_s']} с — {result['updates_per_s']} апдейтов/с")
+    print(f"задержка: p50 {latency['p50_ms']} мс, p95 {latency['p95_ms']} мс, p99 {latency['p99_ms']} мс")
+    for kind, stats in result['latency'].items():
+        if kind != 'all':
+            print(f"  {kind:>13}: {stats['count']:>6} · p50 {stats['p50_ms']:>7} · p99 {stats['p99_ms']:>7} мс")
+    print(f"БД: {result['db']['total_ms']} мс ({result['db']['share_of_wall']:.0%} времени прогона)")
+    print(f"результаты: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import math
+
+# Верхние границы ценовых диапазонов каталога, руб.; последний диапазон открыт
+PRICE_BOUNDS = (500, 1000, 3000, 10000)
+
+
+def _bucket_sql(price):
+    cases = ' '.join(f'WHEN {price} < {bound} THEN {i}' for i, bound in enumerate(PRICE_BOUNDS))
+    return f'CASE {cases} ELSE {len(PRICE_BOUNDS)} END'
+
+
+# Число опубликованных объявлений по (категория, ценовой диапазон) ведут
+# триггеры, поэтому кнопки каталога показывают счётчики без подсчёта по ads.
+# Объявления без цены в каталог не попадают.
+BROWSE_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS browse_facets (
+        category TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (category, bucket)
+    ) WITHOUT ROWID
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS browse_ads_insert AFTER INSERT ON ads
+    WHEN new.status = 'approved' AND new.price IS NOT NULL BEGIN
+        INSERT INTO browse_facets (category, bucket, count)
+        VALUES (COALESCE(new.category, ''), {_bucket_sql('new.price')}, 1)
+        ON CONFLICT (category, bucket) DO UPDATE SET count = count + 1;
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS browse_ads_delete AFTER DELETE ON ads
+    WHEN old.status = 'approved' AND old.price IS NOT NULL BEGIN
+        UPDATE browse_facets SET count = count - 1
+        WHERE category = COALESCE(old.category, '') AND bucket = {_bucket_sql('old.price')};
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS browse_ads_update AFTER UPDATE OF status, category, price ON ads
+    WHEN old.status IS NOT new.status OR old.category IS NOT new.category OR old.price IS NOT new.price BEGIN
+        UPDATE browse_facets SET count = count - 1
+        WHERE old.status = 'approved' AND old.price IS NOT NULL
+        AND category = COALESCE(old.category, '') AND bucket = {_bucket_sql('old.price')};
+        INSERT INTO browse_facets (category, bucket, count)
+        SELECT COALESCE(new.category, ''), {_bucket_sql('new.price')}, 1
+        WHERE new.status = 'approved' AND new.price IS NOT NULL
+        ON CONFLICT (category, bucket) DO UPDATE SET count = count + 1;
+    END
+    ''',
+    f'''
+    INSERT OR REPLACE INTO browse_facets (category, bucket, count)
+    SELECT COALESCE(category, ''), {_bucket_sql('price')}, COUNT(*)
+    FROM ads WHERE status = 'approved' AND price IS NOT NULL
+    GROUP BY 1, 2
+    ''',
+    # Листание внутри диапазона идёт по индексу без сортировки;
+    # прежний (category, status, price) — его префикс и больше не нужен
+    'CREATE INDEX IF NOT EXISTS idx_ads_browse ON ads (category, status, price, created_at)',
+    'DROP INDEX IF EXISTS idx_ads_category_status_price',
+    'ANALYZE',
+)
+
+# Объявления категории в диапазоне цен, от дешёвых к дорогим;
+# страницы листаются по ключу (price, created_at, id)
+_BROWSE_PAGE_SQL = '''
+    SELECT a.id, a.title, a.description, a.price, a.category, a.photo_id,
+           u.username, u.first_name, a.created_at
+    FROM ads a
+    LEFT JOIN users u ON a.user_id = u.user_id
+    WHERE a.category = ? AND a.status = 'approved' AND a.price >= ? AND a.price < ?
+    AND (a.price, a.created_at, a.id) {op} (?, ?, ?)
+    ORDER BY a.price {order}, a.created_at {order}, a.id {order}
+    LIMIT ?
+'''
+BROWSE_NEXT_SQL = _BROWSE_PAGE_SQL.format(op='>', order='ASC')
+BROWSE_PREV_SQL = _BROWSE_PAGE_SQL.format(op='<', order='DESC')
+BROWSE_FIRST_ANCHOR = (-math.inf, '', 0)
+
+
+def bucket_range(bucket):
+    """Границы диапазона [от, до); None — все цены"""
+    if bucket is None:
+        return -math.inf, math.inf
+    low = PRICE_BOUNDS[bucket - 1] if bucket > 0 else -math.inf
+    high = PRICE_BOUNDS[bucket] if bucket < len(PRICE_BOUNDS) else math.inf
+    return low, high
+
+
+def bucket_label(bucket):
+    if bucket is None:
+        return "Все цены"
+    low, high = bucket_range(bucket)
+    if low == -math.inf:
+        return f"до {high:,} ₽".replace(',', ' ')
+    if high == math.inf:
+        return f"от {low:,} ₽".replace(',', ' ')
+    return f"{low:,}–{high:,} ₽".replace(',', ' ')
+
+
+def read_category_counts(conn):
+    """{категория: опубликованных объявлений}"""
+    return dict(conn.execute(
+        'SELECT category, SUM(count) FROM browse_facets GROUP BY category'
+    ).fetchall())
+
+
+def read_bucket_counts(conn, category):
+    """{диапазон: опубликованных объявлений} в категории"""
+    return dict(conn.execute(
+        'SELECT bucket, count FROM browse_facets WHERE category = ? AND count > 0', (category,)
+    ).fetchall())
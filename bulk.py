@@ -0,0 +1,371 @@
+import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+
+import backup
+import dedup
+import lifecycle
+import search
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Выгружаемые таблицы: ключ сортировки и столбцы в порядке файла
+TABLES = {
+    'ads': ('id', ('id', 'user_id', 'title', 'description', 'price', 'category', 'photo_id',
+                   'status', 'created_at', 'expires_at')),
+    'users': ('user_id', ('user_id', 'username', 'first_name', 'last_name', 'registered_at')),
+}
+FORMATS = ('jsonl', 'csv')
+STATUSES = ('pending', 'approved', 'rejected')
+# Записей в одной транзакции загрузки и пауза между транзакциями, с:
+# писатель один, и обработчики встают в очередь между пачками
+IMPORT_CHUNK = 200
+IMPORT_PAUSE = 0.05
+
+# Прогресс загрузки файла (ключ — таблица и хеш содержимого) пишется
+# в той же транзакции, что и пачка, поэтому прерванная загрузка того же
+# файла продолжается с первой незаписанной записи
+IMPORT_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS import_progress (
+        key TEXT PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        position INTEGER NOT NULL DEFAULT 0,
+        imported INTEGER NOT NULL DEFAULT 0,
+        skipped INTEGER NOT NULL DEFAULT 0,
+        started_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        finished_at DATETIME
+    ) WITHOUT ROWID
+    ''',
+)
+
+_USERS_INSERT_SQL = '''
+    INSERT INTO users (user_id, username, first_name, last_name, registered_at)
+    VALUES (:user_id, :username, :first_name, :last_name, COALESCE(:registered_at, CURRENT_TIMESTAMP))
+    ON CONFLICT (user_id) DO NOTHING
+'''
+# Срок публикации одобренного объявления без expires_at отсчитывается от загрузки
+_ADS_INSERT_SQL = '''
+    INSERT INTO ads (id, user_id, title, description, price, category, photo_id, status, created_at, expires_at)
+    VALUES (:id, :user_id, :title, :description, :price, :category, :photo_id, :status,
+            COALESCE(:created_at, CURRENT_TIMESTAMP),
+            CASE WHEN :status = 'approved' THEN COALESCE(:expires_at, datetime('now', :ttl)) END)
+'''
+
+
+def detect_format(path):
+    """Формат по расширению: .csv или .csv.gz — CSV, остальное — JSONL"""
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'jsonl'
+
+
+def open_text(path, mode):
+    """Текстовый файл; .gz сжимается и распаковывается на лету"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+# --- Выгрузка ---
+
+def iter_rows(conn, table):
+    """Строки таблицы по ключу; курсор SQLite отдаёт их по одной"""
+    key, columns = TABLES[table]
+    return conn.execute(f'SELECT {", ".join(columns)} FROM {table} ORDER BY {key}')
+
+
+def jsonl_lines(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+
+
+def csv_lines(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in itertools.chain([columns], rows):
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def export(conn, table, fmt, out):
+    """Пишет таблицу в out построчно, память не зависит от размера; возвращает число строк"""
+    columns = TABLES[table][1]
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    lines = jsonl_lines if fmt == 'jsonl' else csv_lines
+    for line in lines(columns, counted(iter_rows(conn, table))):
+        out.write(line)
+    return count
+
+
+async def export_file(db, table, path, fmt=None):
+    """Выгрузка в файл на соединении читателя: один снимок базы, обработчики не ждут"""
+    def write(conn):
+        with open_text(path, 'w') as out:
+            return export(conn, table, fmt or detect_format(path), out)
+    return await db.read(write)
+
+
+# --- Загрузка ---
+
+def read_records(path, fmt):
+    """Записи файла по одной; непонятная строка JSONL даёт None"""
+    with open_text(path, 'r') as source:
+        if fmt == 'csv':
+            for record in csv.DictReader(source):
+                # В CSV нет NULL: пустое поле — отсутствующее значение
+                yield {name: value if value != '' else None for name, value in record.items()}
+            return
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield record if isinstance(record, dict) else None
+
+
+def file_key(path, table):
+    """Ключ прогресса: таблица и хеш содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+    return f'{table}:{digest.hexdigest()[:32]}'
+
+
+def _text(value):
+    return None if value is None else str(value).strip() or None
+
+
+def _integer(value):
+    return None if value is None else int(value)
+
+
+def user_row(record):
+    """Параметры вставки пользователя; ValueError, если записи не хватает полей"""
+    user_id = _integer(record.get('user_id'))
+    if user_id is None:
+        raise ValueError('нет user_id')
+    return {
+        'user_id': user_id,
+        'username': _text(record.get('username')),
+        'first_name': _text(record.get('first_name')),
+        'last_name': _text(record.get('last_name')),
+        'registered_at': _text(record.get('registered_at')),
+    }
+
+
+def ad_row(record):
+    """Параметры вставки объявления; неизвестный статус — на модерацию"""
+    title = _text(record.get('title'))
+    if title is None:
+        raise ValueError('нет названия')
+    price = record.get('price')
+    status = _text(record.get('status'))
+    return {
+        'id': _integer(record.get('id')),
+        'user_id': _integer(record.get('user_id')),
+        'title': title,
+        'description': _text(record.get('description')),
+        'price': None if price in (None, '') else float(price),
+        'category': _text(record.get('category')),
+        'photo_id': _text(record.get('photo_id')),
+        'status': status if status in STATUSES else 'pending',
+        'created_at': _text(record.get('created_at')),
+        'expires_at': _text(record.get('expires_at')),
+    }
+
+
+def _save_progress(conn, key, table, position, imported, skipped, finished):
+    conn.execute('''
+        INSERT INTO import_progress (key, table_name, position, imported, skipped, finished_at)
+        VALUES (?1, ?2, ?3, ?4, ?5, CASE WHEN ?6 THEN CURRENT_TIMESTAMP END)
+        ON CONFLICT (key) DO UPDATE SET
+            position = ?3, imported = imported + ?4, skipped = skipped + ?5,
+            finished_at = CASE WHEN ?6 THEN CURRENT_TIMESTAMP END
+    ''', (key, table, position, imported, skipped, finished))
+
+
+def _load_progress(conn, key):
+    row = conn.execute(
+        'SELECT position, imported, skipped, finished_at FROM import_progress WHERE key = ?', (key,)
+    ).fetchone()
+    return row or (0, 0, 0, None)
+
+
+def _insert_users(conn, rows):
+    # Уже известные пользователи пропускаются: профиль в базе свежее файла
+    return conn.executemany(_USERS_INSERT_SQL, rows).rowcount if rows else 0
+
+
+def _sign(rows):
+    for row in rows:
+        row['signature'] = dedup.signature(row['title'], row['description'])
+        row['bands'] = dedup.band_keys(row['signature'])
+
+
+def _insert_ads(conn, rows, ttl):
+    """Вставка без повторов: ни того же id (в ads и архиве), ни похожего текста"""
+    explicit = [row['id'] for row in rows if row['id'] is not None]
+    existing = set()
+    if explicit:
+        placeholders = ','.join('?' * len(explicit))
+        existing = {ad_id for ad_id, in conn.execute(f'''
+            SELECT id FROM ads WHERE id IN ({placeholders})
+            UNION ALL SELECT id FROM ads_archive WHERE id IN ({placeholders})
+        ''', explicit + explicit)}
+    # Новые id выдаются сами, чтобы сразу записать отпечатки; AUTOINCREMENT
+    # не переиспользует id объявлений из архива
+    next_id, = conn.execute('''
+        SELECT max(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'ads'), 0),
+                   COALESCE((SELECT max(id) FROM ads), 0),
+                   COALESCE((SELECT max(id) FROM ads_archive), 0))
+    ''').fetchone()
+    next_id = max([next_id] + explicit)
+
+    # Полосы всей пачки читаются из базы одним запросом; принятые записи
+    # попадают в тот же индекс, и следующие записи пачки сверяются и с ними
+    index = dedup.DuplicateIndex()
+    index.load_bands(conn, [key for row in rows for key in row['bands']])
+    inserted = []
+    for row in rows:
+        if row['id'] in existing:
+            continue
+        if index.similar(row['signature'], keys=row['bands']):
+            continue
+        if row['id'] is None:
+            next_id += 1
+            row['id'] = next_id
+        existing.add(row['id'])
+        row['ttl'] = ttl
+        index.add(row['id'], row['user_id'], row['signature'], keys=row['bands'])
+        inserted.append(row)
+    if inserted:
+        conn.executemany(_ADS_INSERT_SQL, inserted)
+        dedup.store_many(conn, [(row['id'], row['user_id'], row['signature'], row['bands']) for row in inserted])
+    return [(row['id'], row['user_id'], row['signature'], row['status']) for row in inserted]
+
+
+def _import_chunk(conn, table, key, position, rows, invalid, finished, ttl):
+    """Пачка и прогресс в одной транзакции; (записано, [объявления для on_chunk])"""
+    if table == 'ads':
+        ads = _insert_ads(conn, rows, ttl)
+        count = len(ads)
+    else:
+        ads = []
+        count = _insert_users(conn, rows)
+    _save_progress(conn, key, table, position, count, len(rows) + invalid - count, finished)
+    return count, ads
+
+
+async def import_file(db, table, path, fmt=None, ttl_days=lifecycle.AD_TTL_DAYS, on_chunk=None,
+                      chunk=IMPORT_CHUNK, pause=IMPORT_PAUSE):
+    """Загрузка файла пачками с продолжением после обрыва.
+
+    Повторы пропускаются: пользователи — по user_id, объявления — по id и по
+    похожести текста (отпечатки dedup). on_chunk получает
+    записанные объявления: [(id, user_id, сигнатура, статус)].
+    """
+    loop = asyncio.get_running_loop()
+    key = await loop.run_in_executor(None, file_key, path, table)
+    position, imported, skipped, finished_at = await db.read(_load_progress, key)
+    result = {'key': key, 'resumed_from': position, 'imported': imported, 'skipped': skipped}
+    if finished_at is not None:
+        result['finished'] = finished_at
+        return result
+
+    parse = ad_row if table == 'ads' else user_row
+    records = itertools.islice(read_records(path, fmt or detect_format(path)), position, None)
+    while True:
+        rows = []
+        invalid = 0
+        for record in itertools.islice(records, chunk):
+            try:
+                rows.append(parse(record))
+            except (AttributeError, TypeError, ValueError):
+                invalid += 1
+        consumed = len(rows) + invalid
+        position += consumed
+        if table == 'ads':
+            # Сигнатуры считаются до транзакции: писатель занят только вставкой
+            await loop.run_in_executor(None, _sign, rows)
+        count, ads = await db.write(
+            _import_chunk, table, key, position, rows, invalid, consumed < chunk, f'+{ttl_days} days'
+        )
+        result['imported'] += count
+        result['skipped'] += consumed - count
+        if ads and on_chunk is not None:
+            on_chunk(ads)
+        if consumed < chunk:
+            result['finished'] = True
+            return result
+        await asyncio.sleep(pause)
+
+
+# --- Командная строка ---
+
+def main(argv=None):
+    """Выгрузка, загрузка и копия базы без бота: python bulk.py --help"""
+    # migrations сам импортирует этот модуль ради IMPORT_SCHEMA
+    import migrations
+
+    parser = argparse.ArgumentParser(description='Выгрузка и загрузка объявлений и пользователей, копия базы')
+    parser.add_argument('--db', default=os.getenv('DB_PATH', 'fleamarket.db'))
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='выгрузить таблицу в JSONL или CSV')
+    export_parser.add_argument('table', choices=sorted(TABLES))
+    export_parser.add_argument('-f', '--format', choices=FORMATS)
+    export_parser.add_argument('-o', '--output', help='файл (.gz — со сжатием); без него — stdout')
+    import_parser = commands.add_parser(
+        'import', help='загрузить таблицу; индекс повторов бота обновится после его перезапуска'
+    )
+    import_parser.add_argument('table', choices=sorted(TABLES))
+    import_parser.add_argument('path')
+    import_parser.add_argument('-f', '--format', choices=FORMATS)
+    backup_parser = commands.add_parser('backup', help='копия работающей базы')
+    backup_parser.add_argument('--dir', default=os.getenv('BACKUP_DIR', backup.BACKUP_DIR))
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    if args.command == 'backup':
+        path = asyncio.run(backup.OnlineBackup(args.db, args.dir).run())
+        print(path)
+        return
+
+    db = Database(args.db, readers=1, functions=search.SQL_FUNCTIONS)
+    try:
+        migrations.migrate(db)
+        if args.command == 'export':
+            if args.output:
+                count = asyncio.run(export_file(db, args.table, args.output, args.format))
+            else:
+                count = db.run_read(export, args.table, args.format or 'jsonl', sys.stdout)
+            logger.info(f"Выгружено строк: {count}")
+        else:
+            result = asyncio.run(import_file(db, args.table, args.path, args.format))
+            logger.info(f"Загрузка {args.path}: {result}")
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
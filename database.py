@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Прагмы применяются к каждому соединению пула
+PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA mmap_size = 134217728',
+    'PRAGMA busy_timeout = 5000',
+)
+
+
+class _TimedConnection(sqlite3.Connection):
+    """Соединение, сообщающее on_query(sql, секунды, ошибка) о каждом execute.
+
+    Замеряется выполнение запроса до первой строки результата (для записи —
+    целиком); чтение строк курсором в замер не входит.
+    """
+    on_query = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        failed = True
+        try:
+            cursor = super().execute(sql, parameters)
+            failed = False
+            return cursor
+        finally:
+            self.on_query(sql, time.perf_counter() - started, failed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        failed = True
+        try:
+            cursor = super().executemany(sql, seq_of_parameters)
+            failed = False
+            return cursor
+        finally:
+            self.on_query(sql, time.perf_counter() - started, failed)
+
+
+class Database:
+    """Слой доступа к SQLite: пул читателей и один последовательный писатель.
+
+    Все запросы выполняются вне event loop: чтения — в пуле потоков
+    с долгоживущими соединениями, записи — в отдельном однопоточном
+    executor'е, поэтому транзакции записи никогда не конкурируют между собой.
+    """
+
+    def __init__(self, path='fleamarket.db', readers=4, functions=None, on_query=None):
+        self.path = path
+        self._functions = dict(functions or {})
+        self._on_query = on_query
+        self._writer = self._connect()
+        self._readers = queue.SimpleQueue()
+        for _ in range(readers):
+            self._readers.put(self._connect())
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-read')
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-write')
+        self._reader_count = readers
+
+    def _connect(self):
+        if self._on_query is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None,
+                                   factory=_TimedConnection)
+            conn.on_query = self._on_query
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        # Пользовательские SQL-функции нужны триггерам на любом соединении
+        for name, fn in self._functions.items():
+            conn.create_function(name, 1, fn, deterministic=True)
+        return conn
+
+    # --- Синхронный API (поток executor'а или старт приложения) ---
+
+    def _read(self, fn, *args):
+        conn = self._readers.get()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._readers.put(conn)
+
+    def _write(self, fn, *args):
+        conn = self._writer
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            result = fn(conn, *args)
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        return result
+
+    def run_read(self, fn, *args):
+        """Синхронно выполняет fn(conn, *args) на соединении читателя."""
+        return self._read_executor.submit(self._read, fn, *args).result()
+
+    def run_write(self, fn, *args):
+        """Синхронно выполняет fn(conn, *args) в транзакции писателя."""
+        return self._write_executor.submit(self._write, fn, *args).result()
+
+    def run_autocommit(self, fn, *args):
+        """Синхронно выполняет fn(conn, *args) на соединении писателя вне транзакции (VACUUM)."""
+        return self._write_executor.submit(fn, self._writer, *args).result()
+
+    # --- Асинхронный API для обработчиков ---
+
+    async def read(self, fn, *args):
+        """Выполняет fn(conn, *args) на соединении из пула читателей."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, self._read, fn, *args)
+
+    async def write(self, fn, *args):
+        """Выполняет fn(conn, *args) в одной транзакции писателя."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor, self._write, fn, *args)
+
+    async def autocommit(self, fn, *args):
+        """Выполняет fn(conn, *args) на соединении писателя вне транзакции."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor, fn, self._writer, *args)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        """Выполняет запрос записи и возвращает lastrowid."""
+        return await self.write(lambda conn: conn.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.write(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    def close(self):
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        for _ in range(self._reader_count):
+            self._readers.get().close()
+        self._writer.close()
+        logger.info("База данных закрыта")
@@ -0,0 +1,226 @@
+import hashlib
+import operator
+import random
+from array import array
+
+import search
+
+# MinHash: число хеш-функций и разбиение сигнатуры на полосы LSH.
+# 16 полос по 4 значения: пары с похожестью 0.8 становятся кандидатами
+# с вероятностью 0.9998, с похожестью 0.3 — примерно в 12% случаев
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+# Оценка коэффициента Жаккара, начиная с которой объявление — повтор
+SIMILARITY_THRESHOLD = 0.8
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 64) - 1
+# Параметры хеш-функций фиксированы: сигнатуры хранятся в базе
+_rnd = random.Random(0x5EED)
+_PERMUTATIONS = [(_rnd.randrange(1, _PRIME), _rnd.randrange(0, _PRIME)) for _ in range(NUM_HASHES)]
+
+DEDUP_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS ad_fingerprints (
+        ad_id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        signature BLOB NOT NULL
+    )
+    ''',
+    # Ключ полосы — хеш номера полосы и её значений сигнатуры
+    '''
+    CREATE TABLE IF NOT EXISTS ad_lsh_bands (
+        band_key INTEGER NOT NULL,
+        ad_id INTEGER NOT NULL,
+        PRIMARY KEY (band_key, ad_id)
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_ad_lsh_bands_ad ON ad_lsh_bands (ad_id)',
+    # Объявление, ушедшее из ads (в архив), перестаёт участвовать в проверке
+    '''
+    CREATE TRIGGER IF NOT EXISTS dedup_ads_delete AFTER DELETE ON ads BEGIN
+        DELETE FROM ad_lsh_bands WHERE ad_id = old.id;
+        DELETE FROM ad_fingerprints WHERE ad_id = old.id;
+    END
+    ''',
+)
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def shingles(text):
+    """Основы слов и пары соседних основ: пары ловят порядок, слова — короткие тексты"""
+    words = search.terms(text)
+    items = set(words)
+    items.update(f'{first} {second}' for first, second in zip(words, words[1:]))
+    return {_hash64(item.encode()) for item in items}
+
+
+def signature(title, description):
+    """MinHash-сигнатура нормализованного названия и описания"""
+    hashes = shingles(f'{title} {description or ""}')
+    if not hashes:
+        return (_MAX_HASH,) * NUM_HASHES
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def band_keys(sig):
+    """Ключи полос LSH; знаковые 64 бита, как INTEGER в SQLite"""
+    keys = []
+    for band in range(BANDS):
+        values = array('Q', sig[band * ROWS:(band + 1) * ROWS])
+        digest = hashlib.blake2b(band.to_bytes(1, 'little') + values.tobytes(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'little', signed=True))
+    return keys
+
+
+def similarity(first, second):
+    """Оценка коэффициента Жаккара по доле совпавших значений сигнатур"""
+    return sum(map(operator.eq, first, second)) / NUM_HASHES
+
+
+def store(conn, ad_id, user_id, sig):
+    """Запись сигнатуры и полос (в транзакции вставки или обновления объявления)"""
+    store_many(conn, [(ad_id, user_id, sig, band_keys(sig))])
+
+
+def store_many(conn, entries):
+    """Запись пачки [(ad_id, user_id, сигнатура, ключи полос)] тремя executemany"""
+    conn.executemany('DELETE FROM ad_lsh_bands WHERE ad_id = ?', [(ad_id,) for ad_id, _, _, _ in entries])
+    conn.executemany(
+        'INSERT OR REPLACE INTO ad_fingerprints (ad_id, user_id, signature) VALUES (?, ?, ?)',
+        [(ad_id, user_id, array('Q', sig).tobytes()) for ad_id, user_id, sig, _ in entries]
+    )
+    conn.executemany(
+        'INSERT OR IGNORE INTO ad_lsh_bands (band_key, ad_id) VALUES (?, ?)',
+        [(key, ad_id) for ad_id, _, _, keys in entries for key in keys]
+    )
+
+
+def backfill(conn):
+    """Сигнатуры для объявлений, поданных до появления проверки"""
+    rows = conn.execute('''
+        SELECT a.id, a.user_id, a.title, a.description FROM ads a
+        WHERE NOT EXISTS (SELECT 1 FROM ad_fingerprints f WHERE f.ad_id = a.id)
+    ''').fetchall()
+    for ad_id, user_id, title, description in rows:
+        store(conn, ad_id, user_id, signature(title, description))
+
+
+class DuplicateIndex:
+    """Зеркало LSH-индекса ad_lsh_bands в памяти.
+
+    Поиск похожих объявлений — BANDS обращений к словарю и сверка
+    сигнатур немногих кандидатов, без перебора всех объявлений. База —
+    источник истины: индекс загружается из неё при старте, а записи
+    объявлений, которых уже нет в ads, убираются при первой встрече.
+
+    Индекс держится в памяти целиком, поэтому хранится плотно: сигнатура —
+    array('Q'), а почти все ключи полос уникальны, так что ключ указывает
+    прямо на ad_id и становится множеством только при совпадении.
+    """
+
+    def __init__(self, threshold=SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self._ads = {}    # ad_id -> (user_id, array('Q') сигнатуры)
+        self._bands = {}  # ключ полосы -> ad_id или {ad_id}, если объявлений несколько
+        self.merged = 0
+        self.rejected = 0
+        self.flagged = 0
+
+    def __len__(self):
+        return len(self._ads)
+
+    def _link(self, key, ad_id):
+        ids = self._bands.get(key)
+        if ids is None:
+            self._bands[key] = ad_id
+        elif isinstance(ids, set):
+            ids.add(ad_id)
+        elif ids != ad_id:
+            self._bands[key] = {ids, ad_id}
+
+    def _unlink(self, key, ad_id):
+        ids = self._bands.get(key)
+        if isinstance(ids, set):
+            ids.discard(ad_id)
+            if len(ids) == 1:
+                self._bands[key] = ids.pop()
+        elif ids == ad_id:
+            del self._bands[key]
+
+    def add(self, ad_id, user_id, sig, keys=None):
+        self.remove(ad_id)
+        self._ads[ad_id] = (user_id, array('Q', sig))
+        for key in keys or band_keys(sig):
+            self._link(key, ad_id)
+
+    def remove(self, ad_id):
+        entry = self._ads.pop(ad_id, None)
+        if entry is None:
+            return
+        for key in band_keys(entry[1]):
+            self._unlink(key, ad_id)
+
+    def load(self, conn):
+        """Перестройка индекса из SQLite при старте"""
+        self._ads.clear()
+        self._bands.clear()
+        for ad_id, user_id, blob in conn.execute('SELECT ad_id, user_id, signature FROM ad_fingerprints'):
+            self._ads[ad_id] = (user_id, array('Q', blob))
+        for key, ad_id in conn.execute('SELECT band_key, ad_id FROM ad_lsh_bands'):
+            self._link(key, ad_id)
+        return len(self._ads)
+
+    def load_bands(self, conn, keys):
+        """Только объявления из полос keys — одним запросом на пачку загрузки файла"""
+        keys = list(set(keys))
+        if not keys:
+            return 0
+        placeholders = ','.join('?' * len(keys))
+        for key, ad_id, user_id, blob in conn.execute(f'''
+            SELECT b.band_key, f.ad_id, f.user_id, f.signature
+            FROM ad_lsh_bands b JOIN ad_fingerprints f ON f.ad_id = b.ad_id
+            WHERE b.band_key IN ({placeholders})
+        ''', keys):
+            self._link(key, ad_id)
+            if ad_id not in self._ads:
+                self._ads[ad_id] = (user_id, array('Q', blob))
+        return len(self._ads)
+
+    def similar(self, sig, exclude=None, keys=None):
+        """Похожие объявления: [(ad_id, user_id, похожесть)], самые похожие первыми"""
+        candidates = set()
+        for key in keys or band_keys(sig):
+            ids = self._bands.get(key)
+            if isinstance(ids, set):
+                candidates.update(ids)
+            elif ids is not None:
+                candidates.add(ids)
+        candidates.discard(exclude)
+
+        matches = []
+        for ad_id in candidates:
+            user_id, other = self._ads[ad_id]
+            score = similarity(sig, other)
+            if score >= self.threshold:
+                matches.append((ad_id, user_id, score))
+        matches.sort(key=lambda match: -match[2])
+        return matches
+
+    def similar_to(self, ad_id):
+        """Похожие на уже проиндексированное объявление"""
+        entry = self._ads.get(ad_id)
+        return self.similar(entry[1], exclude=ad_id) if entry else []
+
+    def stats(self):
+        return {
+            'ads': len(self._ads),
+            'bands': len(self._bands),
+            'merged': self.merged,
+            'rejected': self.rejected,
+            'flagged': self.flagged,
+        }
@@ -0,0 +1,114 @@
+import time
+
+from outbound import TokenBucket
+
+# Общий лимит пользователя: токенов в секунду и запас на всплеск
+USER_RATE = 3.0
+USER_BURST = 15
+# Лимиты по типу апдейта: команды дороже всего (/start пишет профиль),
+# кнопки листания дешевле всего
+KIND_LIMITS = {
+    'command': (0.5, 5),
+    'message': (1.5, 10),
+    'callback': (2.0, 10),
+}
+# Если токен наберётся за это время, апдейт ждёт, а не выбрасывается, с
+MAX_DEFER = 1.0
+# Не чаще одного предупреждения пользователю за интервал, с
+WARN_INTERVAL = 30.0
+# Как часто выбрасывать корзины простаивающих пользователей, с
+EVICT_INTERVAL = 60.0
+
+
+def update_kind(update):
+    """Тип апдейта для лимита: command, message или callback"""
+    if update.callback_query is not None:
+        return 'callback'
+    message = update.message
+    if message is not None and message.text is not None and message.text.startswith('/'):
+        return 'command'
+    return 'message'
+
+
+class _UserLimits:
+    __slots__ = ('total', 'kinds', 'warned_at')
+
+    def __init__(self, now):
+        self.total = TokenBucket(USER_RATE, USER_BURST, now)
+        self.kinds = {}  # тип -> TokenBucket, создаётся при первом апдейте типа
+        self.warned_at = float('-inf')
+
+    def is_full(self, now):
+        return self.total.is_full(now) and all(bucket.is_full(now) for bucket in self.kinds.values())
+
+
+class FloodControl:
+    """Ограничение частоты апдейтов от пользователя до обработчиков.
+
+    admit вызывает обработчик апдейтов (PerUserUpdateProcessor) раньше
+    очереди пользователя и слота: у каждого пользователя общая корзина
+    токенов и корзина на тип апдейта. Если токен наберётся скоро, апдейт
+    откладывается на возвращённое время, иначе выбрасывается, не заняв
+    ни очереди, ни слота. Пользователь получает одно предупреждение за
+    WARN_INTERVAL через on_throttled(chat_id).
+    """
+
+    def __init__(self, exempt=(), on_throttled=None, clock=time.monotonic):
+        self.exempt = frozenset(exempt)
+        self.on_throttled = on_throttled
+        self.clock = clock
+        self._users = {}  # user_id -> _UserLimits
+        self._last_evict = 0.0
+        self.admitted = 0
+        self.deferred = 0
+        self.dropped = 0
+
+    def admit(self, update):
+        """Через сколько секунд обработать апдейт; None — выбросить"""
+        user = getattr(update, 'effective_user', None)
+        if user is None or user.id in self.exempt:
+            return 0.0
+        now = self.clock()
+        if now - self._last_evict > EVICT_INTERVAL:
+            self._evict(now)
+
+        limits = self._users.get(user.id)
+        if limits is None:
+            limits = self._users[user.id] = _UserLimits(now)
+        kind = update_kind(update)
+        bucket = limits.kinds.get(kind)
+        if bucket is None:
+            rate, burst = KIND_LIMITS[kind]
+            bucket = limits.kinds[kind] = TokenBucket(rate, burst, now)
+
+        delay = max(limits.total.delay(now), bucket.delay(now))
+        if delay > MAX_DEFER:
+            self.dropped += 1
+            if now - limits.warned_at >= WARN_INTERVAL:
+                limits.warned_at = now
+                if self.on_throttled is not None and update.effective_chat is not None:
+                    self.on_throttled(update.effective_chat.id)
+            return None
+
+        # Токены занимаются сразу: следующие апдейты встают за этим
+        limits.total.consume(now)
+        bucket.consume(now)
+        if delay > 0:
+            self.deferred += 1
+        self.admitted += 1
+        return delay
+
+    def _evict(self, now):
+        """Убирает пользователей, чьи корзины уже полностью наполнились"""
+        self._last_evict = now
+        for user_id in [user_id for user_id, limits in self._users.items()
+                        if limits.is_full(now) and now - limits.warned_at >= WARN_INTERVAL]:
+            del self._users[user_id]
+
+    def stats(self):
+        return {
+            'users': len(self._users),
+            'admitted': self.admitted,
+            'deferred': self.deferred,
+            'dropped': self.dropped,
+        }
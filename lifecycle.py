@@ -0,0 +1,186 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Срок публикации и за сколько дней до конца предупреждать владельца
+AD_TTL_DAYS = 30
+WARN_DAYS = 3
+# Сколько дней отклонённые объявления видны владельцу в «Моих объявлениях»
+REJECTED_KEEP_DAYS = 7
+# Как часто проверять сроки, с
+SWEEP_INTERVAL = 600.0
+# Строк в одной транзакции переноса в архив и пауза между транзакциями, с:
+# писатель один, и обработчики встают в очередь между пачками
+ARCHIVE_CHUNK = 200
+ARCHIVE_PAUSE = 0.05
+WARN_BATCH = 500
+# Incremental vacuum: с какого числа свободных страниц и по сколько за транзакцию
+VACUUM_MIN_PAGES = 256
+VACUUM_STEP_PAGES = 512
+
+_COLUMNS = 'id, user_id, title, description, price, category, photo_id, status, created_at, expires_at'
+
+LIFECYCLE_SCHEMA = (
+    'ALTER TABLE ads ADD COLUMN expires_at DATETIME',
+    'ALTER TABLE ads ADD COLUMN warned_at DATETIME',
+    "CREATE INDEX IF NOT EXISTS idx_ads_expires ON ads (expires_at) WHERE status = 'approved'",
+    '''
+    CREATE TABLE IF NOT EXISTS ads_archive (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        title TEXT NOT NULL,
+        description TEXT,
+        price REAL,
+        category TEXT,
+        photo_id TEXT,
+        status TEXT NOT NULL,
+        created_at DATETIME,
+        expires_at DATETIME,
+        archived_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_ads_archive_user ON ads_archive (user_id)',
+    # Дата одобрения старых объявлений неизвестна: срок считается от подачи,
+    # но не меньше недели, чтобы после обновления они не снялись разом
+    f'''
+    UPDATE ads SET expires_at = max(datetime(created_at, '+{AD_TTL_DAYS} days'), datetime('now', '+7 days'))
+    WHERE status = 'approved'
+    ''',
+)
+
+
+def enable_incremental_vacuum(conn):
+    """auto_vacuum = INCREMENTAL; на существующей базе вступает в силу только после VACUUM"""
+    mode, = conn.execute('PRAGMA auto_vacuum').fetchone()
+    if mode != 2:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+
+
+def _archive_chunk(conn, rejected_before, limit):
+    # Сначала истёкшие, затем давно отклонённые; удаление из ads снимает
+    # объявление с индекса поиска и со счётчиков статистики триггерами
+    rows = conn.execute(f'''
+        DELETE FROM ads WHERE id IN (
+            SELECT id FROM ads WHERE status = 'approved' AND expires_at <= CURRENT_TIMESTAMP
+            ORDER BY expires_at LIMIT ?
+        ) RETURNING {_COLUMNS}
+    ''', (limit,)).fetchall()
+    if len(rows) < limit:
+        rows += conn.execute(f'''
+            DELETE FROM ads WHERE id IN (
+                SELECT id FROM ads WHERE status = 'rejected' AND created_at <= datetime('now', ?)
+                ORDER BY created_at LIMIT ?
+            ) RETURNING {_COLUMNS}
+        ''', (rejected_before, limit - len(rows))).fetchall()
+    if rows:
+        conn.executemany(f'''
+            INSERT INTO ads_archive ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [row[:7] + ('expired' if row[7] == 'approved' else row[7],) + row[8:] for row in rows])
+        conn.execute('''
+            INSERT INTO stats_counters (name, value) VALUES ('archived', ?)
+            ON CONFLICT (name) DO UPDATE SET value = value + excluded.value
+        ''', (len(rows),))
+    return [(row[0], row[1], row[2], row[7]) for row in rows]
+
+
+def _vacuum_step(conn, pages):
+    # PRAGMA incremental_vacuum освобождает по странице на каждый шаг
+    # оператора, а execute делает только первый шаг; executescript доводит
+    # оператор до конца одной транзакцией, поэтому шаг идёт вне db.write
+    conn.executescript(f'PRAGMA incremental_vacuum({int(pages)})')
+    return conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+
+class AdLifecycle:
+    """Срок жизни объявлений на JobQueue PTB.
+
+    Периодический проход предупреждает владельцев о скором окончании срока,
+    переносит истёкшие и давно отклонённые объявления в ads_archive
+    небольшими транзакциями и возвращает освободившиеся страницы файлу
+    через incremental vacuum. Владельцу и кешам сообщают колбэки:
+    on_expiring([(id, user_id, title, expires_at)]) и
+    on_archived([(id, user_id, title, статус до переноса)]).
+    """
+
+    def __init__(self, db, ttl_days=AD_TTL_DAYS, warn_days=WARN_DAYS, rejected_days=REJECTED_KEEP_DAYS,
+                 on_expiring=None, on_archived=None):
+        self.db = db
+        self.ttl_days = ttl_days
+        self.warn_days = warn_days
+        self.rejected_days = rejected_days
+        self.on_expiring = on_expiring
+        self.on_archived = on_archived
+        self.job = None
+
+    @property
+    def ttl(self):
+        """Модификатор datetime() для нового срока: '+30 days'"""
+        return f'+{self.ttl_days} days'
+
+    def schedule(self, job_queue, interval=SWEEP_INTERVAL, first=60.0):
+        """Повторяющееся задание; останавливается вместе с JobQueue приложения"""
+        self.job = job_queue.run_repeating(self.sweep, interval=interval, first=first, name='ad_lifecycle')
+
+    async def sweep(self, context=None):
+        """Один проход: архив, предупреждения, vacuum"""
+        try:
+            archived = await self.archive()
+            warned = await self.warn()
+            freed = await self.vacuum()
+            if warned or archived or freed:
+                logger.info(f"Срок объявлений: в архиве {archived}, предупреждено {warned}, освобождено страниц {freed}")
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания объявлений: {e}")
+
+    async def warn(self):
+        """Помечает и передаёт в on_expiring объявления, срок которых скоро истечёт"""
+        expiring = await self.db.write(lambda conn: conn.execute('''
+            UPDATE ads SET warned_at = CURRENT_TIMESTAMP
+            WHERE id IN (
+                SELECT id FROM ads
+                WHERE status = 'approved' AND expires_at <= datetime('now', ?)
+                AND expires_at > CURRENT_TIMESTAMP AND warned_at IS NULL
+                ORDER BY expires_at LIMIT ?
+            )
+            RETURNING id, user_id, title, expires_at
+        ''', (f'+{self.warn_days} days', WARN_BATCH)).fetchall())
+        if expiring and self.on_expiring is not None:
+            self.on_expiring(expiring)
+        return len(expiring)
+
+    async def archive(self):
+        """Переносит истёкшие и отклонённые объявления в архив пачками"""
+        total = 0
+        while True:
+            rows = await self.db.write(_archive_chunk, f'-{self.rejected_days} days', ARCHIVE_CHUNK)
+            if rows and self.on_archived is not None:
+                self.on_archived(rows)
+            total += len(rows)
+            if len(rows) < ARCHIVE_CHUNK:
+                return total
+            await asyncio.sleep(ARCHIVE_PAUSE)
+
+    async def vacuum(self):
+        """Возвращает свободные страницы файлу, если их накопилось много"""
+        free, = await self.db.fetchone('PRAGMA freelist_count')
+        freed = 0
+        while free >= VACUUM_MIN_PAGES:
+            remaining = await self.db.autocommit(_vacuum_step, VACUUM_STEP_PAGES)
+            if remaining >= free:
+                # auto_vacuum выключен — incremental_vacuum ничего не делает
+                break
+            freed += free - remaining
+            free = remaining
+            await asyncio.sleep(ARCHIVE_PAUSE)
+        return freed
+
+    async def renew(self, ad_id, user_id):
+        """Продление опубликованного объявления владельцем; новый срок или None"""
+        row = await self.db.write(lambda conn: conn.execute('''
+            UPDATE ads SET expires_at = datetime('now', ?), warned_at = NULL
+            WHERE id = ? AND user_id = ? AND status = 'approved'
+            RETURNING expires_at
+        ''', (self.ttl, ad_id, user_id)).fetchone())
+        return row[0] if row else None
@@ -1,9 +1,30 @@
+import asyncio
 import logging
-import sqlite3
 import os
+import tempfile
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 
+import browse
+import bulk
+import dedup
+import metrics
+import migrations
+import savedsearch
+import search
+import stats
+from backup import OnlineBackup
+from database import Database
+from floodcontrol import FloodControl
+from lifecycle import AdLifecycle
+from outbound import OutboundQueue
+from persistence import SQLitePersistence
+from savedsearch import SavedSearchIndex, parse_subscription
+from searchcache import SearchCache
+from server import BotServer
+from updates import PerUserUpdateProcessor
+from usercache import KnownUserCache
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -14,73 +35,124 @@ logger = logging.getLogger(__name__)
 # Конфигурация
 BOT_TOKEN = os.getenv('BOT_TOKEN', '8491309169:AAEV-ZpVRhjEYfD6RZxyq65Woj8oZUq8sYs')
 ADMIN_ID = int(os.getenv('ADMIN_ID', '8052499118'))
+DB_PATH = os.getenv('DB_PATH', 'fleamarket.db')
+# Режим вебхука включается публичным адресом сервиса; без него — long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or os.getenv('RENDER_EXTERNAL_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+PORT = int(os.getenv('PORT', '8080'))
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '64'))
+# Срок публикации объявления, дней
+AD_TTL_DAYS = int(os.getenv('AD_TTL_DAYS', '30'))
+# Каталог резервных копий базы
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+# Размер пула HTTP-соединений к Bot API (как у ApplicationBuilder по умолчанию)
+BOT_API_CONNECTIONS = 256
+
+CATEGORIES = [
+    "👕 Одежда", "👟 Обувь",
+    "📱 Электроника", "🏠 Для дома",
+    "🎮 Хобби", "📚 Книги",
+    "🚗 Авто", "⚽ Другое",
+]
+
+# Постраничный вывод: объявлений на странице и длина описания в карточке
+PAGE_SIZE = 5
+DESCRIPTION_PREVIEW = 200
+
+# «Мои объявления» листаются по ключу (created_at, id), новые сверху
+_MY_ADS_PAGE_SQL = '''
+    SELECT id, title, description, price, category, status, created_at, photo_id
+    FROM ads
+    WHERE user_id = ? AND (created_at, id) {op} (?, ?)
+    ORDER BY created_at {order}, id {order}
+    LIMIT ?
+'''
+MY_ADS_NEXT_SQL = _MY_ADS_PAGE_SQL.format(op='<', order='DESC')
+MY_ADS_PREV_SQL = _MY_ADS_PAGE_SQL.format(op='>', order='ASC')
+MY_ADS_FIRST_ANCHOR = ('9999-12-31 23:59:59', 0)
+
+# Очередь модерации: ожидающие объявления по возрастанию id
+_MODERATION_PAGE_SQL = '''
+    SELECT a.id, a.title, a.description, a.price, a.category, a.photo_id, u.username, u.first_name
+    FROM ads a
+    LEFT JOIN users u ON a.user_id = u.user_id
+    WHERE a.status = 'pending' AND a.id {op} ?
+    ORDER BY a.id {order}
+    LIMIT ?
+'''
+MODERATION_NEXT_SQL = _MODERATION_PAGE_SQL.format(op='>', order='ASC')
+MODERATION_PREV_SQL = _MODERATION_PAGE_SQL.format(op='<', order='DESC')
+
+# Не чаще одного уведомления администратору за интервал, с;
+# остальные новые объявления приходят одной сводкой
+ADMIN_NOTIFY_INTERVAL = 60.0
 
 class FleaMarketBot:
-    def __init__(self):
+    def __init__(self, db_path=DB_PATH):
+        self.db = self.open_database(db_path)
+        self.outbox = OutboundQueue()
+        self.search_cache = SearchCache()
+        self.users = KnownUserCache(self.db, on_flush=self.profiles_saved)
+        self.search_terms = stats.SearchTermStats(self.db)
+        self.admin_notified_at = float('-inf')
+        self.admin_backlog = 0
+        self.admin_digest = None
+        self.saved_searches = SavedSearchIndex()
+        self.duplicates = dedup.DuplicateIndex()
+        self.flood = FloodControl(exempt=(ADMIN_ID,), on_throttled=self.warn_flood)
+        self.lifecycle = AdLifecycle(
+            self.db, AD_TTL_DAYS, on_expiring=self.notify_expiring, on_archived=self.ads_archived
+        )
+        self.backups = OnlineBackup(db_path, BACKUP_DIR)
+        self.import_task = None
         self.init_db()
+        # Передается в ApplicationBuilder().persistence(...)
+        self.persistence = SQLitePersistence(self.db)
         
+    def open_database(self, db_path):
+        """Слой доступа к базе, общий для всех компонентов бота"""
+        return Database(db_path, functions=search.SQL_FUNCTIONS, on_query=metrics.observe_query)
+    
     def init_db(self):
         """Инициализация базы данных"""
         try:
-            conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    registered_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS ads (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    price REAL,
-                    category TEXT,
-                    photo_id TEXT,
-                    status TEXT DEFAULT 'pending',
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (user_id) REFERENCES users (user_id)
-                )
-            ''')
+            version = migrations.migrate(self.db)
+            subscriptions = self.db.run_read(self.saved_searches.load)
+            fingerprints = self.db.run_read(self.duplicates.load)
             
-            conn.commit()
-            conn.close()
-            logger.info("✅ База данных инициализирована")
+            logger.info(
+                f"✅ База данных инициализирована (схема v{version}, подписок: {subscriptions}, "
+                f"отпечатков: {fingerprints})"
+            )
         except Exception as e:
             logger.error(f"❌ Ошибка инициализации БД: {e}")
 
-    def register_user(self, user_id, username, first_name, last_name):
-        """Регистрация пользователя"""
+    async def register_user(self, user_id, username, first_name, last_name):
+        """Регистрация пользователя (запись в базу — пакетами в фоне)"""
         try:
-            conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT OR IGNORE INTO users (user_id, username, first_name, last_name)
-                VALUES (?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name))
-            
-            conn.commit()
-            conn.close()
+            self.users.touch(user_id, username, first_name, last_name)
         except Exception as e:
             logger.error(f"Ошибка регистрации пользователя: {e}")
 
+    def profiles_saved(self, user_ids):
+        """Профили записаны в базу: карточки с их контактами в кеше поиска устарели"""
+        for user_id in user_ids:
+            self.search_cache.invalidate_user(user_id)
+
+    def warn_flood(self, chat_id):
+        """Предупреждение пользователю, чьи апдейты выбрасываются"""
+        self.outbox.send_message(chat_id, "⏳ Слишком много запросов. Подождите немного и повторите.")
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         try:
             user = update.effective_user
-            self.register_user(user.id, user.username, user.first_name, user.last_name)
+            await self.register_user(user.id, user.username, user.first_name, user.last_name)
             
             keyboard = [
                 ["📦 Добавить объявление", "📋 Мои объявления"],
-                ["🔍 Поиск объявлений", "ℹ️ Помощь"]
+                ["🔍 Поиск объявлений", "🗂 Каталог"],
+                ["ℹ️ Помощь"]
             ]
             reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
             
@@ -147,12 +219,7 @@ class FleaMarketBot:
                 price = float(update.message.text.replace(',', '.'))
                 ad_data['price'] = price
                 
-                keyboard = [
-                    ["👕 Одежда", "👟 Обувь"],
-                    ["📱 Электроника", "🏠 Для дома"],
-                    ["🎮 Хобби", "📚 Книги"],
-                    ["🚗 Авто", "⚽ Другое"]
-                ]
+                keyboard = [CATEGORIES[i:i + 2] for i in range(0, len(CATEGORIES), 2)]
                 reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
                 
                 await update.message.reply_text(
@@ -198,44 +265,123 @@ class FleaMarketBot:
             user = update.effective_user
             
             if all(key in ad_data for key in ['title', 'description', 'price', 'category']):
-                conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT INTO ads (user_id, title, description, price, category, photo_id, status)
-                    VALUES (?, ?, ?, ?, ?, ?, 'pending')
-                ''', (user.id, ad_data['title'], ad_data['description'], 
-                      ad_data['price'], ad_data['category'], ad_data.get('photo')))
-                
-                ad_id = cursor.lastrowid
-                conn.commit()
-                conn.close()
+                signature = dedup.signature(ad_data['title'], ad_data['description'])
+                own, other = await self.find_duplicates(user.id, signature)
                 
-                await self.notify_admin(context, ad_id, ad_data, user)
+                if own is not None:
+                    text = await self.merge_repost(own, user.id, ad_data, signature)
+                else:
+                    def insert(conn):
+                        ad_id = conn.execute('''
+                            INSERT INTO ads (user_id, title, description, price, category, photo_id, status)
+                            VALUES (?, ?, ?, ?, ?, ?, 'pending')
+                        ''', (user.id, ad_data['title'], ad_data['description'], 
+                              ad_data['price'], ad_data['category'], ad_data.get('photo'))).lastrowid
+                        dedup.store(conn, ad_id, user.id, signature)
+                        return ad_id
+                    
+                    ad_id = await self.db.write(insert)
+                    self.duplicates.add(ad_id, user.id, signature)
+                    if other is not None:
+                        self.duplicates.flagged += 1
+                    await self.notify_admin(context, ad_id, ad_data, user, similar=other)
+                    text = (
+                        "✅ Объявление отправлено на модерацию!\n"
+                        "Обычно это занимает несколько часов.\n\n"
+                        "Вы получите уведомление, когда объявление будет опубликовано."
+                    )
                 
                 user_data.pop('creating_ad', None)
                 user_data.pop('ad_data', None)
                 
                 keyboard = [
                     ["📦 Добавить объявление", "📋 Мои объявления"],
-                    ["🔍 Поиск объявлений", "ℹ️ Помощь"]
+                    ["🔍 Поиск объявлений", "🗂 Каталог"],
+                    ["ℹ️ Помощь"]
                 ]
                 reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
                 
-                await update.message.reply_text(
-                    "✅ Объявление отправлено на модерацию!\n"
-                    "Обычно это занимает несколько часов.\n\n"
-                    "Вы получите уведомление, когда объявление будет опубликовано.",
-                    reply_markup=reply_markup
-                )
+                await update.message.reply_text(text, reply_markup=reply_markup)
             else:
                 await update.message.reply_text("❌ Ошибка при создании объявления. Попробуйте снова.")
         except Exception as e:
             logger.error(f"Ошибка в save_ad: {e}")
 
-    async def notify_admin(self, context: ContextTypes.DEFAULT_TYPE, ad_id: int, ad_data: dict, user):
-        """Уведомление администратора о новом объявлении"""
+    async def find_duplicates(self, user_id, signature):
+        """Похожие объявления: (свое (id, статус) или None, чужое активное (id, похожесть) или None)"""
+        similar = self.duplicates.similar(signature)
+        if not similar:
+            return None, None
+        
+        ad_ids = [ad_id for ad_id, _, _ in similar]
+        placeholders = ','.join('?' * len(ad_ids))
+        statuses = dict(await self.db.fetchall(
+            f'SELECT id, status FROM ads WHERE id IN ({placeholders})', ad_ids
+        ))
+        
+        own = other = None
+        for ad_id, owner_id, score in similar:
+            status = statuses.get(ad_id)
+            if status is None:
+                # Объявление уже в архиве
+                self.duplicates.remove(ad_id)
+            elif owner_id == user_id:
+                own = own or (ad_id, status)
+            elif status in ('pending', 'approved'):
+                other = other or (ad_id, score)
+        return own, other
+
+    async def merge_repost(self, own, user_id, ad_data, signature):
+        """Повтор своего объявления: ожидающее обновляется, остальное отклоняется без модерации"""
+        ad_id, status = own
+        if status == 'pending':
+            def update(conn):
+                updated = conn.execute('''
+                    UPDATE ads SET title = ?, description = ?, price = ?, category = ?,
+                        photo_id = COALESCE(?, photo_id)
+                    WHERE id = ? AND status = 'pending'
+                ''', (ad_data['title'], ad_data['description'], ad_data['price'],
+                      ad_data['category'], ad_data.get('photo'), ad_id)).rowcount
+                if updated:
+                    dedup.store(conn, ad_id, user_id, signature)
+                return updated
+            
+            if await self.db.write(update):
+                self.duplicates.add(ad_id, user_id, signature)
+                self.duplicates.merged += 1
+                return (
+                    f"🔁 Похожее объявление №{ad_id} уже ждет модерации.\n"
+                    "Мы обновили его новыми данными — повторная заявка не нужна."
+                )
+        
+        self.duplicates.rejected += 1
+        if status == 'approved':
+            return (
+                f"♻️ Такое объявление у вас уже опубликовано: №{ad_id}.\n"
+                "Подавать его заново не нужно — продлить срок можно из напоминания."
+            )
+        if status == 'rejected':
+            return (
+                f"❌ Похожее объявление №{ad_id} уже отклонено модератором.\n"
+                "Если это другой товар, опишите его подробнее."
+            )
+        return f"♻️ Похожее объявление №{ad_id} уже рассмотрено модератором."
+
+    async def notify_admin(self, context: ContextTypes.DEFAULT_TYPE, ad_id: int, ad_data: dict, user, similar=None):
+        """Уведомление администратора о новом объявлении; similar — (id, похожесть) чужого похожего"""
         try:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            
+            # Во время наплыва объявлений вместо отдельных сообщений — одна сводка
+            if self.admin_backlog or now - self.admin_notified_at < ADMIN_NOTIFY_INTERVAL:
+                self.admin_backlog += 1
+                if self.admin_digest is None:
+                    delay = self.admin_notified_at + ADMIN_NOTIFY_INTERVAL - now
+                    self.admin_digest = loop.call_later(max(delay, 0), self.send_admin_digest)
+                return
+            
+            self.admin_notified_at = now
             keyboard = [
                 [
                     InlineKeyboardButton("✅ Одобрить", callback_data=f"approve_{ad_id}"),
@@ -253,16 +399,18 @@ class FleaMarketBot:
                 f"💰 Цена: {ad_data['price']} руб.\n"
                 f"📂 Категория: {ad_data['category']}"
             )
+            if similar is not None:
+                message_text += f"\n\n⚠️ Похоже на №{similar[0]} другого продавца ({similar[1]:.0%})"
             
             if ad_data.get('photo'):
-                await context.bot.send_photo(
+                self.outbox.send_photo(
                     chat_id=ADMIN_ID,
                     photo=ad_data['photo'],
                     caption=message_text,
                     reply_markup=reply_markup
                 )
             else:
-                await context.bot.send_message(
+                self.outbox.send_message(
                     chat_id=ADMIN_ID,
                     text=message_text,
                     reply_markup=reply_markup
@@ -270,6 +418,26 @@ class FleaMarketBot:
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления администратору: {e}")
 
+    def send_admin_digest(self):
+        """Сводка о накопившихся новых объявлениях"""
+        self.outbox.send_message(
+            chat_id=ADMIN_ID,
+            text=f"🆕 Новых объявлений на модерации: {self.admin_backlog}\nОткрыть очередь: /moderate"
+        )
+        self.admin_backlog = 0
+        self.admin_digest = None
+        self.admin_notified_at = asyncio.get_running_loop().time()
+
+    async def set_ad_status(self, ad_id, status):
+        """Смена статуса ожидающего объявления, возвращает (user_id,) владельца или None"""
+        return await self.db.write(
+            lambda conn: conn.execute('''
+                UPDATE ads SET status = ?1,
+                    expires_at = CASE WHEN ?1 = 'approved' THEN datetime('now', ?2) ELSE expires_at END
+                WHERE id = ?3 AND status = 'pending' RETURNING user_id
+            ''', (status, self.lifecycle.ttl, ad_id)).fetchone()
+        )
+
     async def handle_moderation(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка модерации объявлений"""
         try:
@@ -279,44 +447,21 @@ class FleaMarketBot:
             data = query.data
             ad_id = int(data.split('_')[1])
             
-            conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
             if data.startswith('approve'):
-                cursor.execute('UPDATE ads SET status = "approved" WHERE id = ?', (ad_id,))
+                status = 'approved'
                 status_text = "одобрено"
-                
-                cursor.execute('SELECT user_id FROM ads WHERE id = ?', (ad_id,))
-                result = cursor.fetchone()
-                if result:
-                    user_id = result[0]
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=f"✅ Ваше объявление №{ad_id} было одобрено и опубликовано!"
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления пользователю: {e}")
-            
             elif data.startswith('reject'):
-                cursor.execute('UPDATE ads SET status = "rejected" WHERE id = ?', (ad_id,))
+                status = 'rejected'
                 status_text = "отклонено"
-                
-                cursor.execute('SELECT user_id FROM ads WHERE id = ?', (ad_id,))
-                result = cursor.fetchone()
-                if result:
-                    user_id = result[0]
-                    try:
-                        await context.bot.send_message(
-                            chat_id=user_id,
-                            text=f"❌ Ваше объявление №{ad_id} было отклонено модератором."
-                        )
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки уведомления пользователю: {e}")
             
-            conn.commit()
-            conn.close()
+            result = await self.set_ad_status(ad_id, status)
+            if result is None:
+                # Устаревшая кнопка: объявление уже прошло модерацию или ушло в архив
+                await query.edit_message_text(f"ℹ️ Объявление №{ad_id} уже прошло модерацию.")
+                return
             
+            self.notify_owners([(ad_id, result[0])], status)
+            await self.ads_moderated([ad_id], status)
             await query.edit_message_text(f"✅ Объявление №{ad_id} {status_text}!")
         except Exception as e:
             logger.error(f"Ошибка в handle_moderation: {e}")
@@ -324,46 +469,36 @@ class FleaMarketBot:
     async def my_ads(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать мои объявления"""
         try:
-            user = update.effective_user
-            
-            conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, title, description, price, category, status, created_at 
-                FROM ads WHERE user_id = ? ORDER BY created_at DESC
-            ''', (user.id,))
-            
-            ads = cursor.fetchall()
-            conn.close()
+            text, reply_markup = await self.build_page('my', update.effective_user.id, context)
             
-            if not ads:
-                await update.message.reply_text("📭 У вас пока нет объявлений.")
+            if text is None:
+                self.outbox.send_message(update.effective_chat.id, "📭 У вас пока нет объявлений.")
                 return
             
-            for ad in ads:
-                ad_id, title, description, price, category, status, created_at = ad
-                
-                status_emoji = {
-                    'pending': '⏳',
-                    'approved': '✅',
-                    'rejected': '❌'
-                }.get(status, '❓')
-                
-                message = (
-                    f"📦 Объявление №{ad_id}\n"
-                    f"📌 {title}\n"
-                    f"📝 {description}\n"
-                    f"💰 {price} руб.\n"
-                    f"📂 {category}\n"
-                    f"📅 {created_at[:10]}\n"
-                    f"Статус: {status_emoji} {status}\n"
-                )
-                
-                await update.message.reply_text(message)
+            self.outbox.send_message(update.effective_chat.id, text, reply_markup=reply_markup)
         except Exception as e:
             logger.error(f"Ошибка в my_ads: {e}")
 
+    def format_my_ad(self, ad):
+        """Карточка объявления в «Моих объявлениях»"""
+        ad_id, title, description, price, category, status, created_at, photo_id = ad
+        
+        status_emoji = {
+            'pending': '⏳',
+            'approved': '✅',
+            'rejected': '❌'
+        }.get(status, '❓')
+        
+        return (
+            f"📦 Объявление №{ad_id}{' 📷' if photo_id else ''}\n"
+            f"📌 {title}\n"
+            f"📝 {self.preview(description)}\n"
+            f"💰 {price} руб.\n"
+            f"📂 {category}\n"
+            f"📅 {created_at[:10]}\n"
+            f"Статус: {status_emoji} {status}"
+        )
+
     async def search_ads_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Начало поиска объявлений"""
         try:
@@ -378,62 +513,234 @@ class FleaMarketBot:
     async def search_ads(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Поиск объявлений"""
         try:
-            search_term = f"%{update.message.text}%"
+            match_query = search.build_match_query(update.message.text)
+            self.search_terms.record(update.message.text)
             
-            conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-            cursor = conn.cursor()
+            context.user_data['searching'] = False
+            # Одинаковые запросы в пределах TTL кеша получают общий момент «сейчас»
+            now = self.search_cache.reference_time(match_query, search.julian_now()) if match_query else search.julian_now()
+            context.user_data['search'] = {
+                'query': match_query, 'now': now, 'text': update.message.text
+            }
             
-            cursor.execute('''
-                SELECT a.id, a.title, a.description, a.price, a.category, a.photo_id, 
-                       u.username, u.first_name, a.created_at
-                FROM ads a
-                JOIN users u ON a.user_id = u.user_id
-                WHERE a.status = 'approved' 
-                AND (a.title LIKE ? OR a.description LIKE ? OR a.category LIKE ?)
-                ORDER BY a.created_at DESC
-                LIMIT 20
-            ''', (search_term, search_term, search_term))
+            text, reply_markup = (None, None)
+            if match_query:
+                text, reply_markup = await self.build_page('sr', update.effective_user.id, context)
             
-            ads = cursor.fetchall()
-            conn.close()
+            if text is None:
+                self.outbox.send_message(update.effective_chat.id, "😔 По вашему запросу ничего не найдено.")
+                return
             
-            context.user_data['searching'] = False
+            self.outbox.send_message(update.effective_chat.id, text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Ошибка в search_ads: {e}")
+
+    def format_search_ad(self, ad):
+        """Карточка объявления в результатах поиска"""
+        ad_id, title, description, price, category, photo_id, username, first_name, created_at, *_ = ad
+        
+        contact_info = f"@{username}" if username else first_name
+        
+        return (
+            f"📦 {title}{' 📷' if photo_id else ''}\n"
+            f"📝 {self.preview(description)}\n"
+            f"💰 {price} руб.\n"
+            f"📂 {category}\n"
+            f"👤 {contact_info}\n"
+            f"📅 {created_at[:10]}\n"
+            f"ID: {ad_id}"
+        )
+
+    def preview(self, text):
+        """Описание, укороченное для списка"""
+        if text and len(text) > DESCRIPTION_PREVIEW:
+            return text[:DESCRIPTION_PREVIEW].rstrip() + "…"
+        return text
+
+    async def fetch_page(self, next_sql, prev_sql, params, direction, anchor):
+        """Keyset-страница: (строки, есть_предыдущая, есть_следующая)
+        
+        Запрашивается на одну строку больше страницы, чтобы без COUNT
+        узнать, есть ли продолжение в направлении листания.
+        """
+        sql = prev_sql if direction == 'prev' else next_sql
+        rows = await self.db.fetchall(sql, (*params, *anchor, PAGE_SIZE + 1))
+        has_more = len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
+        
+        if direction == 'prev':
+            return rows[::-1], has_more, True
+        return rows, direction == 'next', has_more
+
+    async def build_page(self, kind, user_id, context, direction=None, anchor=None, number=1):
+        """Текст и клавиатура страницы выдачи; (None, None), если страница пуста"""
+        if kind == 'my':
+            rows, has_prev, has_next = await self.fetch_page(
+                MY_ADS_NEXT_SQL, MY_ADS_PREV_SQL, (user_id,), direction, anchor or MY_ADS_FIRST_ANCHOR
+            )
+            header = f"📋 Мои объявления — стр. {number}"
+            cards = [self.format_my_ad(row) for row in rows]
+            keys = [(row[6], row[0]) for row in rows]
+            photo_ids = [row[0] for row in rows if row[7]]
+        elif kind == 'br':
+            state = context.user_data.get('browse')
+            if not state:
+                return None, None
+            low, high = browse.bucket_range(state['bucket'])
+            rows, has_prev, has_next = await self.fetch_page(
+                browse.BROWSE_NEXT_SQL, browse.BROWSE_PREV_SQL, (state['category'], low, high),
+                direction, anchor or browse.BROWSE_FIRST_ANCHOR
+            )
+            header = f"🗂 {state['category']} · {browse.bucket_label(state['bucket'])} — стр. {number}"
+            cards = [self.format_search_ad(row) for row in rows]
+            keys = [(row[3], row[8], row[0]) for row in rows]
+            photo_ids = [row[0] for row in rows if row[5]]
+        else:
+            state = context.user_data.get('search')
+            if not state or not state.get('query'):
+                return None, None
+            cards, keys, photo_ids, has_prev, has_next = await self.search_page(state, direction, anchor)
+            header = f"🔍 Результаты поиска — стр. {number}"
+        
+        if not cards:
+            return None, None
+        
+        # Ключ строки-якоря передается в callback_data: page|вид|направление|номер|ключ...|id
+        buttons = []
+        if has_prev:
+            buttons.append(InlineKeyboardButton(
+                "◀", callback_data=f"page|{kind}|p|{number - 1}|{'|'.join(map(str, keys[0]))}"
+            ))
+        if has_next:
+            buttons.append(InlineKeyboardButton(
+                "▶", callback_data=f"page|{kind}|n|{number + 1}|{'|'.join(map(str, keys[-1]))}"
+            ))
+        keyboard = [buttons] if buttons else []
+        if kind == 'sr':
+            keyboard.append([InlineKeyboardButton("🔔 Подписаться на запрос", callback_data="sub|save")])
+        elif kind == 'br':
+            keyboard.append([
+                InlineKeyboardButton("⬆ Цены", callback_data=f"br|c|{CATEGORIES.index(state['category'])}"),
+                InlineKeyboardButton("🗂 Категории", callback_data="br|c"),
+            ])
+        if photo_ids:
+            keyboard.append([InlineKeyboardButton(
+                f"📷 Фото ({len(photo_ids)})", callback_data=f"photos|{','.join(map(str, photo_ids))}"
+            )])
+        reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
+        
+        return f"{header}\n\n" + "\n\n".join(cards), reply_markup
+
+    async def search_page(self, state, direction, anchor):
+        """Страница поиска из кеша или из базы: (карточки, ключи, ids с фото, есть_пред, есть_след)"""
+        key = (state['query'], state['now'], direction, anchor)
+        page = self.search_cache.get(key)
+        if page is not None:
+            return page
+        
+        generation = self.search_cache.generation
+        rows, has_prev, has_next = await self.fetch_page(
+            search.SEARCH_NEXT_SQL, search.SEARCH_PREV_SQL, (state['query'], state['now']),
+            direction, anchor or search.SEARCH_FIRST_ANCHOR
+        )
+        cards = [self.format_search_ad(row) for row in rows]
+        keys = [(row[9], row[0]) for row in rows]
+        photo_ids = [row[0] for row in rows if row[5]]
+        self.search_cache.put(
+            key, generation, search.query_tokens(state['query']),
+            [(row[0], row[10], card) for row, card in zip(rows, cards)],
+            keys, photo_ids, has_prev, has_next
+        )
+        return cards, keys, photo_ids, has_prev, has_next
+
+    async def handle_page(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Листание страниц выдачи"""
+        try:
+            query = update.callback_query
+            
+            _, kind, direction, number, *key = query.data.split('|')
+            if kind == 'sr':
+                anchor = (float(key[0]), int(key[1]))
+            elif kind == 'br':
+                anchor = (float(key[0]), key[1], int(key[2]))
+            else:
+                anchor = (key[0], int(key[1]))
             
-            if not ads:
-                await update.message.reply_text("😔 По вашему запросу ничего не найдено.")
+            text, reply_markup = await self.build_page(
+                kind, update.effective_user.id, context,
+                'prev' if direction == 'p' else 'next', anchor, int(number)
+            )
+            
+            if text is None:
+                await query.answer("Результаты устарели, повторите запрос.")
                 return
             
-            await update.message.reply_text(f"🔍 Найдено объявлений: {len(ads)}")
+            await query.answer()
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Ошибка в handle_page: {e}")
+
+    async def browse(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Каталог: категории со счетчиками объявлений"""
+        try:
+            text, reply_markup = await self.build_categories_menu()
+            self.outbox.send_message(update.effective_chat.id, text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Ошибка в browse: {e}")
+
+    async def build_categories_menu(self):
+        """Кнопки категорий; счетчики — из агрегатов browse_facets"""
+        counts = await self.db.read(browse.read_category_counts)
+        buttons = [
+            InlineKeyboardButton(f"{category} · {counts.get(category, 0)}", callback_data=f"br|c|{index}")
+            for index, category in enumerate(CATEGORIES)
+        ]
+        keyboard = [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
+        return "🗂 Каталог — выберите категорию:", InlineKeyboardMarkup(keyboard)
+
+    async def build_buckets_menu(self, index):
+        """Кнопки ценовых диапазонов категории; (None, None), если в ней пусто"""
+        category = CATEGORIES[index]
+        counts = await self.db.read(browse.read_bucket_counts, category)
+        if not counts:
+            return None, None
+        
+        keyboard = [[InlineKeyboardButton(
+            f"{browse.bucket_label(None)} · {sum(counts.values())}", callback_data=f"br|b|{index}|a"
+        )]]
+        for bucket in sorted(counts):
+            keyboard.append([InlineKeyboardButton(
+                f"{browse.bucket_label(bucket)} · {counts[bucket]}", callback_data=f"br|b|{index}|{bucket}"
+            )])
+        keyboard.append([InlineKeyboardButton("⬆ Категории", callback_data="br|c")])
+        return f"🗂 {category} — выберите цену:", InlineKeyboardMarkup(keyboard)
+
+    async def handle_browse(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопки каталога: категория → диапазон цен → страницы объявлений"""
+        try:
+            query = update.callback_query
+            parts = query.data.split('|')
+            
+            if len(parts) == 2:
+                text, reply_markup = await self.build_categories_menu()
+            elif parts[1] == 'c':
+                text, reply_markup = await self.build_buckets_menu(int(parts[2]))
+            else:
+                index = int(parts[2])
+                context.user_data['browse'] = {
+                    'category': CATEGORIES[index],
+                    'bucket': None if parts[3] == 'a' else int(parts[3]),
+                }
+                text, reply_markup = await self.build_page('br', update.effective_user.id, context)
             
-            for ad in ads:
-                ad_id, title, description, price, category, photo_id, username, first_name, created_at = ad
-                
-                contact_info = f"@{username}" if username else first_name
-                
-                message = (
-                    f"📦 {title}\n"
-                    f"📝 {description}\n"
-                    f"💰 {price} руб.\n"
-                    f"📂 {category}\n"
-                    f"👤 {contact_info}\n"
-                    f"📅 {created_at[:10]}\n"
-                    f"ID: {ad_id}"
-                )
-                
-                try:
-                    if photo_id:
-                        await context.bot.send_photo(
-                            chat_id=update.effective_chat.id,
-                            photo=photo_id,
-                            caption=message
-                        )
-                    else:
-                        await update.message.reply_text(message)
-                except Exception as e:
-                    logger.error(f"Ошибка отправки объявления: {e}")
-                    await update.message.reply_text(message)
+            if text is None:
+                await query.answer("Здесь пока нет объявлений.")
+                return
+            
+            await query.answer()
+            await query.edit_message_text(text, reply_markup=reply_markup)
         except Exception as e:
-            logger.error(f"Ошибка в search_ads: {e}")
+            logger.error(f"Ошибка в handle_browse: {e}")
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда помощи"""
@@ -448,6 +755,8 @@ class FleaMarketBot:
                 "1. Нажмите '🔍 Поиск объявлений'\n"
                 "2. Введите ключевые слова\n"
                 "3. Выберите подходящее объявление\n\n"
+                "Каталог:\n"
+                "Нажмите '🗂 Каталог' и выберите категорию и цену\n\n"
                 "Правила:\n"
                 "• Запрещена продажа запрещенных товаров\n"
                 "• Будьте вежливы с другими пользователями\n"
@@ -466,28 +775,644 @@ class FleaMarketBot:
                 await update.message.reply_text("❌ У вас нет прав для этой команды.")
                 return
             
-            conn = sqlite3.connect('fleamarket.db', check_same_thread=False)
-            cursor = conn.cursor()
-            
-            cursor.execute('SELECT COUNT(*) FROM ads WHERE status = "pending"')
-            pending = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM ads WHERE status = "approved"')
-            approved = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT COUNT(*) FROM users')
-            users = cursor.fetchone()[0]
+            pending, approved, users, archived = await self.db.read(
+                stats.read_counters, 'ads:pending', 'ads:approved', 'users', 'archived'
+            )
             
-            conn.close()
+            cache = self.users.stats()
+            search_cache = self.search_cache.stats()
+            duplicates = self.duplicates.stats()
+            flood = self.flood.stats()
+            backup = self.backups.stats()
             
             stats_text = (
                 "📊 Статистика барахолки\n\n"
                 f"👥 Пользователей: {users}\n"
                 f"⏳ Ожидают модерации: {pending}\n"
                 f"✅ Опубликовано: {approved}\n"
+                f"🗄 В архиве: {archived}\n\n"
+                f"🗂 Кэш пользователей: {cache['size']}, "
+                f"попаданий {cache['hits']}, промахов {cache['misses']} "
+                f"({cache['hit_rate']:.0%})\n"
+                f"🔍 Кэш поиска: страниц {search_cache['pages']}, "
+                f"попаданий {search_cache['hits']}, промахов {search_cache['misses']} "
+                f"({search_cache['hit_rate']:.0%}), сбросов {search_cache['invalidations']}\n"
+                f"♻️ Повторы: объединено {duplicates['merged']}, отклонено {duplicates['rejected']}, "
+                f"помечено {duplicates['flagged']}\n"
+                f"🚦 Флуд-контроль: пропущено {flood['admitted']}, отложено {flood['deferred']}, "
+                f"отброшено {flood['dropped']}\n"
             )
+            if backup['last']:
+                stats_text += (
+                    f"💾 Копия базы: {os.path.basename(backup['last'])}, "
+                    f"{backup['size'] / 2**20:.1f} МБ за {backup['seconds']:.1f} с\n"
+                )
             
             await update.message.reply_text(stats_text)
         except Exception as e:
             logger.error(f"Ошибка в admin_stat:{e}2")
 
+    async def moderate(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Очередь модерации для администратора"""
+        try:
+            if update.effective_user.id != ADMIN_ID:
+                await update.message.reply_text("❌ У вас нет прав для этой команды.")
+                return
+            
+            context.user_data['moderation'] = {'after': 0, 'page': [], 'selected': []}
+            text, reply_markup = await self.build_moderation_page(context.user_data['moderation'])
+            await update.message.reply_text(text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Ошибка в moderate: {e}")
+
+    async def build_moderation_page(self, state, direction=None):
+        """Страница очереди модерации; state хранит якорь, id страницы и выбор"""
+        if direction == 'prev' and not state['page']:
+            # «◀» со старой пустой страницы — к началу очереди
+            state['after'] = 0
+            direction = None
+        anchor = state['page'][0] if direction == 'prev' else state['after']
+        rows, has_prev, has_next = await self.fetch_page(
+            MODERATION_NEXT_SQL, MODERATION_PREV_SQL, (), direction, (anchor,)
+        )
+        if not rows and (direction is not None or state['after'] > 0):
+            # Страница опустела (например, после массового действия) — к началу очереди
+            state['after'] = 0
+            return await self.build_moderation_page(state)
+        if direction is None:
+            has_prev = state['after'] > 0
+        if rows:
+            state['after'] = rows[0][0] - 1
+        state['page'] = [row[0] for row in rows]
+        
+        pending, = await self.db.read(stats.read_counters, 'ads:pending')
+        if not rows:
+            return f"🛡 Очередь модерации пуста (ожидают: {pending}).", None
+        
+        selected = set(state['selected'])
+        cards = []
+        for ad_id, title, description, price, category, photo_id, username, first_name in rows:
+            mark = "☑" if ad_id in selected else "☐"
+            contact_info = f"@{username}" if username else (first_name or "нет")
+            similar = self.duplicates.similar_to(ad_id)
+            cards.append(
+                f"{mark} №{ad_id}{' 📷' if photo_id else ''} · {title} · {price} руб.\n"
+                f"📂 {category} · 👤 {contact_info}\n"
+                f"📝 {self.preview(description)}"
+                + (f"\n⚠️ Похоже на №{similar[0][0]} ({similar[0][2]:.0%})" if similar else "")
+            )
+        
+        keyboard = [
+            [InlineKeyboardButton(f"{'☑' if ad_id in selected else '☐'} {ad_id}", callback_data=f"mod|t|{ad_id}")
+             for ad_id in state['page']],
+            [
+                InlineKeyboardButton("✅ Все на странице", callback_data="mod|approved|page"),
+                InlineKeyboardButton("❌ Все на странице", callback_data="mod|rejected|page"),
+            ],
+        ]
+        if selected:
+            keyboard.append([
+                InlineKeyboardButton(f"✅ Выбранные ({len(selected)})", callback_data="mod|approved|sel"),
+                InlineKeyboardButton(f"❌ Выбранные ({len(selected)})", callback_data="mod|rejected|sel"),
+            ])
+        navigation = []
+        if has_prev:
+            navigation.append(InlineKeyboardButton("◀", callback_data="mod|p"))
+        if has_next:
+            navigation.append(InlineKeyboardButton("▶", callback_data="mod|n"))
+        if navigation:
+            keyboard.append(navigation)
+        
+        text = f"🛡 Модерация — ожидают: {pending}\n\n" + "\n\n".join(cards)
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def moderate_bulk(self, ad_ids, status):
+        """Смена статуса пачки объявлений одной транзакцией: [(id, user_id)]"""
+        placeholders = ','.join('?' * len(ad_ids))
+        return await self.db.write(
+            lambda conn: conn.execute(f'''
+                UPDATE ads SET status = ?1,
+                    expires_at = CASE WHEN ?1 = 'approved' THEN datetime('now', ?2) ELSE expires_at END
+                WHERE status = 'pending' AND id IN ({placeholders})
+                RETURNING id, user_id
+            ''', (status, self.lifecycle.ttl, *ad_ids)).fetchall()
+        )
+
+    def notify_owners(self, moderated, status):
+        """Одно уведомление на владельца, сколько бы его объявлений ни прошло модерацию"""
+        by_user = {}
+        for ad_id, user_id in moderated:
+            by_user.setdefault(user_id, []).append(ad_id)
+        
+        for user_id, ad_ids in by_user.items():
+            numbers = ", ".join(f"№{ad_id}" for ad_id in sorted(ad_ids))
+            if len(ad_ids) == 1 and status == 'approved':
+                text = f"✅ Ваше объявление {numbers} было одобрено и опубликовано!"
+            elif len(ad_ids) == 1:
+                text = f"❌ Ваше объявление {numbers} было отклонено модератором."
+            elif status == 'approved':
+                text = f"✅ Ваши объявления {numbers} одобрены и опубликованы!"
+            else:
+                text = f"❌ Ваши объявления {numbers} отклонены модератором."
+            self.outbox.send_message(chat_id=user_id, text=text)
+
+    async def handle_moderation_queue(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопки очереди модерации: выбор, массовые действия, листание"""
+        try:
+            query = update.callback_query
+            state = context.user_data.get('moderation')
+            
+            if update.effective_user.id != ADMIN_ID or state is None:
+                await query.answer("Очередь устарела, откройте /moderate заново.")
+                return
+            
+            parts = query.data.split('|')
+            direction = None
+            answer = None
+            
+            if parts[1] == 't':
+                ad_id = int(parts[2])
+                selected = set(state['selected'])
+                selected ^= {ad_id}
+                state['selected'] = sorted(selected)
+            elif parts[1] in ('approved', 'rejected'):
+                status = parts[1]
+                ad_ids = state['page'] if parts[2] == 'page' else state['selected']
+                moderated = await self.moderate_bulk(ad_ids, status) if ad_ids else []
+                self.notify_owners(moderated, status)
+                if moderated:
+                    await self.ads_moderated([ad_id for ad_id, _ in moderated], status)
+                done = {ad_id for ad_id, _ in moderated}
+                state['selected'] = [ad_id for ad_id in state['selected'] if ad_id not in done]
+                answer = f"{'Одобрено' if status == 'approved' else 'Отклонено'}: {len(moderated)}"
+            elif parts[1] == 'n':
+                state['after'] = state['page'][-1] if state['page'] else state['after']
+                direction = 'next'
+            elif parts[1] == 'p':
+                direction = 'prev'
+            
+            text, reply_markup = await self.build_moderation_page(state, direction)
+            await query.answer(answer)
+            await query.edit_message_text(text, reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Ошибка в handle_moderation_queue: {e}")
+            try:
+                await update.callback_query.answer("Не удалось обновить очередь, откройте /moderate заново.")
+            except Exception:
+                pass
+
+    async def ads_moderated(self, ad_ids, status):
+        """После смены статуса: точный сброс кеша поиска и уведомление подписчиков"""
+        try:
+            for ad_id in ad_ids:
+                self.search_cache.invalidate_ad(ad_id)
+            if status != 'approved':
+                return
+            
+            placeholders = ','.join('?' * len(ad_ids))
+            ads = await self.db.fetchall(f'''
+                SELECT id, user_id, title, description, category, price FROM ads WHERE id IN ({placeholders})
+            ''', ad_ids)
+            # Опубликованное объявление появляется в выдаче запросов, все слова которых в нём есть
+            for ad_id, _, title, description, category, _ in ads:
+                self.search_cache.invalidate_ad(ad_id, search.index_tokens(f'{title} {description} {category}'))
+            
+            self.notify_subscribers(ads)
+        except Exception as e:
+            logger.error(f"Ошибка обработки модерации: {e}")
+
+    def notify_subscribers(self, ads):
+        """Уведомление подписчиков о новых опубликованных объявлениях"""
+        try:
+            for ad_id, owner_id, title, description, category, price in ads:
+                notified = {owner_id}
+                for _, user_id, query in self.saved_searches.match(title, description, category, price):
+                    if user_id in notified:
+                        continue
+                    notified.add(user_id)
+                    self.outbox.send_message(
+                        chat_id=user_id,
+                        text=(
+                            f"🔔 Новое объявление по подписке «{query}»\n\n"
+                            f"📦 {title}\n"
+                            f"💰 {price} руб.\n"
+                            f"📂 {category}\n"
+                            f"ID: {ad_id}"
+                        )
+                    )
+        except Exception as e:
+            logger.error(f"Ошибка уведомления подписчиков: {e}")
+
+    def notify_expiring(self, ads):
+        """Предупреждение владельцам о скором окончании срока с кнопками продления"""
+        by_user = {}
+        for ad_id, user_id, title, expires_at in ads:
+            by_user.setdefault(user_id, []).append((ad_id, title, expires_at))
+        
+        for user_id, user_ads in by_user.items():
+            lines = ["⏳ Скоро закончится срок публикации:"]
+            keyboard = []
+            for ad_id, title, expires_at in user_ads:
+                lines.append(f"• №{ad_id} {title} — до {expires_at[:10]}")
+                keyboard.append([InlineKeyboardButton(f"🔄 Продлить №{ad_id}", callback_data=f"renew|{ad_id}")])
+            lines.append("\nПосле окончания срока объявление будет снято с публикации.")
+            self.outbox.send_message(
+                chat_id=user_id, text="\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+
+    def ads_archived(self, rows):
+        """Объявления перенесены в архив: сброс кеша поиска, уведомление о снятых с публикации"""
+        expired = []
+        for ad_id, user_id, title, status in rows:
+            self.duplicates.remove(ad_id)
+            if status == 'approved':
+                self.search_cache.invalidate_ad(ad_id)
+                expired.append((ad_id, user_id))
+        
+        by_user = {}
+        for ad_id, user_id in expired:
+            by_user.setdefault(user_id, []).append(ad_id)
+        for user_id, ad_ids in by_user.items():
+            numbers = ", ".join(f"№{ad_id}" for ad_id in sorted(ad_ids))
+            self.outbox.send_message(
+                chat_id=user_id,
+                text=f"⌛ Срок публикации истек, сняты с публикации: {numbers}.\n"
+                     "Чтобы продать вещь, подайте объявление заново."
+            )
+
+    async def handle_renew(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопка «Продлить» в предупреждении об окончании срока"""
+        try:
+            query = update.callback_query
+            ad_id = int(query.data.split('|')[1])
+            
+            expires_at = await self.lifecycle.renew(ad_id, update.effective_user.id)
+            if expires_at is None:
+                await query.answer("Объявление уже снято с публикации.")
+                return
+            
+            await query.answer(f"Продлено до {expires_at[:10]}")
+            await query.edit_message_reply_markup(InlineKeyboardMarkup([
+                row for row in query.message.reply_markup.inline_keyboard
+                if row[0].callback_data != query.data
+            ]))
+        except Exception as e:
+            logger.error(f"Ошибка в handle_renew: {e}")
+
+    async def save_subscription(self, user_id, text):
+        """Сохранение поиска; возвращает текст ответа пользователю"""
+        query, category, min_price, max_price = parse_subscription(text, CATEGORIES)
+        terms = search.terms(query)
+        if not terms and category is None:
+            return "❌ Укажите слова для поиска или категорию."
+        
+        def insert(conn):
+            count, = conn.execute('SELECT COUNT(*) FROM saved_searches WHERE user_id = ?', (user_id,)).fetchone()
+            if count >= savedsearch.MAX_PER_USER:
+                return None
+            return conn.execute('''
+                INSERT INTO saved_searches (user_id, query, terms, category, min_price, max_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, text, ' '.join(terms), category, min_price, max_price)).lastrowid
+        
+        sub_id = await self.db.write(insert)
+        if sub_id is None:
+            return f"❌ Можно сохранить не больше {savedsearch.MAX_PER_USER} поисков. Удалите лишние: /subscriptions"
+        
+        self.saved_searches.add(sub_id, user_id, text, terms, category, min_price, max_price)
+        return f"🔔 Подписка «{text}» сохранена. Пришлем новые объявления, как только они появятся."
+
+    async def subscribe(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Подписка на новые объявления: /subscribe запрос [категория] [от N] [до N]"""
+        try:
+            text = ' '.join(context.args or [])
+            if not text:
+                await update.message.reply_text(
+                    "🔔 Подписка на новые объявления:\n"
+                    "/subscribe велосипед детский до 5000\n"
+                    "/subscribe куртка Одежда от 1000 до 3000"
+                )
+                return
+            
+            await update.message.reply_text(await self.save_subscription(update.effective_user.id, text))
+        except Exception as e:
+            logger.error(f"Ошибка в subscribe: {e}")
+
+    async def subscriptions(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Список подписок пользователя"""
+        try:
+            rows = await self.db.fetchall(
+                'SELECT id, query FROM saved_searches WHERE user_id = ? ORDER BY id', (update.effective_user.id,)
+            )
+            if not rows:
+                await update.message.reply_text("🔕 У вас нет подписок. Оформить: /subscribe")
+                return
+            
+            keyboard = [[InlineKeyboardButton(f"🗑 {query}", callback_data=f"sub|del|{sub_id}")] for sub_id, query in rows]
+            await update.message.reply_text(
+                "🔔 Ваши подписки (нажмите, чтобы удалить):",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except Exception as e:
+            logger.error(f"Ошибка в subscriptions: {e}")
+
+    async def handle_subscription(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Кнопки подписок: сохранить текущий поиск, удалить подписку"""
+        try:
+            query = update.callback_query
+            user_id = update.effective_user.id
+            parts = query.data.split('|')
+            
+            if parts[1] == 'save':
+                state = context.user_data.get('search')
+                if not state or not state.get('text'):
+                    await query.answer("Поиск устарел, повторите запрос.")
+                    return
+                await query.answer()
+                self.outbox.send_message(update.effective_chat.id, await self.save_subscription(user_id, state['text']))
+            
+            elif parts[1] == 'del':
+                sub_id = int(parts[2])
+                deleted = await self.db.write(
+                    lambda conn: conn.execute(
+                        'DELETE FROM saved_searches WHERE id = ? AND user_id = ?', (sub_id, user_id)
+                    ).rowcount
+                )
+                if deleted:
+                    self.saved_searches.remove(sub_id)
+                await query.answer("Подписка удалена." if deleted else "Подписка не найдена.")
+                await query.edit_message_reply_markup(InlineKeyboardMarkup([
+                    row for row in query.message.reply_markup.inline_keyboard
+                    if row[0].callback_data != query.data
+                ]))
+        except Exception as e:
+            logger.error(f"Ошибка в handle_subscription: {e}")
+
+    async def admin_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Расширенный отчет для администратора"""
+        try:
+            if update.effective_user.id != ADMIN_ID:
+                await update.message.reply_text("❌ У вас нет прав для этой команды.")
+                return
+            
+            report = await self.db.read(stats.read_report)
+            
+            lines = ["📈 Отчет барахолки", "", "📂 По категориям:"]
+            for category, status, count in report['by_category']:
+                lines.append(f"• {category or 'без категории'} — {status}: {count}")
+            
+            lines += ["", "📅 По дням (подано / одобрено):"]
+            for day, submitted, approved in report['daily']:
+                lines.append(f"• {day}: {submitted} / {approved}")
+            
+            minutes = report['median_moderation_minutes']
+            if minutes is None:
+                lines += ["", "⏱ Медиана модерации: нет данных"]
+            else:
+                lines += ["", f"⏱ Медиана модерации: {minutes // 60} ч {minutes % 60} мин"]
+            
+            lines += ["", "🔍 Частые запросы:"]
+            for term, count in report['top_terms']:
+                lines.append(f"• {term} — {count}")
+            
+            await update.message.reply_text("\n".join(lines))
+        except Exception as e:
+            logger.error(f"Ошибка в admin_report: {e}")
+
+    async def backup_now(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Внеочередная резервная копия базы"""
+        try:
+            if update.effective_user.id != ADMIN_ID:
+                await update.message.reply_text("❌ У вас нет прав для этой команды.")
+                return
+            
+            path = await self.backups.run()
+            if path is None:
+                await update.message.reply_text("⏳ Копия уже снимается, попробуйте позже.")
+                return
+            backup = self.backups.stats()
+            await update.message.reply_text(
+                f"💾 Копия готова: {path}\n{backup['size'] / 2**20:.1f} МБ за {backup['seconds']:.1f} с"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка в backup_now: {e}")
+            await update.message.reply_text("❌ Не удалось снять копию базы.")
+
+    async def export_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/export ads|users [jsonl|csv] — выгрузка таблицы файлом"""
+        try:
+            if update.effective_user.id != ADMIN_ID:
+                await update.message.reply_text("❌ У вас нет прав для этой команды.")
+                return
+            
+            args = context.args or []
+            table = args[0] if args else 'ads'
+            fmt = args[1] if len(args) > 1 else 'jsonl'
+            if table not in bulk.TABLES or fmt not in bulk.FORMATS:
+                await update.message.reply_text("Использование: /export ads|users [jsonl|csv]")
+                return
+            
+            # Сжатый файл: документы бота ограничены 50 МБ
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, f"{table}.{fmt}.gz")
+                count = await bulk.export_file(self.db, table, path, fmt)
+                with open(path, 'rb') as document:
+                    await update.message.reply_document(
+                        document, filename=os.path.basename(path), caption=f"📤 {table}: {count} строк"
+                    )
+        except Exception as e:
+            logger.error(f"Ошибка в export_data: {e}")
+
+    async def import_data(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Файл с подписью /import ads|users — загрузка; повторная отправка продолжает прерванную"""
+        try:
+            if update.effective_user.id != ADMIN_ID:
+                await update.message.reply_text("❌ У вас нет прав для этой команды.")
+                return
+            
+            parts = update.message.caption.split()
+            table = parts[1] if len(parts) > 1 else None
+            if table not in bulk.TABLES:
+                await update.message.reply_text("Подпись к файлу: /import ads или /import users")
+                return
+            
+            if self.import_task is not None and not self.import_task.done():
+                await update.message.reply_text("⏳ Загрузка уже идёт, итог придёт сообщением.")
+                return
+            
+            # Загрузка идёт в фоне: обработчик не держит слот и очередь администратора
+            self.import_task = asyncio.create_task(
+                self.run_import(update.message.document, table, update.effective_chat.id)
+            )
+            await update.message.reply_text("📥 Загрузка началась, итог придёт сообщением.")
+        except Exception as e:
+            logger.error(f"Ошибка в import_data: {e}")
+
+    async def run_import(self, document, table, chat_id):
+        """Фоновая загрузка файла; итог — сообщением через очередь исходящих"""
+        try:
+            name = os.path.basename(document.file_name or 'import.jsonl')
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, name)
+                file = await document.get_file()
+                await file.download_to_drive(path)
+                result = await bulk.import_file(
+                    self.db, table, path, ttl_days=AD_TTL_DAYS, on_chunk=self.ads_imported
+                )
+            
+            if result['finished'] is not True:
+                status = "уже был загружен"
+            elif result['resumed_from']:
+                status = f"загрузка продолжена с записи {result['resumed_from']}"
+            else:
+                status = "загружен"
+            self.outbox.send_message(
+                chat_id, f"📥 Файл {status}: добавлено {result['imported']}, пропущено {result['skipped']}"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка загрузки файла: {e}")
+            self.outbox.send_message(chat_id, "❌ Загрузка прервалась. Отправьте тот же файл ещё раз, чтобы продолжить.")
+
+    def ads_imported(self, ads):
+        """Пачка загруженных объявлений записана: индекс повторов и кеш поиска"""
+        for ad_id, user_id, signature, status in ads:
+            self.duplicates.add(ad_id, user_id, signature)
+        if any(status == 'approved' for _, _, _, status in ads):
+            self.search_cache.clear()
+
+    async def send_page_photos(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Фото объявлений страницы одним альбомом"""
+        try:
+            query = update.callback_query
+            await query.answer()
+            
+            ad_ids = [int(ad_id) for ad_id in query.data.split('|')[1].split(',')]
+            placeholders = ','.join('?' * len(ad_ids))
+            
+            ads = await self.db.fetchall(f'''
+                SELECT id, title, price, photo_id FROM ads
+                WHERE id IN ({placeholders}) AND photo_id IS NOT NULL
+                AND (status = 'approved' OR user_id = ?)
+            ''', (*ad_ids, update.effective_user.id))
+            
+            # Подряд идущие фото очередь отправит одним send_media_group
+            for ad_id, title, price, photo_id in sorted(ads, key=lambda ad: ad_ids.index(ad[0])):
+                self.outbox.send_photo(
+                    chat_id=update.effective_chat.id,
+                    photo=photo_id,
+                    caption=f"📦 {title}\n💰 {price} руб.\nID: {ad_id}"
+                )
+        except Exception as e:
+            logger.error(f"Ошибка в send_page_photos: {e}")
+
+    async def post_init(self, application: Application):
+        """Запуск фоновых компонентов после инициализации приложения"""
+        self.outbox.start(application.bot)
+        self.users.start()
+        self.search_terms.start()
+        if application.job_queue is not None:
+            self.lifecycle.schedule(application.job_queue)
+            self.backups.schedule(application.job_queue)
+        else:
+            logger.warning(
+                "JobQueue недоступна (нужен python-telegram-bot[job-queue]): "
+                "сроки объявлений не проверяются, копии базы не снимаются"
+            )
+
+    async def post_stop(self, application: Application):
+        """Отправка оставшихся сообщений, пока бот ещё может отправлять"""
+        if self.import_task is not None:
+            # Прерванная загрузка продолжится при повторной отправке файла
+            self.import_task.cancel()
+            await asyncio.gather(self.import_task, return_exceptions=True)
+        await self.outbox.stop()
+
+    async def post_shutdown(self, application: Application):
+        """Остановка фоновых компонентов"""
+        await self.users.stop()
+        await self.search_terms.stop()
+        self.db.close()
+
+    def register_handlers(self, application: Application):
+        """Регистрация обработчиков"""
+        application.add_handler(CommandHandler("start", self.start))
+        application.add_handler(CommandHandler("help", self.help_command))
+        application.add_handler(CommandHandler("stats", self.admin_stats))
+        application.add_handler(CommandHandler("report", self.admin_report))
+        application.add_handler(CommandHandler("moderate", self.moderate))
+        application.add_handler(CommandHandler("subscribe", self.subscribe))
+        application.add_handler(CommandHandler("subscriptions", self.subscriptions))
+        application.add_handler(CommandHandler("browse", self.browse))
+        application.add_handler(CommandHandler("backup", self.backup_now))
+        application.add_handler(CommandHandler("export", self.export_data))
+        
+        application.add_handler(MessageHandler(filters.Regex("^📦 Добавить объявление$"), self.add_ad))
+        application.add_handler(MessageHandler(filters.Regex("^📋 Мои объявления$"), self.my_ads))
+        application.add_handler(MessageHandler(filters.Regex("^🔍 Поиск объявлений$"), self.search_ads_command))
+        application.add_handler(MessageHandler(filters.Regex("^🗂 Каталог$"), self.browse))
+        application.add_handler(MessageHandler(filters.Regex("^ℹ️ Помощь$"), self.help_command))
+        
+        application.add_handler(CallbackQueryHandler(self.handle_moderation, pattern=r"^(approve|reject)_\d+$"))
+        application.add_handler(CallbackQueryHandler(self.handle_page, pattern=r"^page\|"))
+        application.add_handler(CallbackQueryHandler(self.handle_moderation_queue, pattern=r"^mod\|"))
+        application.add_handler(CallbackQueryHandler(self.handle_subscription, pattern=r"^sub\|"))
+        application.add_handler(CallbackQueryHandler(self.send_page_photos, pattern=r"^photos\|"))
+        application.add_handler(CallbackQueryHandler(self.handle_renew, pattern=r"^renew\|\d+$"))
+        application.add_handler(CallbackQueryHandler(self.handle_browse, pattern=r"^br\|"))
+        
+        application.add_handler(MessageHandler(filters.Document.ALL & filters.CaptionRegex(r"^/import\b"), self.import_data))
+        application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+
+
+def build_application(bot, token=BOT_TOKEN, base_url=None, update_processor=None):
+    """Сборка Application с хранилищем состояния, параллельной обработкой апдейтов и метриками.
+
+    base_url позволяет направить бота на локальную замену Bot API (нагрузочные тесты).
+    """
+    processor = update_processor or PerUserUpdateProcessor(CONCURRENT_UPDATES, metrics.profiler_from_env())
+    # Флуд-контроль в обработчике апдейтов: лишние апдейты выбрасываются
+    # раньше, чем займут очередь пользователя или слот
+    processor.admission = bot.flood.admit
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(metrics.TimedRequest(connection_pool_size=BOT_API_CONNECTIONS))
+        .get_updates_request(metrics.TimedRequest())
+        .persistence(bot.persistence)
+        .concurrent_updates(processor)
+        .post_init(bot.post_init)
+        .post_stop(bot.post_stop)
+        .post_shutdown(bot.post_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    bot.register_handlers(application)
+    metrics.instrument_handlers(application)
+    metrics.REGISTRY.gauge('fleamarket_update_queue_size', 'Апдейты, ожидающие обработки',
+                           application.update_queue.qsize)
+    metrics.REGISTRY.gauge('fleamarket_outbox_pending', 'Сообщения в очереди исходящих', bot.outbox.pending)
+    for name, help_text in (('hits', 'Попадания в кеш поиска'), ('misses', 'Промахи кеша поиска'),
+                            ('invalidations', 'Страницы, сброшенные модерацией и сменой профиля')):
+        metrics.REGISTRY.gauge(f'fleamarket_search_cache_{name}_total', help_text,
+                               lambda name=name: bot.search_cache.stats()[name], kind='counter')
+    metrics.REGISTRY.gauge('fleamarket_search_cache_pages', 'Страницы в кеше поиска',
+                           lambda: bot.search_cache.stats()['pages'])
+    for name, help_text in (('deferred', 'Апдейты, отложенные флуд-контролем'),
+                            ('dropped', 'Апдейты, отброшенные флуд-контролем')):
+        metrics.REGISTRY.gauge(f'fleamarket_flood_{name}_total', help_text,
+                               lambda name=name: bot.flood.stats()[name], kind='counter')
+    return application
+
+
+def main():
+    """Точка входа: вебхук, если задан WEBHOOK_URL, иначе long polling"""
+    bot = FleaMarketBot(DB_PATH)
+    application = build_application(bot)
+    server = BotServer(application, port=PORT, webhook_url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+    asyncio.run(server.run())
+
+
+if __name__ == '__main__':
+    main()
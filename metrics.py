@@ -0,0 +1,338 @@
+import contextvars
+import cProfile
+import functools
+import heapq
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, с
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Сколько разных шаблонов SQL запоминать (IN-списки схлопываются)
+MAX_QUERY_TEMPLATES = 500
+QUERY_LABEL_LENGTH = 160
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self._values.items()):
+            yield f'{self.name}{_labels(self.label_names, labels)} {value}'
+
+
+class Gauge:
+    """Значение, которое вычисляется в момент запроса /metrics.
+
+    kind='counter' — для счётчиков, которые ведёт сам компонент (кеши).
+    """
+
+    def __init__(self, name, help_text, function, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.function = function
+        self.kind = kind
+
+    def render(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            logger.error(f"Ошибка метрики {self.name}: {e}")
+            return
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield f'{self.name} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки -> [счётчики корзин..., сумма, количество]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                index = i
+                break
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def snapshot(self):
+        """{метки: (количество, сумма)}"""
+        with self._lock:
+            return {labels: (series[-1], series[-2]) for labels, series in self._series.items()}
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        with self._lock:
+            series = sorted((labels, list(values)) for labels, values in self._series.items())
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                bucket = _labels(self.label_names, labels, 'le="%s"' % bound)
+                yield f'{self.name}_bucket{bucket} {cumulative}'
+            bucket = _labels(self.label_names, labels, 'le="+Inf"')
+            yield f'{self.name}_bucket{bucket} {values[-1]}'
+            yield f'{self.name}_sum{_labels(self.label_names, labels)} {values[-2]:.6f}'
+            yield f'{self.name}_count{_labels(self.label_names, labels)} {values[-1]}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, function, kind='gauge'):
+        return self._add(Gauge(name, help_text, function, kind))
+
+    def render(self):
+        """Текст в формате Prometheus exposition 0.0.4"""
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.histogram(
+    'fleamarket_handler_duration_seconds', 'Время работы обработчика', ('handler',))
+HANDLER_ERRORS = REGISTRY.counter(
+    'fleamarket_handler_errors_total', 'Ошибки обработчиков (исключения и logger.error)', ('handler',))
+UPDATE_SECONDS = REGISTRY.histogram(
+    'fleamarket_update_duration_seconds', 'Время обработки апдейта целиком')
+UPDATE_LOCK_WAIT_SECONDS = REGISTRY.histogram(
+    'fleamarket_update_lock_wait_seconds', 'Ожидание предыдущих апдейтов того же пользователя')
+SQL_SECONDS = REGISTRY.histogram(
+    'fleamarket_sql_duration_seconds', 'Время выполнения SQL по шаблону запроса', ('query',))
+SQL_ERRORS = REGISTRY.counter(
+    'fleamarket_sql_errors_total', 'Ошибки SQL по шаблону запроса', ('query',))
+API_SECONDS = REGISTRY.histogram(
+    'fleamarket_bot_api_duration_seconds', 'Время запроса к Bot API', ('method',))
+API_ERRORS = REGISTRY.counter(
+    'fleamarket_bot_api_errors_total', 'Ошибки запросов к Bot API', ('method',))
+
+# Обработчик, в контексте которого сейчас выполняется код
+_current_handler = contextvars.ContextVar('current_handler', default=None)
+
+
+# --- Обработчики ---
+
+def _timed_callback(callback):
+    name = getattr(callback, '__name__', type(callback).__name__)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = _current_handler.set(name)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+            _current_handler.reset(token)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def instrument_handlers(application):
+    """Оборачивает колбэки всех зарегистрированных обработчиков замером времени"""
+    root = logging.getLogger()
+    if not any(isinstance(handler, HandlerErrorCounter) for handler in root.handlers):
+        root.addHandler(HandlerErrorCounter())
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            if not getattr(handler.callback, 'instrumented', False):
+                handler.callback = _timed_callback(handler.callback)
+
+
+class HandlerErrorCounter(logging.Handler):
+    """Считает logger.error внутри обработчиков: они перехватывают свои исключения сами"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record):
+        handler = _current_handler.get()
+        if handler is not None:
+            HANDLER_ERRORS.inc(handler)
+
+
+# --- SQL ---
+
+_IN_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+# Схема и настройки соединений — разовые запросы, в метриках только шум
+_UNTRACKED = ('CREATE', 'DROP', 'ALTER', 'PRAGMA', 'ANALYZE')
+_query_labels = {}
+
+
+def query_label(sql):
+    label = _query_labels.get(sql)
+    if label is None:
+        label = _IN_LIST.sub('?…', ' '.join(sql.split()))[:QUERY_LABEL_LENGTH]
+        if len(_query_labels) < MAX_QUERY_TEMPLATES:
+            _query_labels[sql] = label
+    return label
+
+
+def observe_query(sql, seconds, failed):
+    """Хук Database: вызывается в потоке БД после каждого выполнения запроса"""
+    if sql.lstrip()[:7].upper().startswith(_UNTRACKED):
+        return
+    label = query_label(sql)
+    SQL_SECONDS.observe(seconds, label)
+    if failed:
+        SQL_ERRORS.inc(label)
+
+
+# --- Bot API ---
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest, замеряющий время и ошибки каждого метода Bot API"""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, request_data, **kwargs)
+        except Exception:
+            API_ERRORS.inc(api_method)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, api_method)
+        if status >= 400:
+            API_ERRORS.inc(api_method)
+        return status, payload
+
+
+# --- Профилирование медленных апдейтов ---
+
+class SlowUpdateProfiler:
+    """Выборочный профайлер: cProfile для доли апдейтов, дамп самых медленных.
+
+    Одновременно профилируется не больше одного апдейта. cProfile видит
+    весь поток event loop, поэтому в профиль попадает и работа соседних
+    апдейтов — дамп стоит читать как «что делал бот, пока этот апдейт
+    был медленным».
+    """
+
+    def __init__(self, sample_rate, directory='profiles', keep=10):
+        self.sample_rate = sample_rate
+        self.directory = directory
+        self.keep = keep
+        self._slowest = []  # куча (секунды, путь к дампу)
+        self._active = False
+        os.makedirs(directory, exist_ok=True)
+
+    async def run(self, update, coroutine):
+        if self._active or random.random() >= self.sample_rate:
+            await coroutine
+            return
+
+        self._active = True
+        profile = cProfile.Profile()
+        started = time.perf_counter()
+        profile.enable()
+        try:
+            await coroutine
+        finally:
+            profile.disable()
+            self._active = False
+            self._record(update, time.perf_counter() - started, profile)
+
+    def _record(self, update, seconds, profile):
+        if len(self._slowest) >= self.keep and seconds <= self._slowest[0][0]:
+            return
+        path = os.path.join(self.directory, f'update-{getattr(update, "update_id", 0)}-{seconds * 1000:.0f}ms.txt')
+        try:
+            self._dump(update, seconds, profile, path)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить профиль: {e}")
+            return
+        heapq.heappush(self._slowest, (seconds, path))
+        if len(self._slowest) > self.keep:
+            _, stale = heapq.heappop(self._slowest)
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _dump(update, seconds, profile, path):
+        out = io.StringIO()
+        out.write(f'update {getattr(update, "update_id", None)}: {seconds * 1000:.1f} мс\n')
+        if getattr(update, 'callback_query', None) is not None:
+            out.write(f'callback_data: {update.callback_query.data}\n')
+        elif getattr(update, 'effective_message', None) is not None:
+            out.write(f'text: {(update.effective_message.text or "")[:100]}\n')
+        out.write('\n')
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(40)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+
+
+def profiler_from_env():
+    """SlowUpdateProfiler по PROFILE_SAMPLE_RATE (0 — выключен) и PROFILE_DIR"""
+    rate = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+    if rate <= 0:
+        return None
+    return SlowUpdateProfiler(rate, os.getenv('PROFILE_DIR', 'profiles'), int(os.getenv('PROFILE_KEEP', '10')))
+
@@ -0,0 +1,140 @@
+import logging
+
+import browse
+import bulk
+import dedup
+import lifecycle
+import savedsearch
+import search
+import stats
+
+logger = logging.getLogger(__name__)
+
+# Каждая миграция — (версия, описание, шаги). Шаг — SQL-запрос или
+# функция fn(conn). Миграция применяется в одной транзакции вместе
+# с записью своей версии, поэтому её можно запускать на живой базе.
+# Шаги, которые нельзя выполнять в транзакции (VACUUM), помечаются
+# четвёртым элементом False: они идут вне транзакции и должны быть
+# идемпотентны, версия записывается следом.
+# Уже выпущенные миграции не редактируются — только добавляются новые.
+MIGRATIONS = [
+    (1, 'Базовые таблицы', (
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            registered_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS ads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            title TEXT NOT NULL,
+            description TEXT,
+            price REAL,
+            category TEXT,
+            photo_id TEXT,
+            status TEXT DEFAULT 'pending',
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    )),
+    (2, 'Полнотекстовый индекс объявлений', (
+        search.init_fts,
+    )),
+    (3, 'Индексы для горячих запросов', (
+        # Опубликованные/ожидающие по дате и счётчики по статусу
+        'CREATE INDEX IF NOT EXISTS idx_ads_status_created ON ads (status, created_at)',
+        # «Мои объявления»: WHERE user_id = ? ORDER BY created_at DESC
+        'CREATE INDEX IF NOT EXISTS idx_ads_user_created ON ads (user_id, created_at, status)',
+        # Отбор по категории и цене среди опубликованных
+        'CREATE INDEX IF NOT EXISTS idx_ads_category_status_price ON ads (category, status, price)',
+        'ANALYZE',
+    )),
+    (4, 'Хранилище состояния диалогов', (
+        '''
+        CREATE TABLE IF NOT EXISTS persistence_user_data (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS persistence_chat_data (
+            chat_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS persistence_kv (
+            key TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        ) WITHOUT ROWID
+        ''',
+    )),
+    (5, 'Материализованная статистика', stats.STATS_SCHEMA + stats.STATS_BACKFILL),
+    (6, 'Индекс очереди модерации', (
+        "CREATE INDEX IF NOT EXISTS idx_ads_pending ON ads (id) WHERE status = 'pending'",
+    )),
+    (7, 'Сохраненные поиски', savedsearch.SAVED_SEARCHES_SCHEMA),
+    (8, 'Срок публикации и архив объявлений', lifecycle.LIFECYCLE_SCHEMA),
+    (9, 'Инкрементальный vacuum', (lifecycle.enable_incremental_vacuum,), False),
+    (10, 'Каталог по категориям и ценам', browse.BROWSE_SCHEMA),
+    (11, 'Отпечатки объявлений для поиска повторов', dedup.DEDUP_SCHEMA + (dedup.backfill,)),
+    (12, 'Прогресс загрузки файлов', bulk.IMPORT_SCHEMA),
+    (13, 'Индекс поиска без префиксов', (search.drop_fts_prefix_index,)),
+    (14, 'Индекс «Моих объявлений» по ключу листания', (
+        # status между created_at и rowid не давал индексу отдать порядок
+        # (created_at, id): каждая страница сортировалась во временном B-дереве
+        'CREATE INDEX IF NOT EXISTS idx_ads_user_created_at ON ads (user_id, created_at)',
+        'DROP INDEX IF EXISTS idx_ads_user_created',
+        'ANALYZE idx_ads_user_created_at',
+    )),
+]
+
+
+def _create_version_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    return {row[0] for row in conn.execute('SELECT version FROM schema_migrations')}
+
+
+def _run_steps(conn, steps):
+    for step in steps:
+        if callable(step):
+            step(conn)
+        else:
+            conn.execute(step)
+
+
+def _record(conn, version, name):
+    conn.execute('INSERT INTO schema_migrations (version, name) VALUES (?, ?)', (version, name))
+
+
+def _apply(conn, version, name, steps):
+    _run_steps(conn, steps)
+    _record(conn, version, name)
+
+
+def migrate(db, migrations=MIGRATIONS):
+    """Применяет недостающие миграции по порядку, возвращает текущую версию"""
+    applied = db.run_write(_create_version_table)
+    for version, name, steps, *options in sorted(migrations, key=lambda migration: migration[0]):
+        if version in applied:
+            continue
+        if options and not options[0]:
+            db.run_autocommit(_run_steps, steps)
+            db.run_write(_record, version, name)
+        else:
+            db.run_write(_apply, version, name, steps)
+        applied.add(version)
+        logger.info(f"Применена миграция {version}: {name}")
+    return max(applied, default=0)
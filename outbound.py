@@ -0,0 +1,257 @@
+import asyncio
+import heapq
+import itertools
+import logging
+from collections import deque
+
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~30 сообщений в секунду всего и ~1 в секунду в один чат
+GLOBAL_RATE = 30.0
+CHAT_RATE = 1.0
+CHAT_BURST = 1
+# Альбом (send_media_group) вмещает от 2 до 10 фото
+ALBUM_SIZE = 10
+MAX_RETRIES = 3
+# Как часто выбрасывать корзины простаивающих чатов, с
+EVICT_INTERVAL = 60.0
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now, amount=1):
+        """Сколько секунд ждать, пока наберётся amount токенов"""
+        self._refill(now)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+    def consume(self, now, amount=1):
+        self._refill(now)
+        self.tokens -= amount
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('method', 'kwargs', 'future', 'attempts')
+
+    def __init__(self, method, kwargs, future):
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """Очередь исходящих сообщений с ограничением частоты.
+
+    Обработчики ставят сообщения в очередь и сразу возвращаются.
+    Диспетчер соблюдает общий лимит и лимит на чат (корзины токенов),
+    сохраняет порядок сообщений внутри чата, повторяет отправку после
+    RetryAfter и склеивает подряд идущие фото одного чата в альбом.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST):
+        self.bot = None
+        self._global_rate = global_rate
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._global = None
+        self._jobs = {}      # chat_id -> deque заданий
+        self._buckets = {}   # chat_id -> TokenBucket
+        self._schedule = []  # куча (ready_at, seq, chat_id) чатов, готовых к отправке
+        self._scheduled = set()
+        self._in_flight = set()
+        self._deliveries = set()  # задачи отправки: ссылка держит их до завершения
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        self._last_evict = 0.0
+
+    # --- Постановка в очередь ---
+
+    def send_message(self, chat_id, text, **kwargs):
+        """Ставит send_message в очередь; возвращает future с Message или None"""
+        return self._enqueue('send_message', dict(chat_id=chat_id, text=text, **kwargs))
+
+    def send_photo(self, chat_id, photo, caption=None, **kwargs):
+        """Ставит send_photo в очередь; подряд идущие фото уходят альбомом"""
+        return self._enqueue('send_photo', dict(chat_id=chat_id, photo=photo, caption=caption, **kwargs))
+
+    def pending(self):
+        """Сколько сообщений ждут отправки"""
+        return sum(len(jobs) for jobs in self._jobs.values())
+
+    def _enqueue(self, method, kwargs):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        chat_id = kwargs['chat_id']
+        self._jobs.setdefault(chat_id, deque()).append(_Job(method, kwargs, future))
+        self._idle.clear()
+        if chat_id not in self._in_flight:
+            self._schedule_chat(chat_id, loop.time())
+        return future
+
+    def _schedule_chat(self, chat_id, ready_at):
+        if chat_id in self._scheduled:
+            return
+        self._scheduled.add(chat_id)
+        heapq.heappush(self._schedule, (ready_at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    # --- Жизненный цикл ---
+
+    def start(self, bot):
+        self.bot = bot
+        loop = asyncio.get_running_loop()
+        self._global = TokenBucket(self._global_rate, self._global_rate, loop.time())
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=10.0):
+        """Дожидается отправки оставшихся сообщений и останавливает диспетчер"""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не отправлено сообщений: {self.pending()}, в отправке: {len(self._deliveries)}")
+        self._task.cancel()
+        self._task = None
+        for task in self._deliveries:
+            task.cancel()
+        await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    # --- Диспетчер ---
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now - self._last_evict > EVICT_INTERVAL:
+                self._evict(now)
+
+            if not self._schedule:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            ready_at = self._schedule[0][0]
+            if ready_at > now:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), ready_at - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, chat_id = heapq.heappop(self._schedule)
+            self._scheduled.discard(chat_id)
+
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst, now)
+            chat_delay = bucket.delay(now)
+            if chat_delay > 0:
+                self._schedule_chat(chat_id, now + chat_delay)
+                continue
+
+            jobs = self._take(chat_id)
+            global_delay = self._global.delay(now, len(jobs))
+            if global_delay > 0:
+                self._jobs[chat_id].extendleft(reversed(jobs))
+                self._schedule_chat(chat_id, now + global_delay)
+                continue
+
+            bucket.consume(now)
+            self._global.consume(now, len(jobs))
+            self._in_flight.add(chat_id)
+            task = asyncio.create_task(self._deliver(chat_id, jobs))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+
+    def _take(self, chat_id):
+        """Следующее задание чата или пачка подряд идущих фото для альбома"""
+        queue = self._jobs[chat_id]
+        jobs = [queue.popleft()]
+        if jobs[0].method == 'send_photo' and 'reply_markup' not in jobs[0].kwargs:
+            while (queue and len(jobs) < ALBUM_SIZE and queue[0].method == 'send_photo'
+                   and 'reply_markup' not in queue[0].kwargs):
+                jobs.append(queue.popleft())
+        return jobs
+
+    async def _deliver(self, chat_id, jobs):
+        loop = asyncio.get_running_loop()
+        ready_at = loop.time()
+        try:
+            results = await self._send(chat_id, jobs)
+        except asyncio.CancelledError:
+            # Остановка: ждущие ответа обработчики получают None
+            self._resolve(jobs, [None] * len(jobs))
+            raise
+        except RetryAfter as e:
+            logger.warning(f"Flood control для чата {chat_id}: повтор через {e.retry_after} с")
+            self._jobs[chat_id].extendleft(reversed(jobs))
+            ready_at += float(e.retry_after)
+        except (BadRequest, Forbidden) as e:
+            logger.error(f"Сообщение в чат {chat_id} не доставлено: {e}")
+            self._resolve(jobs, [None] * len(jobs))
+        except Exception as e:
+            retry = [job for job in jobs if job.attempts < MAX_RETRIES]
+            for job in retry:
+                job.attempts += 1
+            self._resolve([job for job in jobs if job not in retry], [None] * (len(jobs) - len(retry)))
+            if retry:
+                logger.warning(f"Ошибка отправки в чат {chat_id}, повтор: {e}")
+                self._jobs[chat_id].extendleft(reversed(retry))
+                ready_at += 2 ** max(job.attempts for job in retry)
+            else:
+                logger.error(f"Сообщение в чат {chat_id} не доставлено: {e}")
+        else:
+            self._resolve(jobs, results)
+        finally:
+            self._in_flight.discard(chat_id)
+
+        if self._jobs.get(chat_id):
+            self._schedule_chat(chat_id, ready_at)
+        else:
+            self._jobs.pop(chat_id, None)
+            if not self._jobs and not self._in_flight:
+                self._idle.set()
+
+    async def _send(self, chat_id, jobs):
+        if len(jobs) == 1:
+            job = jobs[0]
+            return [await getattr(self.bot, job.method)(**job.kwargs)]
+        media = [InputMediaPhoto(media=job.kwargs['photo'], caption=job.kwargs.get('caption')) for job in jobs]
+        return list(await self.bot.send_media_group(chat_id=chat_id, media=media))
+
+    @staticmethod
+    def _resolve(jobs, results):
+        for job, result in zip(jobs, results):
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _evict(self, now):
+        """Убирает корзины чатов без сообщений, которые уже полностью наполнились"""
+        self._last_evict = now
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                        if chat_id not in self._jobs and bucket.is_full(now)]:
+            del self._buckets[chat_id]
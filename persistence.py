@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передаёт изменения в хранилище, с
+FLUSH_INTERVAL = 5.0
+
+# Служебные ключи таблицы persistence_kv
+_BOT_DATA = 'bot_data'
+_CALLBACK_DATA = 'callback_data'
+_CONVERSATION = 'conversation:'
+
+
+def _dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLitePersistence(BasePersistence):
+    """Хранение user_data, chat_data и bot_data в SQLite.
+
+    Application раз в update_interval передаёт копии изменившихся данных;
+    они копятся в памяти, а затем сериализуются в JSON и записываются
+    одной транзакцией в потоке писателя, не нагружая event loop.
+    Состояние мастера объявления и поиска переживает перезапуск.
+    """
+
+    def __init__(self, db, update_interval=FLUSH_INTERVAL):
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.db = db
+        self._users = {}          # user_id -> dict или None (удалить)
+        self._chats = {}          # chat_id -> dict или None
+        self._kv = {}             # ключ -> данные
+        self._conversations = {}  # имя -> {ключ: состояние}
+        self._flush_task = None
+
+    # --- Загрузка при старте ---
+
+    async def get_user_data(self):
+        rows = await self.db.fetchall('SELECT user_id, data FROM persistence_user_data')
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def get_chat_data(self):
+        rows = await self.db.fetchall('SELECT chat_id, data FROM persistence_chat_data')
+        return {chat_id: json.loads(data) for chat_id, data in rows}
+
+    async def _get_kv(self, key, default):
+        row = await self.db.fetchone('SELECT data FROM persistence_kv WHERE key = ?', (key,))
+        return json.loads(row[0]) if row else default
+
+    async def get_bot_data(self):
+        return await self._get_kv(_BOT_DATA, {})
+
+    async def get_callback_data(self):
+        data = await self._get_kv(_CALLBACK_DATA, None)
+        if data is None:
+            return None
+        return [tuple(item) for item in data[0]], data[1]
+
+    async def get_conversations(self, name):
+        items = await self._get_kv(_CONVERSATION + name, [])
+        conversations = {tuple(key): state for key, state in items}
+        self._conversations[name] = dict(conversations)
+        return conversations
+
+    # --- Изменения: только в буфер ---
+
+    async def update_user_data(self, user_id, data):
+        self._users[user_id] = data
+        self._schedule_flush()
+
+    async def update_chat_data(self, chat_id, data):
+        self._chats[chat_id] = data
+        self._schedule_flush()
+
+    async def update_bot_data(self, data):
+        self._kv[_BOT_DATA] = data
+        self._schedule_flush()
+
+    async def update_callback_data(self, data):
+        self._kv[_CALLBACK_DATA] = data
+        self._schedule_flush()
+
+    async def update_conversation(self, name, key, new_state):
+        conversations = self._conversations.setdefault(name, {})
+        if new_state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = new_state
+        self._kv[_CONVERSATION + name] = [[list(key), state] for key, state in conversations.items()]
+        self._schedule_flush()
+
+    async def drop_user_data(self, user_id):
+        self._users[user_id] = None
+        self._schedule_flush()
+
+    async def drop_chat_data(self, chat_id):
+        self._chats[chat_id] = None
+        self._schedule_flush()
+
+    # Данные живут в памяти Application, перечитывать нечего
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    # --- Запись ---
+
+    def _schedule_flush(self):
+        # Application вызывает update_* пачкой; запись выполняется один раз,
+        # когда вся пачка уже в буфере
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        try:
+            await asyncio.sleep(0)
+            await self._write_pending()
+        except Exception as e:
+            logger.error(f"Ошибка записи состояния диалогов: {e}")
+            return
+        finally:
+            self._flush_task = None
+        if self._users or self._chats or self._kv:
+            self._schedule_flush()
+
+    async def _write_pending(self):
+        users, self._users = self._users, {}
+        chats, self._chats = self._chats, {}
+        kv, self._kv = self._kv, {}
+        if not (users or chats or kv):
+            return
+        try:
+            await self.db.write(self._write, users, chats, kv)
+        except Exception:
+            # Не теряем изменения: более свежие данные из буфера не затираем
+            for pending, restored in ((self._users, users), (self._chats, chats), (self._kv, kv)):
+                for key, data in restored.items():
+                    pending.setdefault(key, data)
+            raise
+
+    @staticmethod
+    def _rows(pending):
+        for key, data in pending.items():
+            if data is None:
+                continue
+            try:
+                yield key, _dumps(data)
+            except (TypeError, ValueError) as e:
+                logger.error(f"Данные {key} не сохранены: {e}")
+
+    @classmethod
+    def _write(cls, conn, users, chats, kv):
+        for table, column, pending in (('persistence_user_data', 'user_id', users),
+                                       ('persistence_chat_data', 'chat_id', chats)):
+            conn.executemany(f'INSERT OR REPLACE INTO {table} ({column}, data) VALUES (?, ?)', cls._rows(pending))
+            conn.executemany(
+                f'DELETE FROM {table} WHERE {column} = ?',
+                [(key,) for key, data in pending.items() if data is None]
+            )
+        conn.executemany('INSERT OR REPLACE INTO persistence_kv (key, data) VALUES (?, ?)', cls._rows(kv))
+
+    async def flush(self):
+        """Запись всего накопленного при остановке приложения"""
+        task = self._flush_task
+        if task is not None:
+            await task
+        await self._write_pending()
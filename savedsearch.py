@@ -0,0 +1,134 @@
+import re
+
+import search
+
+MAX_PER_USER = 20
+
+SAVED_SEARCHES_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS saved_searches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        query TEXT NOT NULL,
+        terms TEXT NOT NULL,
+        category TEXT,
+        min_price REAL,
+        max_price REAL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_saved_searches_user ON saved_searches (user_id)',
+)
+
+_NUMBER = re.compile(r'^\d+(?:[.,]\d+)?$')
+_RANGE = re.compile(r'^(\d+)-(\d+)$')
+
+
+def parse_subscription(text, categories):
+    """Разбор «запрос [категория] [от N] [до N] | [N-M]»: (запрос, категория, мин, макс)"""
+    # Название категории без эмодзи, по словам: «Для дома» — два слова запроса
+    names = sorted(
+        ((tuple(category.split(' ', 1)[-1].lower().split()), category) for category in categories),
+        key=lambda item: -len(item[0]),
+    )
+    words = text.split()
+    query, category, min_price, max_price = [], None, None, None
+    i = 0
+    while i < len(words):
+        word = words[i]
+        lower = word.lower()
+        range_match = _RANGE.match(word)
+        name = None
+        if category is None:
+            # Самое длинное название, слова которого идут подряд с этого места
+            name = next((item for item in names
+                         if tuple(w.lower() for w in words[i:i + len(item[0])]) == item[0]), None)
+        if lower in ('от', 'до') and i + 1 < len(words) and _NUMBER.match(words[i + 1]):
+            value = float(words[i + 1].replace(',', '.'))
+            if lower == 'от':
+                min_price = value
+            else:
+                max_price = value
+            i += 2
+            continue
+        if range_match:
+            min_price, max_price = float(range_match.group(1)), float(range_match.group(2))
+        elif name is not None:
+            category = name[1]
+            i += len(name[0])
+            continue
+        else:
+            query.append(word)
+        i += 1
+    return ' '.join(query), category, min_price, max_price
+
+
+class SavedSearchIndex:
+    """Перколятор: обратный индекс подписок по основам слов и категориям.
+
+    Каждая подписка индексируется по одному «якорному» слову — самому
+    длинному, как самому редкому, — а подписки без слов по категории.
+    Новое объявление проверяется только против подписок из постингов
+    своих слов и своей категории, а не против всех подписок.
+    """
+
+    def __init__(self):
+        self._subs = {}         # id -> (user_id, query, terms, category, min_price, max_price)
+        self._by_term = {}      # основа -> {id}
+        self._by_category = {}  # категория -> {id}
+
+    def __len__(self):
+        return len(self._subs)
+
+    def _index_key(self, terms, category):
+        if terms:
+            return self._by_term, max(terms, key=len)
+        return self._by_category, category
+
+    def add(self, sub_id, user_id, query, terms, category=None, min_price=None, max_price=None):
+        terms = frozenset(terms)
+        self._subs[sub_id] = (user_id, query, terms, category, min_price, max_price)
+        postings, key = self._index_key(terms, category)
+        postings.setdefault(key, set()).add(sub_id)
+
+    def remove(self, sub_id):
+        sub = self._subs.pop(sub_id, None)
+        if sub is None:
+            return
+        postings, key = self._index_key(sub[2], sub[3])
+        ids = postings.get(key)
+        if ids is not None:
+            ids.discard(sub_id)
+            if not ids:
+                del postings[key]
+
+    def load(self, conn):
+        """Перестройка индекса из SQLite при старте"""
+        self._subs.clear()
+        self._by_term.clear()
+        self._by_category.clear()
+        for sub_id, user_id, query, terms, category, min_price, max_price in conn.execute('''
+            SELECT id, user_id, query, terms, category, min_price, max_price FROM saved_searches
+        '''):
+            self.add(sub_id, user_id, query, terms.split(), category, min_price, max_price)
+        return len(self._subs)
+
+    def match(self, title, description, category, price):
+        """Подписки, которым соответствует объявление: [(id, user_id, query)]"""
+        ad_terms = set(search.terms(f'{title} {description or ""} {category or ""}'))
+        candidates = set(self._by_category.get(category, ()))
+        for term in ad_terms:
+            candidates.update(self._by_term.get(term, ()))
+
+        matches = []
+        for sub_id in candidates:
+            user_id, query, terms, sub_category, min_price, max_price = self._subs[sub_id]
+            if not terms <= ad_terms:
+                continue
+            if sub_category is not None and sub_category != category:
+                continue
+            if price is not None and ((min_price is not None and price < min_price)
+                                      or (max_price is not None and price > max_price)):
+                continue
+            matches.append((sub_id, user_id, query))
+        return matches
@@ -0,0 +1,208 @@
+import re
+import time
+
+# Упрощённый стеммер Портера (Snowball) для русского языка
+_RVRE = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(
+    r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$'
+)
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DER = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+_I = re.compile(r'и$')
+_SOFT_SIGN = re.compile(r'ь$')
+_NN = re.compile(r'нн$')
+_CYRILLIC = re.compile(r'[а-я]')
+_WORD = re.compile(r'\w+')
+
+# Сколько самых свежих совпадений ранжировать: ограничивает стоимость
+# частых запросов, поэтому задержка не растёт вместе с таблицей
+CANDIDATE_LIMIT = 1000
+# Через сколько дней вес объявления в выдаче падает вдвое
+RECENCY_DAYS = 30.0
+
+
+def stem(word):
+    """Основа русского слова; прочие слова возвращаются как есть"""
+    word = word.lower().replace('ё', 'е')
+    if not _CYRILLIC.search(word):
+        return word
+    match = _RVRE.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+
+    temp = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        temp = _ADJECTIVE.sub('', rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE.sub('', temp, 1)
+        else:
+            temp = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+
+    rv = _I.sub('', rv, 1)
+    if _DERIVATIONAL.match(rv):
+        rv = _DER.sub('', rv, 1)
+
+    temp = _SOFT_SIGN.sub('', rv, 1)
+    if temp == rv:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        rv = _NN.sub('н', rv, 1)
+    else:
+        rv = temp
+    return prefix + rv
+
+
+def terms(text):
+    """Нормализованные основы слов текста"""
+    return [stem(word) for word in _WORD.findall(text or '')]
+
+
+def stem_text(text):
+    """Текст для индекса FTS (SQL-функция ru_stem)"""
+    return ' '.join(terms(text))
+
+
+def build_match_query(text):
+    """Запрос FTS5: все основы обязательны; слово совпадает по основе целиком"""
+    words = [term.replace('"', '') for term in terms(text)]
+    words = [word for word in words if word]
+    if not words:
+        return None
+    return ' AND '.join(f'"{word}"' for word in words)
+
+
+_TOKEN = re.compile(r'[^\W_]+')
+_PHRASE = re.compile(r'"([^"]*)"')
+
+
+def index_tokens(text):
+    """Основы текста так, как их видит токенайзер FTS (unicode61 делит слова и по «_»)"""
+    return set(_TOKEN.findall(stem_text(text)))
+
+
+def query_tokens(match_query):
+    """Токены запроса FTS: объявление попадает в выдачу, только если содержит их все"""
+    return {token for phrase in _PHRASE.findall(match_query or '') for token in _TOKEN.findall(phrase)}
+
+
+# Функции, которые должны быть зарегистрированы на каждом соединении:
+# их вызывают триггеры индекса
+SQL_FUNCTIONS = {
+    'ru_stem': stem_text,
+}
+
+FTS_SCHEMA = (
+    '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS ads_fts USING fts5(
+        title, description, category,
+        tokenize = 'unicode61'
+    )
+    ''',
+    # В индексе только опубликованные объявления
+    '''
+    CREATE TRIGGER IF NOT EXISTS ads_fts_insert AFTER INSERT ON ads
+    WHEN new.status = 'approved' BEGIN
+        INSERT INTO ads_fts (rowid, title, description, category)
+        VALUES (new.id, ru_stem(new.title), ru_stem(new.description), ru_stem(new.category));
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ads_fts_delete AFTER DELETE ON ads
+    WHEN old.status = 'approved' BEGIN
+        DELETE FROM ads_fts WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS ads_fts_update AFTER UPDATE OF status, title, description, category ON ads
+    BEGIN
+        DELETE FROM ads_fts WHERE rowid = old.id AND old.status = 'approved';
+        INSERT INTO ads_fts (rowid, title, description, category)
+        SELECT new.id, ru_stem(new.title), ru_stem(new.description), ru_stem(new.category)
+        WHERE new.status = 'approved';
+    END
+    ''',
+)
+
+FTS_BACKFILL = '''
+    INSERT INTO ads_fts (rowid, title, description, category)
+    SELECT id, ru_stem(title), ru_stem(description), ru_stem(category)
+    FROM ads WHERE status = 'approved'
+'''
+
+# bm25 отрицателен (меньше — лучше), старые объявления прижимаются к нулю.
+# Страницы выдачи листаются по ключу (rank, id); момент «сейчас» передаётся
+# параметром и фиксируется на время просмотра, чтобы rank не сдвигался.
+_SEARCH_PAGE_SQL = '''
+    WITH candidates AS (
+        SELECT rowid AS ad_id, bm25(ads_fts, 10.0, 2.0, 5.0) AS score
+        FROM ads_fts WHERE ads_fts MATCH ?
+        ORDER BY rowid DESC
+        LIMIT {candidate_limit}
+    ),
+    ranked AS (
+        SELECT a.id, a.title, a.description, a.price, a.category, a.photo_id,
+               u.username, u.first_name, a.created_at,
+               c.score / (1.0 + (? - julianday(a.created_at)) / {recency_days}) AS rank,
+               a.user_id
+        FROM candidates c
+        JOIN ads a ON a.id = c.ad_id
+        JOIN users u ON a.user_id = u.user_id
+        WHERE a.status = 'approved'
+    )
+    SELECT * FROM ranked
+    WHERE (rank, id) {op} (?, ?)
+    ORDER BY rank {order}, id {order}
+    LIMIT ?
+'''
+SEARCH_NEXT_SQL = _SEARCH_PAGE_SQL.format(
+    candidate_limit=CANDIDATE_LIMIT, recency_days=RECENCY_DAYS, op='>', order='ASC'
+)
+SEARCH_PREV_SQL = _SEARCH_PAGE_SQL.format(
+    candidate_limit=CANDIDATE_LIMIT, recency_days=RECENCY_DAYS, op='<', order='DESC'
+)
+# Ключ «перед первой строкой» для первой страницы
+SEARCH_FIRST_ANCHOR = (float('-inf'), 0)
+
+
+def julian_now():
+    """Текущий момент в юлианских днях, как julianday('now') в SQLite"""
+    return time.time() / 86400.0 + 2440587.5
+
+
+def drop_fts_prefix_index(conn):
+    """Пересоздаёт индекс без префиксных индексов: запросы ищут основы целиком и их не используют"""
+    sql, = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'ads_fts'"
+    ).fetchone()
+    if 'prefix' not in sql:
+        return
+    conn.execute('DROP TABLE ads_fts')
+    for statement in FTS_SCHEMA:
+        conn.execute(statement)
+    conn.execute(FTS_BACKFILL)
+
+
+def init_fts(conn):
+    """Создаёт индекс и при первом запуске заполняет его существующими объявлениями"""
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ads_fts'"
+    ).fetchone()
+    for statement in FTS_SCHEMA:
+        conn.execute(statement)
+    if not exists:
+        conn.execute(FTS_BACKFILL)
@@ -0,0 +1,154 @@
+import time
+from collections import OrderedDict
+
+# Сколько живёт страница выдачи и момент «сейчас» популярного запроса, с
+CACHE_TTL = 300.0
+CACHE_SIZE = 2000
+CARDS_SIZE = 20000
+
+
+class SearchCache:
+    """TTL+LRU кеш страниц поисковой выдачи и общих карточек объявлений.
+
+    Ключ страницы — (запрос FTS, момент «сейчас», направление, якорь).
+    Все, кто ищет один запрос в пределах TTL, получают один момент «сейчас»,
+    поэтому и первые, и следующие страницы у них общие. Карточки хранятся
+    отдельно по id объявления и переиспользуются разными запросами.
+
+    Сброс точный: смена статуса объявления удаляет страницы, где оно есть,
+    а публикация — ещё и страницы запросов, все основы которых есть в
+    объявлении; смена профиля пользователя удаляет страницы с его
+    объявлениями. Поколение отсекает страницы, прочитанные до сброса.
+    """
+
+    def __init__(self, capacity=CACHE_SIZE, cards=CARDS_SIZE, ttl=CACHE_TTL, clock=time.monotonic):
+        self.capacity = capacity
+        self.cards_capacity = cards
+        self.ttl = ttl
+        self.clock = clock
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._heads = {}             # запрос -> (момент «сейчас», истекает)
+        self._pages = OrderedDict()  # ключ -> (истекает, страница, основы запроса, ids, владельцы)
+        self._cards = OrderedDict()  # ad_id -> (user_id, карточка)
+        self._by_ad = {}             # ad_id -> {ключ}
+        self._by_user = {}           # user_id -> {ключ}
+
+    # --- Чтение ---
+
+    def reference_time(self, query, now):
+        """Момент «сейчас» для нового поиска: общий для запроса в пределах TTL"""
+        moment = self.clock()
+        head = self._heads.get(query)
+        if head is not None and head[1] > moment:
+            return head[0]
+        if len(self._heads) >= self.capacity:
+            self._heads = {key: value for key, value in self._heads.items() if value[1] > moment}
+            if len(self._heads) >= self.capacity:
+                self._heads.clear()
+        self._heads[query] = (now, moment + self.ttl)
+        return now
+
+    def get(self, key):
+        """Страница (карточки, ключи, ids с фото, есть_пред, есть_след) или None"""
+        entry = self._pages.get(key)
+        if entry is not None and entry[0] <= self.clock():
+            self._drop(key)
+            entry = None
+        if entry is not None:
+            cards = [self._cards.get(ad_id) for ad_id in entry[3]]
+            if None in cards:
+                self._drop(key)
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._pages.move_to_end(key)
+        for ad_id in entry[3]:
+            self._cards.move_to_end(ad_id)
+        keys, photo_ids, has_prev, has_next = entry[1]
+        return [text for _, text in cards], keys, photo_ids, has_prev, has_next
+
+    # --- Запись ---
+
+    def put(self, key, generation, terms, ads, keys, photo_ids, has_prev, has_next):
+        """Кладёт страницу; ads — [(ad_id, user_id, карточка)].
+
+        generation — значение self.generation до чтения из базы: если с тех пор
+        был сброс, страница могла устареть и не кешируется.
+        """
+        if generation != self.generation:
+            return
+        if key in self._pages:
+            self._drop(key)
+        ad_ids = tuple(ad_id for ad_id, _, _ in ads)
+        owners = frozenset(user_id for _, user_id, _ in ads)
+        self._pages[key] = (self.clock() + self.ttl, (keys, photo_ids, has_prev, has_next),
+                            frozenset(terms), ad_ids, owners)
+        for ad_id, user_id, card in ads:
+            self._cards[ad_id] = (user_id, card)
+            self._cards.move_to_end(ad_id)
+            self._by_ad.setdefault(ad_id, set()).add(key)
+        for user_id in owners:
+            self._by_user.setdefault(user_id, set()).add(key)
+
+        while len(self._pages) > self.capacity:
+            self._drop(next(iter(self._pages)))
+        while len(self._cards) > self.cards_capacity:
+            self._cards.popitem(last=False)
+
+    def _drop(self, key):
+        entry = self._pages.pop(key, None)
+        if entry is None:
+            return
+        for index, ids in ((self._by_ad, entry[3]), (self._by_user, entry[4])):
+            for item in ids:
+                keys = index.get(item)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[item]
+
+    # --- Сброс ---
+
+    def invalidate_ad(self, ad_id, terms=None):
+        """Объявление сменило статус; terms — основы опубликованного объявления"""
+        self.generation += 1
+        keys = set(self._by_ad.get(ad_id, ()))
+        if terms is not None:
+            terms = set(terms)
+            keys.update(key for key, entry in self._pages.items() if entry[2] <= terms)
+        self._cards.pop(ad_id, None)
+        self._invalidate(keys)
+
+    def invalidate_user(self, user_id):
+        """Изменился профиль пользователя: его контакт есть в карточках"""
+        self.generation += 1
+        # Карточки читаются только через страницы и перезаписываются при put
+        self._invalidate(set(self._by_user.get(user_id, ())))
+
+    def clear(self):
+        """Сброс всех страниц (массовая загрузка объявлений)"""
+        self.generation += 1
+        self._invalidate(set(self._pages))
+        self._cards.clear()
+
+    def _invalidate(self, keys):
+        for key in keys:
+            self._drop(key)
+        self.invalidations += len(keys)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'pages': len(self._pages),
+            'cards': len(self._cards),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'invalidations': self.invalidations,
+        }
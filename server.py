@@ -0,0 +1,121 @@
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = '/webhook'
+HEALTH_PATH = '/health'
+METRICS_PATH = '/metrics'
+# Заголовок, в котором Telegram передаёт secret_token вебхука
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class BotServer:
+    """Встроенный aiohttp-сервер: приём вебхуков, проверка здоровья и метрики.
+
+    В режиме вебхука апдейты из POST-запросов кладутся в update_queue
+    приложения, в режиме long polling их получает Updater, а сервер
+    отвечает только на /health и /metrics (Render требует открытый порт у web-сервиса).
+    """
+
+    def __init__(self, application, host='0.0.0.0', port=8080, webhook_url=None, secret_token=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.webhook_url = webhook_url
+        self.secret_token = secret_token
+        self.app = web.Application()
+        self.app.router.add_get(HEALTH_PATH, self.health)
+        self.app.router.add_get(METRICS_PATH, self.metrics)
+        if webhook_url:
+            self.app.router.add_post(WEBHOOK_PATH, self.webhook)
+        self._runner = None
+
+    @property
+    def mode(self):
+        return 'webhook' if self.webhook_url else 'polling'
+
+    async def health(self, request):
+        running = self.application.running
+        return web.json_response({
+            'status': 'ok' if running else 'starting',
+            'mode': self.mode,
+            'update_queue': self.application.update_queue.qsize(),
+        }, status=200 if running else 503)
+
+    async def metrics(self, request):
+        return web.Response(body=metrics.REGISTRY.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    async def webhook(self, request):
+        if self.secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_HEADER, ''), self.secret_token):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.error(f"Некорректный апдейт в вебхуке: {e}")
+            return web.Response(status=400)
+        # Ответ Telegram сразу; обработка идёт в фоне через очередь приложения
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f"🌐 HTTP-сервер слушает {self.host}:{self.port} ({self.mode})")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def run(self, drop_pending_updates=False):
+        """Запуск приложения и сервера до SIGINT/SIGTERM"""
+        application = self.application
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        await application.initialize()
+        try:
+            if application.post_init:
+                await application.post_init(application)
+            await self.start()
+            if self.webhook_url:
+                await application.bot.set_webhook(
+                    url=self.webhook_url.rstrip('/') + WEBHOOK_PATH,
+                    secret_token=self.secret_token,
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=drop_pending_updates,
+                )
+            else:
+                await application.updater.start_polling(
+                    allowed_updates=Update.ALL_TYPES,
+                    drop_pending_updates=drop_pending_updates,
+                )
+            await application.start()
+            logger.info("🤖 Бот запущен")
+            await stop.wait()
+        finally:
+            logger.info("Остановка бота...")
+            if application.updater.running:
+                await application.updater.stop()
+            if application.running:
+                await application.stop()
+            # Очередь исходящих дописывается здесь: после shutdown у бота уже нет HTTP-клиента
+            if application.post_stop:
+                await application.post_stop(application)
+            await self.stop()
+            await application.shutdown()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
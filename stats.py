@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+# Пауза между записями накопленных поисковых запросов, с
+FLUSH_INTERVAL = 5.0
+# Длина запроса, который учитывается в статистике
+MAX_TERM_LENGTH = 64
+
+# Счётчики и сводки поддерживаются триггерами на ads и users, поэтому
+# ни /stats, ни отчёт администратора не сканируют таблицу объявлений.
+STATS_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_category_status (
+        category TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (category, status)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        submitted INTEGER NOT NULL DEFAULT 0,
+        approved INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    # Гистограмма времени модерации в минутах
+    '''
+    CREATE TABLE IF NOT EXISTS stats_moderation_minutes (
+        minutes INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_search_terms (
+        term TEXT PRIMARY KEY,
+        count INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_stats_search_terms_count ON stats_search_terms (count)',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('users', 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_users_delete AFTER DELETE ON users BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_ads_insert AFTER INSERT ON ads BEGIN
+        INSERT INTO stats_counters (name, value) VALUES ('ads:' || COALESCE(new.status, ''), 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1;
+        INSERT INTO stats_category_status (category, status, count)
+        VALUES (COALESCE(new.category, ''), COALESCE(new.status, ''), 1)
+        ON CONFLICT (category, status) DO UPDATE SET count = count + 1;
+        INSERT INTO stats_daily (day, submitted, approved)
+        VALUES (date(new.created_at), 1, new.status = 'approved')
+        ON CONFLICT (day) DO UPDATE SET submitted = submitted + 1, approved = approved + excluded.approved;
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_ads_delete AFTER DELETE ON ads BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'ads:' || COALESCE(old.status, '');
+        UPDATE stats_category_status SET count = count - 1
+        WHERE category = COALESCE(old.category, '') AND status = COALESCE(old.status, '');
+    END
+    ''',
+    '''
+    CREATE TRIGGER IF NOT EXISTS stats_ads_update AFTER UPDATE OF status, category ON ads
+    WHEN old.status IS NOT new.status OR old.category IS NOT new.category BEGIN
+        UPDATE stats_counters SET value = value - 1 WHERE name = 'ads:' || COALESCE(old.status, '');
+        INSERT INTO stats_counters (name, value) VALUES ('ads:' || COALESCE(new.status, ''), 1)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1;
+        UPDATE stats_category_status SET count = count - 1
+        WHERE category = COALESCE(old.category, '') AND status = COALESCE(old.status, '');
+        INSERT INTO stats_category_status (category, status, count)
+        VALUES (COALESCE(new.category, ''), COALESCE(new.status, ''), 1)
+        ON CONFLICT (category, status) DO UPDATE SET count = count + 1;
+        INSERT INTO stats_daily (day, approved)
+        SELECT date('now'), 1 WHERE new.status = 'approved' AND old.status IS NOT 'approved'
+        ON CONFLICT (day) DO UPDATE SET approved = approved + 1;
+        INSERT INTO stats_moderation_minutes (minutes, count)
+        SELECT CAST((julianday('now') - julianday(new.created_at)) * 1440 AS INTEGER), 1
+        WHERE old.status = 'pending' AND new.status IN ('approved', 'rejected')
+        ON CONFLICT (minutes) DO UPDATE SET count = count + 1;
+    END
+    ''',
+)
+
+# Однократное заполнение сводок по уже существующим данным.
+# Дата одобрения старых объявлений неизвестна — берётся дата подачи.
+STATS_BACKFILL = (
+    "INSERT OR REPLACE INTO stats_counters (name, value) SELECT 'users', COUNT(*) FROM users",
+    '''
+    INSERT OR REPLACE INTO stats_counters (name, value)
+    SELECT 'ads:' || COALESCE(status, ''), COUNT(*) FROM ads GROUP BY 1
+    ''',
+    '''
+    INSERT OR REPLACE INTO stats_category_status (category, status, count)
+    SELECT COALESCE(category, ''), COALESCE(status, ''), COUNT(*) FROM ads GROUP BY 1, 2
+    ''',
+    '''
+    INSERT OR REPLACE INTO stats_daily (day, submitted, approved)
+    SELECT date(created_at), COUNT(*), SUM(status = 'approved') FROM ads GROUP BY 1
+    ''',
+)
+
+
+def read_counters(conn, *names):
+    """Значения счётчиков по именам (отсутствующие — 0)"""
+    placeholders = ','.join('?' * len(names))
+    values = dict(conn.execute(
+        f'SELECT name, value FROM stats_counters WHERE name IN ({placeholders})', names
+    ).fetchall())
+    return [values.get(name, 0) for name in names]
+
+
+def _median_minutes(histogram):
+    total = sum(count for _, count in histogram)
+    if not total:
+        return None
+    seen = 0
+    for minutes, count in histogram:
+        seen += count
+        if seen * 2 >= total:
+            return minutes
+
+
+def read_report(conn, days=7, top_terms=10):
+    """Данные расширенного отчёта администратора"""
+    return {
+        'by_category': conn.execute('''
+            SELECT category, status, count FROM stats_category_status
+            WHERE count > 0 ORDER BY category, status
+        ''').fetchall(),
+        'daily': conn.execute('''
+            SELECT day, submitted, approved FROM stats_daily
+            WHERE day >= date('now', ?) ORDER BY day DESC
+        ''', (f'-{days - 1} days',)).fetchall(),
+        'median_moderation_minutes': _median_minutes(conn.execute(
+            'SELECT minutes, count FROM stats_moderation_minutes ORDER BY minutes'
+        ).fetchall()),
+        'top_terms': conn.execute(
+            'SELECT term, count FROM stats_search_terms ORDER BY count DESC LIMIT ?', (top_terms,)
+        ).fetchall(),
+    }
+
+
+def normalize_term(text):
+    return ' '.join((text or '').lower().split())[:MAX_TERM_LENGTH]
+
+
+class SearchTermStats:
+    """Счётчик поисковых запросов: копится в памяти, пишется пакетами"""
+
+    def __init__(self, db, flush_interval=FLUSH_INTERVAL):
+        self.db = db
+        self.flush_interval = flush_interval
+        self._pending = Counter()
+        self._task = None
+
+    def record(self, text):
+        term = normalize_term(text)
+        if term:
+            self._pending[term] += 1
+
+    async def flush(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, Counter()
+        try:
+            await self.db.executemany('''
+                INSERT INTO stats_search_terms (term, count) VALUES (?, ?)
+                ON CONFLICT (term) DO UPDATE SET count = count + excluded.count
+            ''', list(pending.items()))
+        except Exception:
+            self._pending.update(pending)
+            raise
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи статистики поиска: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
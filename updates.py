@@ -0,0 +1,101 @@
+import asyncio
+import sys
+import time
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+# Сколько апдейтов обрабатывается одновременно
+CONCURRENT_UPDATES = 64
+# Лимит для BaseUpdateProcessor: слоты считает PerUserUpdateProcessor
+UNBOUNDED = sys.maxsize
+
+
+def update_key(update):
+    """Ключ упорядочивания: пользователь, иначе чат; None — без упорядочивания"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user is not None:
+        return update.effective_user.id
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Параллельная обработка апдейтов с сохранением порядка внутри пользователя.
+
+    Апдейты разных пользователей обрабатываются одновременно (не больше
+    max_concurrent_updates), апдейты одного пользователя — строго по
+    очереди, так что шаги мастера объявления не обгоняют друг друга.
+    Блокировки живут, пока у пользователя есть апдейты в обработке.
+
+    admission(update) — флуд-контроль до очереди и слота: возвращает
+    задержку в секундах или None, и тогда апдейт выбрасывается.
+
+    Слоты считает собственный семафор, а семафор BaseUpdateProcessor
+    не ограничивает: он занимается раньше do_process_update, и апдейты,
+    ждущие своей очереди или токена, держали бы слоты остальных.
+    """
+
+    def __init__(self, max_concurrent_updates=CONCURRENT_UPDATES, profiler=None, admission=None):
+        super().__init__(UNBOUNDED)
+        if max_concurrent_updates < 1:
+            raise ValueError('max_concurrent_updates должен быть положительным')
+        self.limit = max_concurrent_updates
+        self.profiler = profiler
+        self.admission = admission
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}  # ключ -> [asyncio.Lock, число ожидающих]
+
+    async def do_process_update(self, update, coroutine):
+        """Флуд-контроль, затем очередь пользователя, затем слот"""
+        delay = 0.0
+        if self.admission is not None:
+            delay = self.admission(update)
+            if delay is None:
+                coroutine.close()
+                return
+
+        waiting = time.perf_counter()
+        key = update_key(update)
+        if key is None:
+            await self._run(update, coroutine, delay, waiting)
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                metrics.UPDATE_LOCK_WAIT_SECONDS.observe(time.perf_counter() - waiting)
+                await self._run(update, coroutine, delay, waiting)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def _run(self, update, coroutine, delay, waiting):
+        # Отложенный апдейт дожидается токена в очереди своего пользователя,
+        # сохраняя порядок, но без слота
+        remaining = delay - (time.perf_counter() - waiting)
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                if self.profiler is not None:
+                    await self.profiler.run(update, coroutine)
+                else:
+                    await coroutine
+            finally:
+                metrics.UPDATE_SECONDS.observe(time.perf_counter() - started)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
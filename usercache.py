@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 50000
+# Пауза между пакетными записями и размер пакета, при котором пишем сразу
+FLUSH_INTERVAL = 1.0
+BATCH_SIZE = 500
+
+# Строка обновляется, только если профиль действительно изменился
+UPSERT_SQL = '''
+    INSERT INTO users (user_id, username, first_name, last_name)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (user_id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name
+    WHERE users.username IS NOT excluded.username
+       OR users.first_name IS NOT excluded.first_name
+       OR users.last_name IS NOT excluded.last_name
+'''
+
+
+class KnownUserCache:
+    """LRU известных пользователей с отложенной пакетной записью.
+
+    Ключ — user_id, значение — хеш полей профиля. Если профиль не менялся,
+    база не трогается; новые и изменённые профили копятся в буфере и
+    записываются пакетами в одной транзакции. После записи on_flush
+    получает id пользователей, чьи профили могли измениться.
+    """
+
+    def __init__(self, db, capacity=CACHE_SIZE, flush_interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE, on_flush=None):
+        self.db = db
+        self.on_flush = on_flush
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+        self._known = OrderedDict()  # user_id -> хеш профиля
+        self._pending = {}           # user_id -> (username, first_name, last_name)
+        self._batch_full = asyncio.Event()
+        self._task = None
+
+    def touch(self, user_id, username, first_name, last_name):
+        """Отмечает пользователя; возвращает True, если профиль нужно записать"""
+        profile = (username, first_name, last_name)
+        profile_hash = hash(profile)
+        if self._known.get(user_id) == profile_hash:
+            self._known.move_to_end(user_id)
+            self.hits += 1
+            return False
+
+        self.misses += 1
+        self._known[user_id] = profile_hash
+        self._known.move_to_end(user_id)
+        if len(self._known) > self.capacity:
+            self._known.popitem(last=False)
+
+        self._pending[user_id] = profile
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+        return True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._known),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'pending': len(self._pending),
+        }
+
+    async def flush(self):
+        """Записывает накопленные профили одной транзакцией"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        self._batch_full.clear()
+        rows = [(user_id, *profile) for user_id, profile in pending.items()]
+        try:
+            await self.db.executemany(UPSERT_SQL, rows)
+        except Exception:
+            for user_id, profile in pending.items():
+                self._pending.setdefault(user_id, profile)
+            # Без записи в базе профиль нельзя считать известным
+            for user_id in pending:
+                self._known.pop(user_id, None)
+            raise
+        if self.on_flush is not None:
+            self.on_flush(list(pending))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка записи пользователей: {e}")
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()